@@ -107,6 +107,8 @@ from games import GameManager, GAME_REGISTRY, GAME_CONFIGS
 # 感知模块
 from perception import PerceptionManager, init_screen_processor, get_screen_processor, draw_detection_info
 from perception.perception_integrator import PerceptionIntegrator
+from perception.landmark_service import LandmarkClient
+from perception.frame_bus import CAMERA_BUS, FrameBusReader
 
 # ============================================================================
 # 初始化
@@ -133,8 +135,17 @@ for game_id, game_class in GAME_REGISTRY.items():
     game_manager.register(game_id, game_class, config)
 #print(f"[游戏系统] 已注册游戏: {list(GAME_REGISTRY.keys())}")
 
-# 4. 感知管理器
-perception_manager = PerceptionManager()
+# 4. 感知管理器（人脸框复用 emotion.py 的 FaceMesh 结果，emotion 未运行时回退 Haar）
+# 只在当前处理的帧与 emotion 来自同一摄像头时复用 (帧总线 / 同一路网络摄像头), 本地摄像头时不复用
+landmark_client = LandmarkClient("http://127.0.0.1:5010/api/landmarks").start()
+_face_source_id = None  # 当前处理帧的摄像头标识, 与 emotion 发布的 source 比较; None 为不复用
+
+def _emotion_face_boxes(shape):
+    if _face_source_id is None:
+        return None
+    return landmark_client.face_boxes(shape, source=_face_source_id)
+
+perception_manager = PerceptionManager(face_source=_emotion_face_boxes)
 
 # 5. 行动执行器（使用SystemCore作为状态源）
 action_executor = ActionExecutor(socketio, system_core)
@@ -194,12 +205,57 @@ perception_frame = None
 perception_frame_lock = threading.Lock()
 _last_perception_time = 0
 PERCEPTION_INTERVAL = 0.5  # 500ms处理一次感知，平衡性能和实时性
+# emotion.py 运行时经共享内存帧总线取它的摄像头帧 (直接转发其 JPEG), 否则回退 MJPEG / 本地摄像头;
+# 写方退出或摄像头停顿时心跳过期, connected() 随即为 False
+camera_bus = FrameBusReader(CAMERA_BUS)
+
+def _perception_step(frame, jpeg=None, feet=False):
+    """显示帧始终更新; 感知处理按 PERCEPTION_INTERVAL 限频。jpeg 为该帧已编码的 JPEG (有则不再编码)"""
+    global perception_frame, user_state, _last_perception_time
+    now = time.time()
+    
+    # 视频帧始终更新（用于显示）
+    if jpeg is None:
+        _, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+        jpeg = buf.tobytes()
+    with perception_frame_lock:
+        perception_frame = jpeg
+    
+    # 感知处理按频率限制
+    if now - _last_perception_time < PERCEPTION_INTERVAL:
+        return
+    _last_perception_time = now
+    
+    # 获取屏幕处理器的脚部检测状态
+    feet_detected = False
+    if feet:
+        try:
+            screen_proc = get_screen_processor()
+            if screen_proc:
+                status = screen_proc.get_status()
+                feet_detected = status.get('feet_detected', False)
+        except Exception:
+            pass
+    
+    user_state = perception_manager.process_frame(frame, "tablet", feet_detected=feet_detected)
+    
+    # 更新SystemCore的感知数据
+    system_core.update_perception({
+        'personDetected': user_state.get('environment', {}).get('person_present', False),
+        'personCount': user_state.get('environment', {}).get('person_count', 0),
+        'faceCount': user_state.get('environment', {}).get('person_count', 0),
+        'bodyDetected': user_state.get('body_state', {}).get('posture') != 'unknown',
+        'emotion': user_state.get('emotion', {}).get('primary', 'neutral'),
+        'attention': user_state.get('eye_state', {}).get('attention_score', 0),
+        'fatigue': user_state.get('overall', {}).get('fatigue_level', 0),
+        'activity': user_state.get('body_state', {}).get('posture', 'unknown'),
+    })
 
 def perception_worker():
     """感知处理线程 - 带指数退避重连机制和本地摄像头切换"""
+    global _face_source_id
     import urllib.request
     
-    global perception_frame, user_state, _last_perception_time
     tablet_url = TABLET_VIDEO_URL
     
     #print(f"[感知线程] 启动，连接: {tablet_url}")
@@ -212,10 +268,26 @@ def perception_worker():
     # 本地摄像头切换参数
     use_local_camera = False
     local_camera_cap = None
+    bus_seq = 0
     
     while True:
         try:
-            if not use_local_camera:
+            if camera_bus.connected():
+                if local_camera_cap:
+                    local_camera_cap.release()
+                    local_camera_cap = None
+                use_local_camera = False
+                bf = camera_bus.read(copy=True, after_seq=bus_seq)
+                if bf is None:
+                    time.sleep(0.01)
+                    continue
+                bus_seq = bf.seq
+                # 总线帧就是 emotion 自己的摄像头帧, 沿用它发布的 source
+                landmarks = bf.meta.get('landmarks') if bf.meta else None
+                _face_source_id = landmarks.get('source') if landmarks else None
+                landmark_client.feed(landmarks)
+                _perception_step(bf.frame, bf.jpeg, feet=True)
+            elif not use_local_camera:
                 # 尝试连接网络摄像头
                 stream = urllib.request.urlopen(tablet_url, timeout=5)
                 bytes_data = bytes()
@@ -231,6 +303,7 @@ def perception_worker():
                     local_camera_cap.release()
                     local_camera_cap = None
                     print("[感知线程] 切换回网络摄像头")
+                _face_source_id = tablet_url
                 
                 while True:
                     bytes_data += stream.read(4096)
@@ -246,31 +319,15 @@ def perception_worker():
                         if frame is None or frame.size == 0:
                             continue
                         
-                        now = time.time()
-                        
-                        # 视频帧始终更新（用于显示）
-                        with perception_frame_lock:
-                            _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                            perception_frame = jpeg.tobytes()
+                        _perception_step(frame)
                         
-                        # 感知处理按频率限制
-                        if now - _last_perception_time >= PERCEPTION_INTERVAL:
-                            _last_perception_time = now
-                            user_state = perception_manager.process_frame(frame, "tablet")
-                            
-                            # 更新SystemCore的感知数据
-                            system_core.update_perception({
-                                'personDetected': user_state.get('environment', {}).get('person_present', False),
-                                'personCount': user_state.get('environment', {}).get('person_count', 0),
-                                'faceCount': user_state.get('environment', {}).get('person_count', 0),
-                                'bodyDetected': user_state.get('body_state', {}).get('posture') != 'unknown',
-                                'emotion': user_state.get('emotion', {}).get('primary', 'neutral'),
-                                'attention': user_state.get('eye_state', {}).get('attention_score', 0),
-                                'fatigue': user_state.get('overall', {}).get('fatigue_level', 0),
-                                'activity': user_state.get('body_state', {}).get('posture', 'unknown'),
-                            })
+                        # emotion.py 启动后改走帧总线
+                        if camera_bus.connected():
+                            stream.close()
+                            break
             else:
-                # 使用本地摄像头
+                # 使用本地摄像头 (与 emotion 不是同一画面, 不复用其人脸框)
+                _face_source_id = None
                 if not local_camera_cap:
                     local_camera_cap = cv2.VideoCapture(0)
                     if local_camera_cap.isOpened():
@@ -291,40 +348,7 @@ def perception_worker():
                     print("[感知线程] 本地摄像头读取失败，尝试重新连接网络摄像头")
                     continue
                 
-                now = time.time()
-                
-                # 视频帧始终更新（用于显示）
-                with perception_frame_lock:
-                    _, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                    perception_frame = jpeg.tobytes()
-                
-                # 感知处理按频率限制
-                if now - _last_perception_time >= PERCEPTION_INTERVAL:
-                    _last_perception_time = now
-                    
-                    # 获取屏幕处理器的脚部检测状态
-                    feet_detected = False
-                    try:
-                        screen_proc = get_screen_processor()
-                        if screen_proc:
-                            status = screen_proc.get_status()
-                            feet_detected = status.get('feet_detected', False)
-                    except Exception:
-                        pass
-                    
-                    user_state = perception_manager.process_frame(frame, "tablet", feet_detected=feet_detected)
-                    
-                    # 更新SystemCore的感知数据
-                    system_core.update_perception({
-                        'personDetected': user_state.get('environment', {}).get('person_present', False),
-                        'personCount': user_state.get('environment', {}).get('person_count', 0),
-                        'faceCount': user_state.get('environment', {}).get('person_count', 0),
-                        'bodyDetected': user_state.get('body_state', {}).get('posture') != 'unknown',
-                        'emotion': user_state.get('emotion', {}).get('primary', 'neutral'),
-                        'attention': user_state.get('eye_state', {}).get('attention_score', 0),
-                        'fatigue': user_state.get('overall', {}).get('fatigue_level', 0),
-                        'activity': user_state.get('body_state', {}).get('posture', 'unknown'),
-                    })
+                _perception_step(frame, feet=True)
                 
                 # 本地摄像头模式下，短暂休眠以控制帧率
                 time.sleep(0.033)  # 约30fps
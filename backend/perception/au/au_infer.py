@@ -0,0 +1,129 @@
+# au_infer.py
+# MEFARG AU 网络推理后端: eager PyTorch / ONNX Runtime
+"""
+两个后端接口相同:
+    infer(x) -> (B, 41) float32, sigmoid*100 分数; x 为 preprocess() 输出的 (B, 3, 224, 224)
+前 27 维依次对应 emotion.AU_MAIN。MEFARG.forward 返回单个张量, 子 AU (AUL/AUR) 与原 torch 路径一致不取模型输出。
+
+ONNX 模型由 export_au_onnx.py 导出 (可选动态 batch / INT8 / FP16), sigmoid 已在图内。
+本模块无副作用, 导出脚本和 emotion.py 共用; torch / onnxruntime 只在对应后端构造时导入。
+"""
+import os
+import time
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+AU_INPUT_SIZE = 224
+NUM_MAIN_CLASSES = 27
+NUM_SUB_CLASSES = 14
+_MEAN = np.array([0.485,0.456,0.406], dtype=np.float32)
+_STD = np.array([0.229,0.224,0.225], dtype=np.float32)
+
+
+def preprocess(aligned):
+    """对齐后的 224x224 BGR 人脸 → (1, 3, 224, 224) 归一化 RGB"""
+    img = aligned[:, :, ::-1].astype(np.float32) / 255.0
+    img = (img - _MEAN) / _STD
+    return np.ascontiguousarray(np.transpose(img, (2, 0, 1))[None])
+
+
+def default_threads():
+    """intra-op 线程数默认取一半逻辑核, 留给取帧/FER/姿态线程"""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def load_mefarg(arc='resnet50', ckpt='checkpoints/OpenGprahAU-ResNet50_second_stage.pth', device='cpu'):
+    import torch
+    from au_net.MEFL import MEFARG
+    net = MEFARG(num_main_classes=NUM_MAIN_CLASSES, num_sub_classes=NUM_SUB_CLASSES, backbone=arc)
+    if os.path.exists(ckpt):
+        d = torch.load(ckpt, map_location=device); sd = {k.replace("module.",""): v for k,v in d["state_dict"].items()}
+        net.load_state_dict(sd); print(f"[AU] 权重已加载: {ckpt}")
+    else: print(f"[AU] 权重缺失: {ckpt}")
+    return net.to(device).eval()
+
+
+def score_module(net):
+    """把 sigmoid*100 接在网络后面, 导出时放进 ONNX 图内"""
+    import torch
+
+    class _AUScore(torch.nn.Module):
+        def __init__(self, net):
+            super().__init__()
+            self.net = net
+
+        def forward(self, x):
+            return torch.sigmoid(self.net(x)) * 100
+
+    return _AUScore(net).eval()
+
+
+class TorchAUBackend:
+    name = 'torch'
+
+    def __init__(self, arc='resnet50', ckpt='checkpoints/OpenGprahAU-ResNet50_second_stage.pth', device=None):
+        import torch
+        self._torch = torch
+        self.dev = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.net = load_mefarg(arc, ckpt, self.dev)
+        self.model = score_module(self.net)
+
+    def infer(self, x):
+        torch = self._torch
+        t = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32)).to(self.dev)
+        with torch.no_grad(): out = self.model(t)
+        return out.cpu().numpy()
+
+
+class OnnxAUBackend:
+    name = 'onnx'
+
+    def __init__(self, path, threads=0):
+        import onnxruntime as ort
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        so.intra_op_num_threads = threads or default_threads()
+        so.inter_op_num_threads = 1
+        self.path = path
+        self.threads = so.intra_op_num_threads
+        self.sess = ort.InferenceSession(path, so, providers=['CPUExecutionProvider'])
+        inp = self.sess.get_inputs()[0]
+        self.input_name = inp.name
+        # 导出时未开动态 batch 的模型只能逐张推理
+        self.dynamic_batch = not isinstance(inp.shape[0], int)
+        print(f"[AU] ONNX 后端: {os.path.basename(path)}, 线程 {self.threads}, 动态batch {self.dynamic_batch}")
+
+    def infer(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if self.dynamic_batch or len(x) == 1:
+            return self.sess.run(None, {self.input_name: x})[0].astype(np.float32, copy=False)
+        return np.concatenate([self.sess.run(None, {self.input_name: x[i:i+1]})[0]
+                               for i in range(len(x))]).astype(np.float32, copy=False)
+
+
+def compare_backends(ref, other, x):
+    """同一输入下两个后端的分数差 (sigmoid*100 刻度), 只统计 emotion 实际使用的前 27 维"""
+    a = ref.infer(x)[:, :NUM_MAIN_CLASSES]
+    b = other.infer(x)[:, :NUM_MAIN_CLASSES]
+    diff = np.abs(a - b)
+    return {
+        "samples": int(len(x)),
+        "max_abs": round(float(diff.max()), 4),
+        "mean_abs": round(float(diff.mean()), 4),
+        "p99_abs": round(float(np.percentile(diff, 99)), 4),
+        # 每个样本分数最高的 AU 是否一致
+        "top1_agree": round(float(np.mean(a.argmax(axis=1) == b.argmax(axis=1))), 4),
+    }
+
+
+def bench(backend, x, n=20, warmup=3):
+    """单样本推理耗时 (ms): 均值 / p50 / p95"""
+    for _ in range(warmup): backend.infer(x)
+    ms = []
+    for _ in range(n):
+        t0 = time.perf_counter(); backend.infer(x); ms.append((time.perf_counter() - t0) * 1000.0)
+    ms = np.array(ms)
+    return {"mean": round(float(ms.mean()), 2), "p50": round(float(np.percentile(ms, 50)), 2),
+            "p95": round(float(np.percentile(ms, 95)), 2)}
@@ -1,7 +1,8 @@
 # emotion.py
 import os, time, threading, json, base64
 import numpy as np
-from collections import deque
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 import sys
 import logging
 from datetime import datetime
@@ -13,14 +14,16 @@ logging.basicConfig(level=logging.CRITICAL)
 os.environ["FLASK_SKIP_DOTENV"] = "1"
 os.chdir(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # perception/: landmark_service
 
 import cv2
-import torch
-import mediapipe as mp
 from flask import Flask, Response, jsonify, request
 from sixdrepnet import SixDRepNet
-from au_net.MEFL import MEFARG
+from au_infer import AU_INPUT_SIZE, OnnxAUBackend, TorchAUBackend, preprocess
 from emotion_logger import EmotionLogger
+from landmark_service import LandmarkService
+from frame_bus import ALIGNED_BUS, CAMERA_BUS, FrameBusWriter
+from infer_scheduler import DeadlineExceeded, InferenceScheduler
 
 # ── Constants ──────────────────────────────────────────────
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -30,14 +33,16 @@ FRONTEND_CORE_DIR = os.path.join(PROJECT_ROOT, 'frontend', 'core')
 os.makedirs(FRONTEND_CORE_DIR, exist_ok=True)
 
 CALIB_N = 30
+# 样本数类参数 (CALIB_N、personal_baseline_*_samples、情绪平滑 history、校准最少样本) 按 AU 结果频率 AU_REF_HZ 标定
+# (personal_baseline_min_samples 30 ≈ 15 秒), FERSmoother 窗口按 FER_REF_HZ 标定; 实际频率不同时按比例换算, 保持时间跨度不变
+AU_REF_HZ = 2.0
+FER_REF_HZ = 5.0
 AU_MAIN = ['AU1','AU2','AU4','AU5','AU6','AU7','AU9','AU10','AU11','AU12','AU13','AU14','AU15','AU16','AU17','AU18','AU19','AU20','AU22','AU23','AU24','AU25','AU26','AU27','AU32','AU38','AU39']
 AU_SUB = ['AUL1','AUR1','AUL2','AUR2','AUL4','AUR4','AUL6','AUR6','AUL10','AUR10','AUL12','AUR12','AUL14','AUR14']
 AU_SHOW = ['AU12','AU6','AU25','AU7','AU5','AU15','AU4','AU17','AU1','AU9']
 AU_LABEL = {'AU12':'嘴角上拉','AU6':'颧骨提升','AU25':'嘴唇分开','AU7':'眼睑收紧','AU5':'上睑抬起','AU15':'嘴角下拉','AU4':'皱眉','AU17':'下巴上提','AU1':'内眉上抬','AU9':'鼻皱'}
 _s = 224.0 / 96.0
 ALIGN_DST = np.array([[38.2946,51.6963],[73.5318,51.5014],[56.0252,71.7366],[41.5493,92.3655],[70.7299,92.2041]], dtype=np.float32) * _s
-_MEAN = np.array([0.485,0.456,0.406], dtype=np.float32)
-_STD = np.array([0.229,0.224,0.225], dtype=np.float32)
 MP5 = [33, 263, 1, 61, 291]
 KP_IDX = [1,33,133,159,145,263,362,386,374,61,291,13,14,152,105,334,55,285]
 POSES = ['front', 'up', 'down', 'side_left', 'side_right']
@@ -45,6 +50,12 @@ EMOTIONS = ['neutral', 'positive', 'negative']
 AU_HAPPY = ['AU12', 'AU6', 'AU25']
 AU_SAD = ['AU15', 'AU4', 'AU1', 'AU17']
 
+# 共享内存帧总线: 原始帧 (+JPEG +关键点) 和对齐人脸供同机进程零拷贝读取, 替代 MJPEG/HTTP 取帧
+FRAME_BUS = True
+# 微批推理调度: 提交后超过该时长仍未开始推理的样本直接丢弃 (秒)
+AU_DEADLINE = 1.0
+FER_DEADLINE = 1.0
+
 FER_MODEL_PATH = os.path.join(SCRIPT_DIR, "pretrain_models", "emotion-ferplus-8.onnx")
 FER_LABELS_8 = ["neutral", "happiness", "surprise", "sadness", "anger", "disgust", "fear", "contempt"]
 # FER+ 8类到3类的语义映射（用于概率池化）
@@ -53,22 +64,18 @@ FER_MAP_8_TO_3 = {
     "sadness": "negative", "anger": "negative", "disgust": "negative", "fear": "negative", "contempt": "neutral"
 }
 
+def _rate_interval(hz):
+    return 1.0 / hz if hz and hz > 0 else 0.0
+
+def _done_future(value):
+    f = Future(); f.set_result(value); return f
+
 def softmax(x):
     e = np.exp(x - np.max(x))
     return e / (e.sum() + 1e-10)
 
 # ── [保持不变] AU 原有组件 ──────────────────────────────
-class FaceDetector:
-    def __init__(self):
-        self.fm = mp.solutions.face_mesh.FaceMesh(static_image_mode=False, max_num_faces=5, refine_landmarks=True, min_detection_confidence=0.5, min_tracking_confidence=0.5)
-    def process(self, frame):
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        r = self.fm.process(rgb)
-        if not r.multi_face_landmarks: return []
-        h, w = frame.shape[:2]
-        return [np.array([[p.x*w, p.y*h, p.z*w] for p in fl.landmark]) for fl in r.multi_face_landmarks]
-    def release(self): self.fm.close()
-
+# 人脸检测由 landmark_service.LandmarkService 统一完成 (整个进程只有一个 FaceMesh)
 class SpeechDetector:
     def __init__(self):
         self.lip_open_history = deque(maxlen=50)
@@ -183,42 +190,30 @@ class FaceSelector:
 
 class PoseEstimator:
     def __init__(self): self.model = SixDRepNet()
-    def estimate(self, frame, lm):
-        if lm is None: return 0.,0.,0.
-        h, w = frame.shape[:2]; xs, ys = lm[:,0], lm[:,1]
-        x0,x1 = int(xs.min()),int(xs.max()); y0,y1 = int(ys.min()),int(ys.max())
-        m=0.3; bw=max(x1-x0,1); bh=max(y1-y0,1)
-        x0=max(0,int(x0-bw*m)); x1=min(w,int(x1+bw*m)); y0=max(0,int(y0-bh*m)); y1=min(h,int(y1+bh*m))
-        crop = frame[y0:y1, x0:x1]
-        if crop.size==0 or crop.shape[0]<20: return 0.,0.,0.
-        crop = cv2.resize(crop,(480,480), interpolation=cv2.INTER_LANCZOS4)
+    def estimate(self, crop):
+        # crop: AlignedFace.pose() 的 480x480 人脸裁剪, None 时返回 0
+        if crop is None: return 0.,0.,0.
         p,y,r = self.model.predict(crop)
         return float(np.asarray(p).item()),float(np.asarray(y).item()),float(np.asarray(r).item())
 
 class AUExtractor:
-    def __init__(self, arc='resnet50', ckpt='checkpoints/OpenGprahAU-ResNet50_second_stage.pth'):
-        self.sz = 224; self.dev = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.net = MEFARG(num_main_classes=27, num_sub_classes=14, backbone=arc)
-        if os.path.exists(ckpt):
-            d = torch.load(ckpt, map_location=self.dev); sd = {k.replace("module.",""): v for k,v in d["state_dict"].items()}
-            self.net.load_state_dict(sd); print(f"[AU] 权重已加载: {ckpt}")
-        else: print(f"[AU] 权重缺失: {ckpt}")
-        self.net.to(self.dev).eval()
-    def _align(self, frame, lm):
-        src = np.array([lm[i][:2] for i in MP5], dtype=np.float32); M = cv2.estimateAffinePartial2D(src, ALIGN_DST)[0]
-        if M is None: return None
-        return cv2.warpAffine(frame, M, (self.sz, self.sz), flags=cv2.INTER_LANCZOS4)
-    def predict(self, frame, lm):
-        if lm is None: return None
-        aligned = self._align(frame, lm)
+    # backend: 'torch' 或 'onnx' (export_au_onnx.py 导出的模型), ONNX 不可用时回退 torch
+    def __init__(self, arc='resnet50', ckpt='checkpoints/OpenGprahAU-ResNet50_second_stage.pth', backend='torch', onnx_path=None, threads=0):
+        self.backend = None
+        if backend == 'onnx':
+            if onnx_path and os.path.exists(onnx_path):
+                try: self.backend = OnnxAUBackend(onnx_path, threads)
+                except Exception as ex: print(f"[AU] ONNX 后端加载失败: {ex}, 回退到 torch")
+            else: print(f"[AU] ONNX 模型缺失: {onnx_path}, 回退到 torch")
+        if self.backend is None: self.backend = TorchAUBackend(arc, ckpt)
+    def predict(self, aligned):
+        # aligned: AlignedFace.au() 的 224x224 对齐人脸
         if aligned is None: return None
-        img = cv2.cvtColor(aligned, cv2.COLOR_BGR2RGB).astype(np.float32)/255.0
-        img = (img - _MEAN) / _STD; img = np.transpose(img, (2,0,1))[None]
-        t = torch.from_numpy(img).float().to(self.dev)
-        with torch.no_grad(): out = self.net(t)
-        if isinstance(out, (tuple,list)):
-            mp_ = torch.sigmoid(out[0]).cpu().numpy()[0]*100; sp_ = torch.sigmoid(out[1]).cpu().numpy()[0]*100 if len(out)>1 else np.zeros(14)
-        else: mp_ = torch.sigmoid(out).cpu().numpy()[0]*100; sp_ = np.zeros(14)
+        return self.to_scores(self.backend.infer(preprocess(aligned))[0])
+    @staticmethod
+    def to_scores(mp_):
+        # 模型输出的一行 (sigmoid*100) → {AU: 分数}; 子 AU 模型不输出, 保持为 0
+        sp_ = np.zeros(14)
         r = {}
         for i,n in enumerate(AU_MAIN): r[n] = float(mp_[i])
         for i,n in enumerate(AU_SUB): r[n] = float(sp_[i])
@@ -226,6 +221,7 @@ class AUExtractor:
 
 class EmotionMapper:
     def __init__(self, history=15, persist_path=None):
+        self.history = history; self.rate_scale = 1.0  # 实际 AU 结果频率 / AU_REF_HZ, 由 EmotionEngine 更新
         # 系统基线：4*3（现在的baselines改名为system_baselines）
         self.system_baselines = {p: {e: None for e in EMOTIONS} for p in POSES}
         # 个人基线：在线学习的neutral
@@ -245,7 +241,21 @@ class EmotionMapper:
             'verify_boost_factor': 1.15,  # 佐证匹配时的置信度提升
             'verify_reduce_factor': 0.85,  # 佐证不匹配时的置信度降低
             'personal_baseline_min_samples': 30,  # 启动个人基线需要的最小样本数（约15秒）
-            'personal_baseline_max_samples': 200  # 个人基线最大保存样本数
+            'personal_baseline_max_samples': 200,  # 个人基线最大保存样本数
+            # AU 推理后端: 'torch' / 'onnx'（模型由 export_au_onnx.py 导出），修改后重建 AUExtractor
+            'au_backend': 'torch',
+            'au_onnx_path': 'checkpoints/au_resnet50.onnx',
+            'au_onnx_threads': 0,  # onnxruntime intra-op 线程数，0 为自动
+            # 微批调度 (AU / FER+ 共用): 模型空闲即送入已排队的样本, 推理期间到达的样本凑成下一批 (至多 infer_max_batch);
+            # infer_max_batch 同时是在途检测帧上限, 低于上限且不超过 au_rate_hz / fer_rate_hz 时提交新帧; infer_max_wait_ms > 0 时首个样本额外等待凑批
+            'infer_max_batch': 8,
+            'infer_max_wait_ms': 0,
+            # 检测 / 推理频率上限 (Hz), 在调度器背压之外再限一层, 控制 CPU; 0 为只受背压限制
+            'au_rate_hz': 5.0,
+            'fer_rate_hz': 5.0,
+            'au_all_faces': False,  # 多人时其余人脸也做 AU（结果在 au_result['faces']）
+            # AU / 姿态裁剪的插值: lanczos4（原效果）/ cubic / linear，linear 明显更省 CPU（warpAffine 不支持 area，故不提供）
+            'align_interp': 'lanczos4'
         }
         self.last_emotion = 'neutral'; self.switch_cnt = 0
         self.persist_path = persist_path or os.path.join(os.path.dirname(__file__),'config.json')
@@ -302,7 +312,7 @@ class EmotionMapper:
         self.calibrating = (pose, emotion); self.buffers[f"{pose}_{emotion}"] = []; return True
     def finish_calib(self, pose, emotion):
         key = f"{pose}_{emotion}"; buf = self.buffers.get(key, [])
-        if len(buf) < 20: self.calibrating = None; return False
+        if len(buf) < self.n(20): self.calibrating = None; return False
         keys = list(buf[0].keys())
         mu = {k: float(np.mean([f[k] for f in buf])) for k in keys}
         sigma = {k: max(float(np.std([f[k] for f in buf])), 0.1) for k in keys}
@@ -329,6 +339,9 @@ class EmotionMapper:
         if key not in self.buffers: self.buffers[key] = []
         self.buffers[key].append(au)
         return len(self.buffers[key])
+    def n(self, count):
+        """AU_REF_HZ 下标定的样本数换算到实际结果频率"""
+        return max(1, int(round(count * self.rate_scale)))
     def get_calibrated(self): return {p: [e for e in EMOTIONS if self.system_baselines[p][e]] for p in POSES}
     def update_personal_baseline(self, au, pitch, yaw, is_calm=False):
         # 只记录正脸（pitch不太低，yaw不太大）
@@ -345,7 +358,7 @@ class EmotionMapper:
             return False
         
         # 只有连续平静帧才采集样本
-        calm_threshold = 5  # 需要连续5帧平静
+        calm_threshold = self.n(5)  # 需要连续5帧平静 (AU_REF_HZ 下)
         if is_calm:
             self.consecutive_calm_frames += 1
             if self.consecutive_calm_frames < calm_threshold:
@@ -357,11 +370,11 @@ class EmotionMapper:
         # 保存样本
         self.personal_baseline_samples.append(au.copy())
         # 限制最大样本数
-        max_samples = self.config.get('personal_baseline_max_samples', 200)
+        max_samples = self.n(self.config.get('personal_baseline_max_samples', 200))
         if len(self.personal_baseline_samples) > max_samples:
             self.personal_baseline_samples = self.personal_baseline_samples[-max_samples:]
         # 如果有足够样本，计算平均mu和sigma
-        min_samples = self.config.get('personal_baseline_min_samples', 30)
+        min_samples = self.n(self.config.get('personal_baseline_min_samples', 30))
         if len(self.personal_baseline_samples) >= min_samples:
             # 获取所有样本中共同的AU键
             all_keys = set()
@@ -583,6 +596,7 @@ class EmotionMapper:
             if self.switch_cnt < 2: best = self.last_emotion
             else: best = raw; self.last_emotion = raw; self.switch_cnt = 0
         else: self.switch_cnt = 0; best = raw
+        if self.hist.maxlen != self.n(self.history): self.hist = deque(self.hist, maxlen=self.n(self.history))
         self.hist.append(scores)
         smooth = {e: float(np.mean([x[e] for x in self.hist])) for e in EMOTIONS}
         return pose, best, smooth[best], smooth
@@ -595,13 +609,33 @@ class FERDetector:
             self.net = cv2.dnn.readNetFromONNX(model_path)
             self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
             self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self._batch_ok = True   # 模型不支持 batch 维时退回逐张前向
+
+    def blob(self, aligned_64):
+        return cv2.cvtColor(aligned_64, cv2.COLOR_BGR2GRAY).astype(np.float32).reshape(1, 64, 64)
+
+    def forward_batch(self, blobs):
+        # (N, 1, 64, 64) → (N, 8) 原始分数, 供 InferenceScheduler 调用
+        if self._batch_ok and len(blobs) > 1:
+            try:
+                self.net.setInput(blobs); out = self.net.forward()
+                if len(out) == len(blobs): return out
+            except cv2.error: pass
+            self._batch_ok = False; print("[FER] 模型不支持批量前向, 改为逐张")
+        out = []
+        for b in blobs: self.net.setInput(b[None]); out.append(self.net.forward()[0])
+        return np.stack(out)
 
     def predict(self, aligned_64):
         if self.net is None: return "neutral", 0.0, np.zeros(8)
+        try: return self.decode(self.forward_batch(self.blob(aligned_64)[None])[0])
+        except Exception: return "neutral", 0.0, np.zeros(8)
+
+    def decode(self, scores):
+        # 原始分数 → (3类标签, 置信度, 8类概率); scores 为 None (无模型/推理失败) 时为中性 0
+        if scores is None: return "neutral", 0.0, np.zeros(8)
         try:
-            gray = cv2.cvtColor(aligned_64, cv2.COLOR_BGR2GRAY)
-            blob = gray.astype(np.float32).reshape(1, 1, 64, 64)
-            self.net.setInput(blob); scores = self.net.forward()[0]; probs = softmax(scores)
+            probs = softmax(scores)
             
             # 概率池化：直接把8类概率按语义合并成3类
             probs_3 = {
@@ -620,31 +654,71 @@ class FERDetector:
             return label_3, float(conf_3), probs
         except Exception as e: return "neutral", 0.0, np.zeros(8)
 
-class FERAligner:
-    def __init__(self):
-        self.mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=False, max_num_faces=1, refine_landmarks=False, min_detection_confidence=0.5, min_tracking_confidence=0.5)
-    def align(self, frame):
-        h, w = frame.shape[:2]; rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        try: res = self.mesh.process(rgb)
-        except Exception: return None
-        if not res.multi_face_landmarks: return None
-        lm = res.multi_face_landmarks[0].landmark
-        left = np.array([lm[33].x * w, lm[33].y * h]); right = np.array([lm[263].x * w, lm[263].y * h])
-        angle = np.degrees(np.arctan2(right[1]-left[1], right[0]-left[0]))
-        center = ((left[0]+right[0])/2, (left[1]+right[1])/2)
-        rot = cv2.getRotationMatrix2D(center, angle, 1.0)
-        rotated = cv2.warpAffine(frame, rot, (w, h), borderValue=(0,0,0))
-        xs = [p.x * w for p in lm]; ys = [p.y * h for p in lm]
-        bx1, by1 = min(xs), min(ys); bx2, by2 = max(xs), max(ys)
-        pad = int(max(bx2-bx1, by2-by1) * 0.3)
-        cx1, cy1 = max(0, int(bx1 - pad)), max(0, int(by1 - pad))
-        cx2, cy2 = min(w, int(bx2 + pad)), min(h, int(by2 + pad))
-        crop = rotated[cy1:cy2, cx1:cx2]
-        if crop.size == 0: return None
-        return cv2.resize(crop, (64, 64))
+# ── 对齐缓存: 每个 (帧 seq, 人脸) 只估计一次变换, AU / FER+ / 姿态裁剪都由它派生 ──
+INTERP = {'lanczos4': cv2.INTER_LANCZOS4, 'cubic': cv2.INTER_CUBIC, 'linear': cv2.INTER_LINEAR}  # AU 裁剪走 warpAffine, 不支持 INTER_AREA
+
+class AlignedFace:
+    # M: 原图 → 224 对齐空间的五点相似变换; 各裁剪首次取用时生成并缓存
+    def __init__(self, frame, lm, interp=cv2.INTER_LANCZOS4):
+        self.frame = frame; self.lm = lm; self.interp = interp; self._crops = {}
+        src = np.array([lm[i][:2] for i in MP5], dtype=np.float32); self.M = cv2.estimateAffinePartial2D(src, ALIGN_DST)[0]
+    def _crop(self, key, make):
+        if key not in self._crops: self._crops[key] = make()
+        return self._crops[key]
+    def au(self):
+        # 224x224 AU 输入
+        if self.M is None: return None
+        return self._crop('au', lambda: cv2.warpAffine(self.frame, self.M, (AU_INPUT_SIZE, AU_INPUT_SIZE), flags=self.interp))
+    def fer(self):
+        # 64x64 FER+ 输入: 对齐空间 (双眼水平) 中关键点外接框外扩 30%, 与 M 合成后一次 warp, 不再整帧旋转
+        if self.M is None: return None
+        def make():
+            pts = self.lm[:, :2] @ self.M[:, :2].T + self.M[:, 2]
+            (x1, y1), (x2, y2) = pts.min(0), pts.max(0); pad = max(x2-x1, y2-y1) * 0.3
+            sx = 64.0 / (x2-x1+2*pad); sy = 64.0 / (y2-y1+2*pad)
+            S = np.array([[sx, 0, -(x1-pad)*sx], [0, sy, -(y1-pad)*sy], [0, 0, 1]])
+            return cv2.warpAffine(self.frame, (S @ np.vstack([self.M, [0, 0, 1]]))[:2], (64, 64), flags=cv2.INTER_LINEAR)
+        return self._crop('fer', make)
+    def pose(self):
+        # 480x480 SixDRepNet 输入: 原图外接框外扩 30% (不旋转, 否则 roll 被对齐掉); 人脸过小时为 None
+        def make():
+            h, w = self.frame.shape[:2]; xs, ys = self.lm[:,0], self.lm[:,1]
+            x0,x1 = int(xs.min()),int(xs.max()); y0,y1 = int(ys.min()),int(ys.max())
+            m=0.3; bw=max(x1-x0,1); bh=max(y1-y0,1)
+            x0=max(0,int(x0-bw*m)); x1=min(w,int(x1+bw*m)); y0=max(0,int(y0-bh*m)); y1=min(h,int(y1+bh*m))
+            crop = self.frame[y0:y1, x0:x1]
+            if crop.size==0 or crop.shape[0]<20: return None
+            return cv2.resize(crop,(480,480), interpolation=self.interp)
+        return self._crop('pose', make)
+
+class AlignCache:
+    # (帧 seq, 人脸下标) → AlignedFace, au_loop 与 fer_loop 共用; interp 由配置 align_interp 决定
+    def __init__(self, size=16):
+        self._d = OrderedDict(); self._lock = threading.Lock(); self.size = size
+        self.interp = cv2.INTER_LANCZOS4; self.hits = 0; self.misses = 0
+    def get(self, frame, seq, idx, lm):
+        key = (seq, idx)
+        with self._lock:
+            af = self._d.get(key)
+            if af is not None: self.hits += 1; self._d.move_to_end(key); return af
+            self.misses += 1; af = AlignedFace(frame, lm, self.interp); self._d[key] = af
+            while len(self._d) > self.size: self._d.popitem(last=False)
+        return af
+    def stats(self): return {'hits': self.hits, 'misses': self.misses, 'cached': len(self._d)}
+
+class RateMeter:
+    """结果频率 (Hz) 的 EMA 估计; 间隔超过 max_gap (无人脸 / 停顿) 时不计入"""
+    def __init__(self, ref_hz, alpha=0.1, max_gap=5.0): self.hz = ref_hz; self.alpha = alpha; self.max_gap = max_gap; self._last = None
+    def tick(self):
+        now = time.monotonic()
+        if self._last is not None and 0 < now - self._last < self.max_gap: self.hz += self.alpha * (1.0 / (now - self._last) - self.hz)
+        self._last = now; return self.hz
 
 class FERSmoother:
-    def __init__(self, window=10): self.window = deque(maxlen=window)
+    def __init__(self, window=10): self.base = window; self.window = deque(maxlen=window)
+    def rescale(self, scale):
+        n = max(1, int(round(self.base * scale)))
+        if n != self.window.maxlen: self.window = deque(self.window, maxlen=n)
     def update(self, label, probs_3):
         self.window.append((label, probs_3))
         if not self.window: return "neutral", 0.0, {'neutral':0, 'positive':0, 'negative':0}
@@ -672,26 +746,42 @@ class EmotionEngine:
         self.camera_status = "connecting"  # connecting / connected / disconnected
         
         # AU 组件
-        self.det = FaceDetector()
+        self.landmarks = LandmarkService(max_faces=5, refine=True)
+        self.landmarks.source = str(self.camera_url)  # 随检测结果发布, 其他进程据此确认人脸框属于同一摄像头
         self.face_sel = FaceSelector()
         self.speech_det = SpeechDetector()
         self.pose_est = PoseEstimator()
-        self.au_ext = AUExtractor()
         persist = os.path.join(os.path.dirname(__file__),'config.json')
         self.mapper = EmotionMapper(history=50, persist_path=persist)
+        self.au_ext = self._make_au_extractor()
+        self.align_cache = AlignCache(); self.align_cache.interp = INTERP.get(self.mapper.config.get('align_interp', 'lanczos4'), cv2.INTER_LANCZOS4)
         
         # FER+ 组件（窗口增大到20以适应更低的推理频率）
-        self.fer_det = FERDetector(); self.fer_align = FERAligner(); self.fer_smoother = FERSmoother(window=10)
+        self.fer_det = FERDetector(); self.fer_smoother = FERSmoother(window=10)
+        self.au_rate = RateMeter(AU_REF_HZ); self.fer_rate = RateMeter(FER_REF_HZ)
+        
+        # 微批推理调度: batch_fn 在调用时取当前的 au_ext (配置切换后端时会替换)
+        mc = self.mapper.config
+        self.au_sched = InferenceScheduler('au', lambda x: self.au_ext.backend.infer(x), mc.get('infer_max_batch', 8), mc.get('infer_max_wait_ms', 0) / 1000.0)
+        self.fer_sched = InferenceScheduler('fer', self.fer_det.forward_batch, mc.get('infer_max_batch', 8), mc.get('infer_max_wait_ms', 0) / 1000.0)
         
         # Intentionally lock-free: CPython reference assignment is atomic.
         # Both threads may process slightly different frames (≤1 frame drift).
         # Acceptable because each channel has its own smoothing window.
-        self.raw_frame = None
+        # frame_packet = (seq, ts, frame), 整体替换; seq 用于 LandmarkService 的逐帧缓存
+        self.raw_frame = None; self.frame_seq = 0; self.frame_packet = None
         self.last_landmarks = None  # 保存最新的人脸关键点
+        # 摄像头帧总线按实际采集分辨率在首帧创建 (_camera_bus_for), 不预留 1080p
+        self.camera_bus = self.aligned_bus = None; self._camera_bus_ok = FRAME_BUS
+        self._bus_meta_key = None; self._bus_meta = None
+        if FRAME_BUS:
+            try:
+                self.aligned_bus = FrameBusWriter(ALIGNED_BUS, max_shape=(AU_INPUT_SIZE, AU_INPUT_SIZE, 3), slots=2, jpeg_capacity=0)
+            except Exception as e: print(f"[FrameBus] 共享内存创建失败, 仅保留 HTTP 接口: {e}")
         
         self.lock = threading.Lock(); self.running = False
         self.annotated = None
-        self.t0 = time.time(); self._fc_au = 0; self._fc_fer = 2
+        self.t0 = time.time(); self._fc_au = 0
         
         self.au_result = {'emotion':'no_face','confidence':0.,'scores':{'neutral':0,'positive':0,'negative':0},'pose':'-','pitch':0,'yaw':0,'roll':0,'au':{},'speaking':False,'calibrating':False,'calib_pose':None,'calib_emotion':None,'calib_count':0,'personal_samples':0,'personal_ready':False,'engagement':'None','face_detected':False,'face_count':0}
         self.fer_result = {'label':'neutral','conf':0.0,'probs_3':{'neutral':0,'positive':0,'negative':0},'has_face':False}
@@ -730,7 +820,9 @@ class EmotionEngine:
         else:
             current_eng = "None"
         
-        # 4. 时间平滑 (重要：防止数值抖动)
+        # 4. 时间平滑 (重要：防止数值抖动); 窗口按实际检测频率换算
+        n = self.mapper.n(15)
+        if self.engagement_buffer.maxlen != n: self.engagement_buffer = deque(self.engagement_buffer, maxlen=n)
         self.engagement_buffer.append(current_eng)
         # 取最近 15 帧出现频率最高的作为最终状态
         if len(self.engagement_buffer) > 0:
@@ -795,13 +887,18 @@ class EmotionEngine:
                 self.camera_status = "connected"
                 
                 # 直接保存原始帧，不做任何绘制
+                self.frame_seq += 1
+                self.frame_packet = (self.frame_seq, time.time(), frame)
                 self.raw_frame = frame
                 
                 # 视频流直接传输原始画面（无任何绘制）
                 r, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+                jpeg = buf.tobytes() if r else None
                 if r:
                     with self.lock:
-                        self.annotated = buf.tobytes()
+                        self.annotated = jpeg
+                bus = self._camera_bus_for(frame)
+                if bus is not None: bus.write(frame, self.frame_packet[1], jpeg=jpeg, meta=self._frame_meta())
                 
                 # 快照逻辑：情绪变化立即捕捉，否则0.5s捕捉一次（快照带标注）
                 now = time.time()
@@ -854,12 +951,15 @@ class EmotionEngine:
                 time.sleep(0.1)
 
     def au_loop(self):
+        pending = deque()   # 已提交 AU 推理、待收尾的检测帧, 按提交顺序处理
+        last_seq = None; next_t = 0.0
         lm_cache = None
         current_speaking = False
         last_yaw = 0
         while self.running:
-            frame = self.raw_frame
-            if frame is not None:
+            packet = self.frame_packet
+            if packet is not None:
+                seq, ts, frame = packet
                 self._fc_au += 1
                 
                 # 高频说话检测
@@ -887,17 +987,25 @@ class EmotionEngine:
                             res.update(emotion='speaking')
                         self.au_result = res
                 
-                # 低频重推理
-                if self._fc_au % 10 == 1:
-                    lm_list = self.det.process(frame)
+                # 调度器完成的 AU 推理按提交顺序收尾 (推理不阻塞本循环, 积压的帧在调度器里合批)
+                while pending and all(f.done() for f in self._au_futures(pending[0])):
+                    self._finish_au(pending.popleft())
+                
+                # 按调度器背压重推理: 新帧、在途检测帧未达 infer_max_batch 且不超过 au_rate_hz 时检测并提交, 模型跟不上时自然降频
+                now_m = time.monotonic()
+                if seq != last_seq and len(pending) < self.au_sched.max_batch and now_m >= next_t:
+                    last_seq = seq; next_t = now_m + _rate_interval(self.mapper.config.get('au_rate_hz', 5.0))
+                    ff = self.landmarks.process(frame, seq, ts)
+                    lm_list = [f.lm for f in ff.faces]
                     lm = self.face_sel.select(lm_list, frame.shape) if lm_list else None
+                    if lm is not None:
+                        pi = next(i for i, x in enumerate(lm_list) if x is lm)
+                        self.landmarks.annotate(ff, primary=pi)
                     lm_cache = lm
                     self.last_landmarks = lm
-                    res = dict(self.au_result)
                     
                     # 更新face_count和face_detected
-                    res['face_count'] = len(lm_list) if lm_list else 0
-                    res['face_detected'] = lm is not None
+                    job = {'fut': None, 'face_count': len(lm_list) if lm_list else 0, 'face_detected': lm is not None, 'others': []}
                     
                     if lm is not None:
                         speaking = current_speaking
@@ -911,75 +1019,151 @@ class EmotionEngine:
                         if has_clear_fer_emotion:
                             speaking = False
                         
-                        pitch, yaw, roll = self.pose_est.estimate(frame, lm)
+                        # 一次对齐 (按帧 seq + 人脸缓存), 姿态 / AU / FER+ 的裁剪都从这里取
+                        af = self.align_cache.get(frame, seq, pi, lm)
+                        pitch, yaw, roll = self.pose_est.estimate(af.pose())
+                        self.landmarks.annotate(ff, pose=(pitch, yaw, roll))
                         last_yaw = yaw
-                        au = self.au_ext.predict(frame, lm)
                         
-                        # 保存对齐后的人脸图像供外部模块使用
-                        aligned_face = self.au_ext._align(frame, lm)
+                        # 保存对齐后的人脸图像供外部模块使用, 同一张对齐图提交 AU 推理
+                        aligned_face = af.au()
                         if aligned_face is not None:
                             self.last_aligned_face = aligned_face
+                            self.landmarks.annotate(ff, aligned=aligned_face)
+                            bus = self.aligned_bus
+                            if bus is not None: bus.write(aligned_face, ts, meta={'frame_seq': seq})
+                            job['fut'] = self.au_sched.submit(preprocess(aligned_face)[0], time.monotonic() + AU_DEADLINE)
+                        
+                        # 多人场景: 其余人脸一并提交, 与主受试者同批推理 (只出 AU, 不做情绪映射)
+                        if self.mapper.config.get('au_all_faces', False):
+                            for j, f in enumerate(ff.faces):
+                                if j == pi: continue
+                                a = self.align_cache.get(frame, seq, j, f.lm).au()
+                                if a is not None: job['others'].append(([int(v) for v in f.bbox], self.au_sched.submit(preprocess(a)[0], time.monotonic() + AU_DEADLINE)))
                         
                         # 估算专注度（基于头部姿态）
                         # 注意：这里暂时只用姿态估算，因为需要更复杂的视线追踪才能获取iris_pos
                         # 如果未来集成视线追踪，可以传入iris_pos
                         iris_pos = None  # [x, y] 虹膜相对坐标，暂无数据
-                        engagement = self.estimate_engagement(pitch, yaw, iris_pos)
-                        
-                        # 更新个人基线：当FER+检测到高信度正脸中性时（仅在功能开启时）
-                        if self.mapper.config.get('enable_personal_baseline', False):
-                            fer_label = self.fer_result.get('label')
-                            fer_conf = self.fer_result.get('conf', 0.0)
-                            fer_probs = self.fer_result.get('probs_3', {})
-                            neutral_prob = fer_probs.get('neutral', 0)
-                            # 判断当前帧是否平静：FER+检测到高置信度中性
-                            is_calm = (au and fer_label == 'neutral' and fer_conf > 0.7 and neutral_prob > 0.7)
-                            self.mapper.update_personal_baseline(au, pitch, yaw, is_calm)
-                        
-                        if self.mapper.calibrating and au:
-                            cp, ce = self.mapper.calibrating; cnt = self.mapper.feed_calib(au, yaw)
-                            res.update(calibrating=True, calib_pose=cp, calib_emotion=ce, calib_count=cnt)
-                            if cnt >= CALIB_N: self.mapper.finish_calib(cp, ce); res['calibrating']=False
-                        
-                        pose, emotion, conf, scores = self.mapper.predict(au, pitch, yaw, speaking=speaking)
-                        
-                        # 更新个人基线状态
-                        personal_samples = len(self.mapper.personal_baseline_samples)
-                        personal_ready = self.mapper.personal_baseline is not None
-                        
-                        res.update(pose=pose, emotion=emotion, confidence=round(conf,3), pitch=round(pitch,1), yaw=round(yaw,1), roll=round(roll,1), scores={k:round(v,3) for k,v in scores.items()}, au={k:round(v,1) for k,v in au.items()} if au else {}, speaking=speaking, personal_samples=personal_samples, personal_ready=personal_ready, engagement=engagement)
-                    else:
-                        # 更新个人基线状态（即使无人脸）
-                        personal_samples = len(self.mapper.personal_baseline_samples)
-                        personal_ready = self.mapper.personal_baseline is not None
-                        
-                        res.update(emotion='no_face', au={}, scores={'neutral':0,'positive':0,'negative':0}, speaking=False, personal_samples=personal_samples, personal_ready=personal_ready, engagement='None')
-                    
-                    self.au_result = res
-                    emotion_logger.log(self.au_result, self.fer_result, self.get_fusion())
-                    # 保存实时数据到 frontend/core/emotion.json
-                    save_realtime_emotion(self.au_result, self.fer_result, self.get_fusion())
+                        job.update(speaking=speaking, pitch=pitch, yaw=yaw, roll=roll, engagement=self.estimate_engagement(pitch, yaw, iris_pos))
+                    pending.append(job)
             time.sleep(0.01)
 
     def fer_loop(self):
+        last_seq = None; next_t = 0.0
+        pending = deque()   # FER+ 推理 Future (None 表示该次无人脸), 按提交顺序收尾
         while self.running:
-            frame = self.raw_frame
-            if frame is not None:
-                self._fc_fer += 1
-                # 低频推理（每15帧一次，降低CPU占用）
-                if self._fc_fer % 15 == 3:
-                    aligned = self.fer_align.align(frame)
-                    if aligned is not None:
-                        label, conf, probs_8 = self.fer_det.predict(aligned)
-                        probs_3 = {}
-                        for k, v in FER_MAP_8_TO_3.items():
-                            i = FER_LABELS_8.index(k); probs_3[v] = probs_3.get(v, 0.0) + probs_8[i]
-                        s_label, s_conf, s_probs = self.fer_smoother.update(label, probs_3)
-                        self.fer_result = {'label':s_label, 'conf':round(s_conf,3), 'probs_3':{k:round(v,3) for k,v in s_probs.items()}, 'has_face':True}
-                    else:
-                        self.fer_result = {'label':'neutral','conf':0.0,'probs_3':{'neutral':0,'positive':0,'negative':0},'has_face':False}
+            while pending and (pending[0] is None or pending[0].done()):
+                self._finish_fer(pending.popleft())
+            # 复用 au_loop 的检测结果 (检测所用的帧 + 主受试者关键点), 同一检测帧只推理一次
+            ff = self.landmarks.latest(max_age=1.0)
+            if ff is None:
+                # 检测结果过期 (无画面 / au_loop 停顿): 清空一次
+                if last_seq is not None: last_seq = None; pending.append(None)
+            # 按调度器背压推理: 新检测帧都提交, 在途结果达到 infer_max_batch 或超过 fer_rate_hz 时跳过
+            elif ff.seq != last_seq and len(pending) < self.fer_sched.max_batch and time.monotonic() >= next_t:
+                last_seq = ff.seq; next_t = time.monotonic() + _rate_interval(self.mapper.config.get('fer_rate_hz', 5.0))
+                face = ff.primary_face()
+                aligned = self.align_cache.get(ff.frame, ff.seq, ff.primary, face.lm).fer() if face is not None else None
+                if aligned is None: pending.append(None)
+                elif self.fer_det.net is None: pending.append(_done_future(None))
+                else: pending.append(self.fer_sched.submit(self.fer_det.blob(aligned), time.monotonic() + FER_DEADLINE))
             time.sleep(0.01)
 
+    def _finish_fer(self, fut):
+        if fut is None:
+            self.fer_result = {'label':'neutral','conf':0.0,'probs_3':{'neutral':0,'positive':0,'negative':0},'has_face':False}
+            return
+        try: scores = fut.result()
+        except DeadlineExceeded: return
+        except Exception as e: print(f"[FER] 推理失败: {e}"); scores = None
+        self.fer_smoother.rescale(self.fer_rate.tick() / FER_REF_HZ)
+        label, conf, probs_8 = self.fer_det.decode(scores)
+        probs_3 = {}
+        for k, v in FER_MAP_8_TO_3.items():
+            i = FER_LABELS_8.index(k); probs_3[v] = probs_3.get(v, 0.0) + probs_8[i]
+        s_label, s_conf, s_probs = self.fer_smoother.update(label, probs_3)
+        self.fer_result = {'label':s_label, 'conf':round(s_conf,3), 'probs_3':{k:round(v,3) for k,v in s_probs.items()}, 'has_face':True}
+
+    @staticmethod
+    def _au_futures(job):
+        return ([job['fut']] if job['fut'] is not None else []) + [f for _, f in job['others']]
+
+    def _finish_au(self, job):
+        # au_loop 线程中调用: 取调度器结果, 完成情绪映射并发布 au_result
+        au = None
+        if job['fut'] is not None:
+            try: au = self.au_ext.to_scores(job['fut'].result())
+            except DeadlineExceeded: return        # 积压过久的帧直接丢弃, 等下一帧结果
+            except Exception as e: print(f"[AU] 推理失败: {e}")
+        self.mapper.rate_scale = self.au_rate.tick() / AU_REF_HZ
+        res = dict(self.au_result)
+        res['face_count'] = job['face_count']
+        res['face_detected'] = job['face_detected']
+        
+        if job['face_detected']:
+            speaking, pitch, yaw, roll, engagement = job['speaking'], job['pitch'], job['yaw'], job['roll'], job['engagement']
+            
+            # 更新个人基线：当FER+检测到高信度正脸中性时（仅在功能开启时）
+            if self.mapper.config.get('enable_personal_baseline', False):
+                fer_label = self.fer_result.get('label')
+                fer_conf = self.fer_result.get('conf', 0.0)
+                fer_probs = self.fer_result.get('probs_3', {})
+                neutral_prob = fer_probs.get('neutral', 0)
+                # 判断当前帧是否平静：FER+检测到高置信度中性
+                is_calm = (au and fer_label == 'neutral' and fer_conf > 0.7 and neutral_prob > 0.7)
+                self.mapper.update_personal_baseline(au, pitch, yaw, is_calm)
+            
+            if self.mapper.calibrating and au:
+                cp, ce = self.mapper.calibrating; cnt = self.mapper.feed_calib(au, yaw)
+                res.update(calibrating=True, calib_pose=cp, calib_emotion=ce, calib_count=cnt, calib_target=self.mapper.n(CALIB_N))
+                if cnt >= res['calib_target']: self.mapper.finish_calib(cp, ce); res['calibrating']=False
+            
+            pose, emotion, conf, scores = self.mapper.predict(au, pitch, yaw, speaking=speaking)
+            
+            # 更新个人基线状态
+            personal_samples = len(self.mapper.personal_baseline_samples)
+            personal_ready = self.mapper.personal_baseline is not None
+            
+            res.update(pose=pose, emotion=emotion, confidence=round(conf,3), pitch=round(pitch,1), yaw=round(yaw,1), roll=round(roll,1), scores={k:round(v,3) for k,v in scores.items()}, au={k:round(v,1) for k,v in au.items()} if au else {}, speaking=speaking, personal_samples=personal_samples, personal_ready=personal_ready, engagement=engagement)
+        else:
+            # 更新个人基线状态（即使无人脸）
+            personal_samples = len(self.mapper.personal_baseline_samples)
+            personal_ready = self.mapper.personal_baseline is not None
+            
+            res.update(emotion='no_face', au={}, scores={'neutral':0,'positive':0,'negative':0}, speaking=False, personal_samples=personal_samples, personal_ready=personal_ready, engagement='None')
+        
+        # 其余人脸的 AU (au_all_faces 开启时)
+        others = []
+        for bbox, fut in job['others']:
+            try: others.append({'bbox': bbox, 'au': {k: round(v,1) for k,v in self.au_ext.to_scores(fut.result()).items() if k in AU_SHOW}})
+            except Exception: pass
+        res['faces'] = others
+        
+        self.au_result = res
+        emotion_logger.log(self.au_result, self.fer_result, self.get_fusion())
+        # 保存实时数据到 frontend/core/emotion.json
+        save_realtime_emotion(self.au_result, self.fer_result, self.get_fusion())
+
+    def _camera_bus_for(self, frame):
+        """按帧尺寸取摄像头帧总线: 首帧创建, 分辨率变大 (切换摄像头) 时重建; 创建失败后不再尝试"""
+        bus = self.camera_bus
+        if bus is not None and frame.nbytes <= bus.layout.frame_cap: return bus
+        if not self._camera_bus_ok: return None
+        if bus is not None: self.camera_bus = None; bus.close()
+        try: self.camera_bus = FrameBusWriter(CAMERA_BUS, max_shape=frame.shape)
+        except Exception as e: self._camera_bus_ok = False; print(f"[FrameBus] 共享内存创建失败, 仅保留 HTTP 接口: {e}")
+        return self.camera_bus
+
+    def _frame_meta(self):
+        # 帧总线元数据: 最新一次检测的关键点 (landmarks.seq 为检测所用帧), 检测结果不变时复用序列化结果
+        ff = self.landmarks.latest()
+        if ff is None: return None
+        key = (ff.seq, ff.primary, ff.pose is not None)
+        if key != self._bus_meta_key:
+            self._bus_meta = json.dumps({'landmarks': ff.to_dict()}).encode('utf-8'); self._bus_meta_key = key
+        return self._bus_meta
+
     def get_fusion(self):
         au = self.au_result; fer = self.fer_result
         em = au.get('emotion')
@@ -1053,21 +1237,39 @@ class EmotionEngine:
             'tag': tag, 'au_raw': au_best, 'fer_raw': fer_best
         }
 
+    def _make_au_extractor(self):
+        mc = self.mapper.config
+        return AUExtractor(backend=mc.get('au_backend', 'torch'), onnx_path=mc.get('au_onnx_path'), threads=mc.get('au_onnx_threads', 0))
+
     def start_calib(self, pose, emotion): return self.mapper.start_calib(pose, emotion)
     def update_config(self, cfg):
         print(f"[Config] 收到配置更新: {cfg}")
         mc = self.mapper.config
+        au_keys = ('au_backend', 'au_onnx_path', 'au_onnx_threads')
+        au_before = [mc.get(k) for k in au_keys]
         for k, v in cfg.items():
             if k in mc:
                 if isinstance(mc[k], dict) and isinstance(v, dict): mc[k].update(v)
                 else: mc[k] = v
+        if [mc.get(k) for k in au_keys] != au_before:
+            # 新实例建好后再替换引用，au_loop 不会拿到半初始化的对象
+            self.au_ext = self._make_au_extractor()
+            print(f"[Config] AU 推理后端: {self.au_ext.backend.name}")
+        self.align_cache.interp = INTERP.get(mc.get('align_interp', 'lanczos4'), cv2.INTER_LANCZOS4)
+        for sched in (self.au_sched, self.fer_sched):
+            sched.configure(max_batch=mc.get('infer_max_batch'), max_wait=mc.get('infer_max_wait_ms', 0) / 1000.0)
         print(f"[Config] 保存配置更新后: enable_personal_baseline={mc.get('enable_personal_baseline')}, enable_interclass_verify={mc.get('enable_interclass_verify')}")
         self.mapper._save()
     def shutdown(self): 
         self.running = False
         emotion_logger.close()
         self.cap.release(); 
-        self.det.release()
+        self.au_sched.close(); self.fer_sched.close()
+        self.landmarks.release()
+        self._camera_bus_ok = False
+        for name in ('camera_bus', 'aligned_bus'):
+            bus = getattr(self, name); setattr(self, name, None)
+            if bus is not None: bus.close()
 
     def switch_camera(self, camera_type):
         """切换摄像头类型"""
@@ -1084,6 +1286,7 @@ class EmotionEngine:
         
         # 创建新连接
         self.camera_url = new_url
+        self.landmarks.source = str(new_url)
         self.cap = cv2.VideoCapture(new_url)
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
@@ -1266,6 +1469,18 @@ def api_all():
         'fusion': engine.get_fusion()
     })
 
+@app.route("/api/infer_stats")
+def api_infer_stats():
+    """微批调度统计: 批大小、吞吐 (样本/秒)、延迟与排队分位数 (ms); align 为对齐缓存命中"""
+    return jsonify({'au': engine.au_sched.stats(), 'fer': engine.fer_sched.stats(), 'align': engine.align_cache.stats()})
+
+@app.route("/api/landmarks")
+def api_landmarks():
+    """最新人脸检测结果 (坐标归一化到 0-1), 供 app.py / rppg.py 复用; full=1 时带全部关键点"""
+    ff = engine.landmarks.latest()
+    if ff is None: return jsonify({'seq': None, 'faces': [], 'stats': engine.landmarks.stats()})
+    return jsonify({**ff.to_dict(full=request.args.get('full') == '1'), 'stats': engine.landmarks.stats()})
+
 @app.route("/api/aligned_face")
 def api_aligned_face():
     """返回对齐后的人脸图像（供perception模块进行年龄性别分析）"""
@@ -0,0 +1,110 @@
+# export_au_onnx.py
+# MEFARG AU 网络导出 ONNX + 量化 + 与 torch 路径的数值一致性检查
+"""
+用法:
+    python export_au_onnx.py                                   # FP32, batch=1
+    python export_au_onnx.py --dynamic-batch --quantize int8   # 动态 batch + INT8 动态量化
+    python export_au_onnx.py --quantize fp16 --images faces/   # FP16, 用对齐人脸图片做一致性检查
+
+导出后在 config.json 的 _config 中设置 "au_backend": "onnx" (或 /api/config) 即可切换,
+au_onnx_path 默认 checkpoints/au_resnet50.onnx。
+INT8 为动态量化 (权重 int8, 激活运行时量化), 不需要校准集; FP16 需要 onnxconverter-common,
+在不支持 FP16 指令的 CPU 上通常比 FP32 慢, 主要用于减小模型体积。
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from au_infer import (AU_INPUT_SIZE, SCRIPT_DIR, OnnxAUBackend, TorchAUBackend,
+                      bench, compare_backends, preprocess)
+
+# 一致性阈值 (sigmoid*100 刻度的最大绝对误差)
+PARITY_TOL = {'none': 0.05, 'fp16': 1.0, 'int8': 5.0}
+
+
+def export(model, out_path, opset=17, dynamic_batch=False):
+    import torch
+    dummy = torch.randn(1, 3, AU_INPUT_SIZE, AU_INPUT_SIZE)
+    dynamic_axes = {'input': {0: 'batch'}, 'au': {0: 'batch'}} if dynamic_batch else None
+    with torch.no_grad():
+        torch.onnx.export(model, dummy, out_path, input_names=['input'], output_names=['au'],
+                          opset_version=opset, do_constant_folding=True, dynamic_axes=dynamic_axes)
+    print(f"[OK] 导出 {out_path} ({os.path.getsize(out_path) / 1e6:.1f} MB)")
+
+
+def quantize(src_path, out_path, mode):
+    if mode == 'int8':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(src_path, out_path, weight_type=QuantType.QInt8)
+    elif mode == 'fp16':
+        import onnx
+        from onnxconverter_common import float16
+        m = float16.convert_float_to_float16(onnx.load(src_path), keep_io_types=True)
+        onnx.save(m, out_path)
+    print(f"[OK] {mode} 量化 {out_path} ({os.path.getsize(out_path) / 1e6:.1f} MB)")
+
+
+def parity_inputs(n_random, image_dir=None, seed=0):
+    """随机输入 (归一化空间) + 可选的对齐人脸图片 (如 /api/aligned_face 保存的 jpg)"""
+    xs = [np.random.default_rng(seed).standard_normal((n_random, 3, AU_INPUT_SIZE, AU_INPUT_SIZE)).astype(np.float32)]
+    if image_dir:
+        import cv2
+        for p in sorted(glob.glob(os.path.join(image_dir, '*.jpg')) + glob.glob(os.path.join(image_dir, '*.png'))):
+            img = cv2.imread(p)
+            if img is not None:
+                xs.append(preprocess(cv2.resize(img, (AU_INPUT_SIZE, AU_INPUT_SIZE))))
+    return np.concatenate(xs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MEFARG AU 网络导出 ONNX")
+    parser.add_argument("--arc", default="resnet50", help="骨干网络 (resnet50 / swin_transformer_tiny ...)")
+    parser.add_argument("--ckpt", default=os.path.join(SCRIPT_DIR, "checkpoints", "OpenGprahAU-ResNet50_second_stage.pth"))
+    parser.add_argument("--out", default=os.path.join(SCRIPT_DIR, "checkpoints", "au_resnet50.onnx"))
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--dynamic-batch", action="store_true", help="batch 维可变 (批量推理)")
+    parser.add_argument("--quantize", choices=["none", "int8", "fp16"], default="none")
+    parser.add_argument("--threads", type=int, default=0, help="onnxruntime intra-op 线程, 0 为自动")
+    parser.add_argument("--samples", type=int, default=8, help="一致性检查的随机样本数")
+    parser.add_argument("--images", help="一致性检查用的对齐人脸图片目录")
+    parser.add_argument("--tol", type=float, help="最大绝对误差阈值, 默认按量化方式取值")
+    parser.add_argument("--bench", type=int, default=20, help="单张推理计时次数, 0 为不计时")
+    parser.add_argument("--json", help="检查/计时结果 JSON 输出路径")
+    args = parser.parse_args()
+
+    ref = TorchAUBackend(args.arc, args.ckpt, device='cpu')
+    if args.quantize == 'none':
+        export(ref.model, args.out, args.opset, args.dynamic_batch)
+    else:
+        fp32_path = os.path.splitext(args.out)[0] + '.fp32.onnx'
+        export(ref.model, fp32_path, args.opset, args.dynamic_batch)
+        quantize(fp32_path, args.out, args.quantize)
+
+    ort_backend = OnnxAUBackend(args.out, args.threads)
+    x = parity_inputs(args.samples, args.images)
+    tol = args.tol if args.tol is not None else PARITY_TOL[args.quantize]
+    summary = {"onnx": args.out, "quantize": args.quantize, "dynamic_batch": args.dynamic_batch,
+               "parity": compare_backends(ref, ort_backend, x), "tol": tol}
+    if args.bench > 0:
+        import torch
+        torch.set_num_threads(ort_backend.threads)
+        summary["latency_ms"] = {"torch": bench(ref, x[:1], args.bench),
+                                 "onnx": bench(ort_backend, x[:1], args.bench)}
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    if summary["parity"]["max_abs"] > tol:
+        print(f"[FAIL] 与 torch 路径最大误差 {summary['parity']['max_abs']} > {tol}")
+        sys.exit(1)
+    print(f"[OK] 与 torch 路径一致 (最大误差 {summary['parity']['max_abs']} <= {tol})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# infer_scheduler.py
+# 微批推理调度: 跨帧 / 跨人脸把对齐人脸凑成批, 一次送进模型
+"""
+生产者 submit(x, deadline) 立即拿到 Future, 不阻塞; 调度线程在模型空闲时取走已排队的样本 (至多 max_batch),
+调 batch_fn(np.stack(xs)), 按顺序把每行结果填回各自的 Future。调度前已超过截止时间的样本直接以
+DeadlineExceeded 结束, 不占模型。
+
+模型推理期间新到的样本自然排队进入下一批, 负载越高批越大; 单样本不额外等待, 延迟与逐帧推理相同。
+max_wait > 0 时首个样本最多再等 max_wait (或到最早截止时间前, 按最近批耗时预留) 凑批, 适合多个生产者同时提交。
+每个模型一个调度器 (AU / FER+), batch_fn 在调度线程中调用, 同一模型不会被并发调用。
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class InferenceScheduler:
+
+    def __init__(self, name, batch_fn, max_batch=8, max_wait=0.0, history=512):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._queue = deque()           # (x, deadline, t_submit, future)
+        self._running = True
+        # 统计
+        self.submitted = 0
+        self.completed = 0
+        self.expired = 0
+        self.failed = 0
+        self.batches = 0
+        self._batch_ms_ema = None
+        self._latency = deque(maxlen=history)      # submit → 结果 (ms)
+        self._wait = deque(maxlen=history)         # submit → 入批 (ms)
+        self._sizes = deque(maxlen=history)
+        self._done_ts = deque(maxlen=history)
+        self._thread = threading.Thread(target=self._worker, name=f"infer-{name}", daemon=True)
+        self._thread.start()
+
+    def configure(self, max_batch=None, max_wait=None):
+        with self._cond:
+            if max_batch is not None:
+                self.max_batch = max(1, int(max_batch))
+            if max_wait is not None:
+                self.max_wait = max(0.0, float(max_wait))
+            self._cond.notify()
+
+    def submit(self, x, deadline=None):
+        """x: 单个样本 (不带 batch 维); deadline: time.monotonic() 时刻, None 为不限"""
+        fut = Future()
+        with self._cond:
+            if not self._running:
+                fut.set_exception(RuntimeError(f"{self.name} 调度器已关闭"))
+                return fut
+            self._queue.append((x, deadline, time.monotonic(), fut))
+            self.submitted += 1
+            self._cond.notify()
+        return fut
+
+    def _close_time(self):
+        """当前队列应当关批的时刻"""
+        first_t = self._queue[0][2]
+        t = first_t + self.max_wait
+        deadlines = [d for _, d, _, _ in self._queue if d is not None]
+        if deadlines:
+            reserve = (self._batch_ms_ema or 0.0) / 1000.0
+            t = min(t, min(deadlines) - reserve)
+        return t
+
+    def _take_batch(self):
+        with self._cond:
+            while self._running:
+                if self._queue:
+                    if len(self._queue) >= self.max_batch:
+                        break
+                    remaining = self._close_time() - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                else:
+                    self._cond.wait(0.5)
+            if not self._running:
+                return []
+            n = min(self.max_batch, len(self._queue))
+            return [self._queue.popleft() for _ in range(n)]
+
+    def _worker(self):
+        while self._running:
+            items = self._take_batch()
+            now = time.monotonic()
+            live = []
+            for item in items:
+                if item[1] is not None and now > item[1]:
+                    self.expired += 1
+                    item[3].set_exception(DeadlineExceeded(f"{self.name} 超过截止时间"))
+                else:
+                    live.append(item)
+            if not live:
+                continue
+            t0 = time.monotonic()
+            try:
+                out = self.batch_fn(np.stack([it[0] for it in live]))
+            except Exception as e:
+                self.failed += len(live)
+                for it in live:
+                    it[3].set_exception(e)
+                continue
+            t1 = time.monotonic()
+            ms = (t1 - t0) * 1000.0
+            self._batch_ms_ema = ms if self._batch_ms_ema is None else 0.8 * self._batch_ms_ema + 0.2 * ms
+            self.batches += 1
+            self._sizes.append(len(live))
+            for i, (_, _, t_sub, fut) in enumerate(live):
+                self._wait.append((t0 - t_sub) * 1000.0)
+                self._latency.append((t1 - t_sub) * 1000.0)
+                self._done_ts.append(t1)
+                fut.set_result(out[i])
+            self.completed += len(live)
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return {"p50": None, "p95": None, "p99": None}
+        a = np.asarray(values)
+        return {f"p{q}": round(float(np.percentile(a, q)), 2) for q in (50, 95, 99)}
+
+    def stats(self):
+        done = list(self._done_ts)
+        span = done[-1] - done[0] if len(done) > 1 else 0.0
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000.0, 1),
+            "queued": len(self._queue),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "expired": self.expired,
+            "failed": self.failed,
+            "batches": self.batches,
+            "mean_batch": round(float(np.mean(self._sizes)), 2) if self._sizes else 0.0,
+            "batch_ms": round(self._batch_ms_ema, 2) if self._batch_ms_ema is not None else None,
+            "throughput": round((len(done) - 1) / span, 2) if span > 0 else 0.0,   # 样本/秒 (最近窗口)
+            "latency_ms": self._percentiles(list(self._latency)),
+            "queue_wait_ms": self._percentiles(list(self._wait)),
+        }
+
+    def close(self):
+        with self._cond:
+            self._running = False
+            pending = list(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+        for *_, fut in pending:
+            fut.set_exception(RuntimeError(f"{self.name} 调度器已关闭"))
@@ -0,0 +1,265 @@
+# perception/frame_bus.py
+# 共享内存帧总线: 摄像头所有者 (emotion.py) 写入原始帧环形缓冲, 同机其他进程零拷贝读取
+"""
+代替进程间的 MJPEG / HTTP 传帧: 写方每帧一次写入原始 BGR 帧, 可附带已编码的 JPEG
+(写方本来就要编码给自己的 /video_feed, 读方转发时不必再解码/编码) 和 JSON 元数据 (如关键点)。
+
+共享内存布局 (小端):
+    总头 64B   magic, 槽数, 帧容量, JPEG 容量, 元数据容量, closed, 最新 seq, 心跳 (写方最近一次写入的墙钟时间)
+    槽 × N     槽头 64B (seqlock, seq, ts, h, w, c, jpeg_len, meta_len) + 帧 + JPEG + 元数据
+
+单写多读, 每个槽一个 seqlock: 写方先把计数加一 (奇数, 写入中), 写完再加一 (偶数), 最后发布最新 seq;
+读方前后两次读到相同的偶数计数才算读到完整一帧, 否则重试。依赖对齐 8 字节写入的原子性 (x86-64 / ARM64)。
+读方拿到的零拷贝视图只在该槽被覆盖前有效 (约 槽数-1 帧), 用 valid() 检查, 需要长期持有时 copy=True。
+写方异常退出 (来不及 close) 或摄像头停顿时心跳不再更新, 读方据此断开, 不会停在没有新帧的段上。
+"""
+import json
+import os
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+CAMERA_BUS = "rppg_camera"          # emotion.py 的摄像头原始帧 + JPEG + 最新关键点
+ALIGNED_BUS = "rppg_aligned_face"   # emotion.py 的 224x224 对齐人脸 (PersonAnalyzer 使用)
+
+MAGIC = b"RPPGBUS1"
+_HEADER = struct.Struct("<8sIIIII4xQd")     # magic, slots, frame_cap, jpeg_cap, meta_cap, closed, (pad), latest_seq, heartbeat
+_SLOT = struct.Struct("<QQd IIIII")          # lock, seq, ts, h, w, c, jpeg_len, meta_len
+HEADER_SIZE = 64
+SLOT_HEADER_SIZE = 64
+_CLOSED_OFFSET = 24
+_LATEST_OFFSET = 32
+_HEARTBEAT_OFFSET = 40
+
+BusFrame = namedtuple('BusFrame', ['seq', 'ts', 'frame', 'jpeg', 'meta', 'slot', 'version'])
+
+
+def _align64(n):
+    return (n + 63) // 64 * 64
+
+
+def _attach(name):
+    """按名字打开已有共享内存, 不交给 resource_tracker 管理 (否则读方退出时会删除写方的段)"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)    # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class _Layout:
+
+    def __init__(self, slots, frame_cap, jpeg_cap, meta_cap):
+        self.slots = slots
+        self.frame_cap = frame_cap
+        self.jpeg_cap = jpeg_cap
+        self.meta_cap = meta_cap
+        self.stride = _align64(SLOT_HEADER_SIZE + frame_cap + jpeg_cap + meta_cap)
+        self.size = HEADER_SIZE + self.stride * slots
+
+    def slot_offset(self, i):
+        return HEADER_SIZE + self.stride * i
+
+    @classmethod
+    def read(cls, buf):
+        magic, slots, frame_cap, jpeg_cap, meta_cap, _, _, _ = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise ValueError("不是帧总线共享内存")
+        return cls(slots, frame_cap, jpeg_cap, meta_cap)
+
+
+class FrameBusWriter:
+    """单写方。max_shape 决定帧容量 (按实际采集分辨率给出), 超出容量的帧不写入。"""
+
+    def __init__(self, name, max_shape=(1080, 1920, 3), slots=4, jpeg_capacity=None,
+                 meta_capacity=16384):
+        frame_cap = int(np.prod(max_shape))
+        jpeg_cap = frame_cap // 4 if jpeg_capacity is None else jpeg_capacity
+        self.name = name
+        self.layout = _Layout(slots, frame_cap, jpeg_cap, meta_capacity)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.layout.size)
+        except FileExistsError:
+            # 上次未正常关闭 (写方被杀): 旧段标记关闭后删除重建, 不复用。
+            # 读方缓存的是旧段的布局, 看到 closed 即断开, 重连时按新段总头重新解析
+            old = _attach(name)
+            try:
+                if bytes(old.buf[:len(MAGIC)]) == MAGIC:
+                    struct.pack_into("<I", old.buf, _CLOSED_OFFSET, 1)
+            finally:
+                old.close()
+                try:
+                    old.unlink()
+                except FileNotFoundError:
+                    pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.layout.size)
+        self.buf = self.shm.buf
+        self.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        for i in range(slots):
+            off = self.layout.slot_offset(i)
+            self.buf[off:off + SLOT_HEADER_SIZE] = bytes(SLOT_HEADER_SIZE)
+        _HEADER.pack_into(self.buf, 0, MAGIC, slots, frame_cap, jpeg_cap, meta_capacity, 0, 0,
+                          time.time())
+        self.seq = 0
+        self.dropped = 0
+        self._warned = set()
+
+    def _warn(self, key, msg):
+        if key not in self._warned:
+            self._warned.add(key)
+            print(f"[FrameBus] {self.name}: {msg}")
+
+    def write(self, frame, ts=None, jpeg=None, meta=None):
+        """写入一帧并发布, 返回其 seq; 帧超出容量时返回 None。
+        meta 为 dict (JSON 序列化) 或已序列化的 bytes。"""
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        lay = self.layout
+        if frame.nbytes > lay.frame_cap:
+            self.dropped += 1
+            self._warn("frame", f"帧 {frame.shape} 超出容量 {lay.frame_cap}B, 已丢弃")
+            return None
+        if jpeg is not None and len(jpeg) > lay.jpeg_cap:
+            self._warn("jpeg", f"JPEG {len(jpeg)}B 超出容量 {lay.jpeg_cap}B, 不附带")
+            jpeg = None
+        if meta is not None and not isinstance(meta, (bytes, bytearray)):
+            meta = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+        if meta is not None and len(meta) > lay.meta_cap:
+            self._warn("meta", f"元数据 {len(meta)}B 超出容量 {lay.meta_cap}B, 不附带")
+            meta = None
+
+        seq = self.seq + 1
+        off = lay.slot_offset(seq % lay.slots)
+        lock = struct.unpack_from("<Q", self.buf, off)[0]
+        struct.pack_into("<Q", self.buf, off, lock + 1)            # 奇数: 写入中
+        shape = frame.shape + (1,) * (3 - frame.ndim)
+        jl = len(jpeg) if jpeg is not None else 0
+        ml = len(meta) if meta is not None else 0
+        p = off + SLOT_HEADER_SIZE
+        self.buf[p:p + frame.nbytes] = frame.reshape(-1).data
+        p += lay.frame_cap
+        if jl:
+            self.buf[p:p + jl] = jpeg
+        p += lay.jpeg_cap
+        if ml:
+            self.buf[p:p + ml] = meta
+        _SLOT.pack_into(self.buf, off, lock + 1, seq, time.time() if ts is None else ts,
+                        shape[0], shape[1], shape[2], jl, ml)
+        struct.pack_into("<Q", self.buf, off, lock + 2)            # 偶数: 完成
+        struct.pack_into("<Q", self.buf, _LATEST_OFFSET, seq)
+        struct.pack_into("<d", self.buf, _HEARTBEAT_OFFSET, time.time())
+        self.seq = seq
+        return seq
+
+    def close(self):
+        """标记关闭 (读方随即放弃该段) 并删除共享内存"""
+        struct.pack_into("<I", self.buf, _CLOSED_OFFSET, 1)
+        self.buf = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class FrameBusReader:
+    """读方。写方不存在时 read() 返回 None, 每 retry_interval 秒重试一次连接。
+    stale_after: 写方心跳超过该秒数未更新即视为写方已退出或摄像头停顿, 断开且不连接该段,
+    直到心跳恢复 (None 为不检查)。"""
+
+    def __init__(self, name, stale_after=2.0, retry_interval=1.0):
+        self.name = name
+        self.stale_after = stale_after
+        self.retry_interval = retry_interval
+        self.shm = None
+        self.layout = None
+        self._next_attach = 0.0
+        self.torn_reads = 0
+
+    def _connect(self):
+        now = time.time()
+        if now < self._next_attach:
+            return False
+        self._next_attach = now + self.retry_interval
+        try:
+            shm = _attach(self.name)
+        except FileNotFoundError:
+            return False
+        try:
+            layout = _Layout.read(shm.buf)
+        except ValueError:      # 写方尚未初始化完总头
+            shm.close()
+            return False
+        if self._stale(shm.buf):
+            shm.close()
+            return False
+        self.shm, self.layout = shm, layout
+        return True
+
+    def _disconnect(self):
+        shm, self.shm, self.layout = self.shm, None, None
+        try:
+            shm.close()
+        except BufferError:
+            pass    # 仍有零拷贝视图引用该段, 由 GC 回收
+
+    def _stale(self, buf):
+        return (self.stale_after is not None
+                and time.time() - struct.unpack_from("<d", buf, _HEARTBEAT_OFFSET)[0] > self.stale_after)
+
+    def connected(self):
+        return self.shm is not None or self._connect()
+
+    def latest_seq(self):
+        if not self.connected():
+            return 0
+        return struct.unpack_from("<Q", self.shm.buf, _LATEST_OFFSET)[0]
+
+    def read(self, copy=True, after_seq=0, retries=8):
+        """读最新一帧; 最新 seq 等于 after_seq (没有新帧)、写方不存在或已过期时返回 None。
+        写方重启后 seq 从 1 重新计数, 因此只比较是否相同。过期检查在比较 seq 之前,
+        没有新帧时也能发现写方已退出。"""
+        if not self.connected():
+            return None
+        buf = self.shm.buf
+        if struct.unpack_from("<I", buf, _CLOSED_OFFSET)[0] or self._stale(buf):
+            self._disconnect()
+            return None
+        lay = self.layout
+        for _ in range(retries):
+            latest = struct.unpack_from("<Q", buf, _LATEST_OFFSET)[0]
+            if latest == 0 or latest == after_seq:
+                return None
+            off = lay.slot_offset(latest % lay.slots)
+            v1, seq, ts, h, w, c, jl, ml = _SLOT.unpack_from(buf, off)
+            if v1 & 1 or seq != latest:
+                self.torn_reads += 1
+                continue
+            p = off + SLOT_HEADER_SIZE
+            frame = np.ndarray((h, w, c), dtype=np.uint8, buffer=buf, offset=p)
+            if copy:
+                frame = frame.copy()
+            p += lay.frame_cap
+            jpeg = bytes(buf[p:p + jl]) if jl else None
+            p += lay.jpeg_cap
+            meta = bytes(buf[p:p + ml]) if ml else None
+            if struct.unpack_from("<Q", buf, off)[0] != v1:
+                self.torn_reads += 1
+                continue
+            return BusFrame(seq, ts, frame, jpeg, json.loads(meta) if meta else None,
+                            off, v1)
+        return None
+
+    def valid(self, bf):
+        """零拷贝读出的帧是否仍未被覆盖"""
+        return (self.shm is not None
+                and struct.unpack_from("<Q", self.shm.buf, bf.slot)[0] == bf.version)
+
+    def close(self):
+        if self.shm is not None:
+            self._disconnect()
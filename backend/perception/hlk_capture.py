@@ -0,0 +1,69 @@
+# perception/hlk_capture.py
+# HLK 雷达原始串口字节录制 / 读取
+"""
+.hlkcap 格式 (小端):
+    文件头  b"HLKCAP01"
+    记录    <d 接收时间戳 (秒)> <I 字节数 n> <n 字节原始串口数据>  重复
+
+每次 ser.read() 的结果原样记为一条记录, 回放时分块边界和时间戳都与现场一致。
+末尾不完整的记录 (进程异常退出) 在读取时忽略。
+"""
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"HLKCAP01"
+RECORD = struct.Struct('<dI')
+
+
+class CaptureWriter:
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab')
+        if new:
+            self._file.write(MAGIC)
+        self._last_flush = time.time()
+        self._lock = threading.Lock()     # 接收线程写入, 主线程退出时 close
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, ts, data):
+        if not data:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD.pack(ts, len(data)))
+            self._file.write(data)
+            self.records += 1
+            self.bytes += len(data)
+            if ts - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = ts
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._file.close()
+                self._file = None
+
+
+def iter_capture(path):
+    """逐条产出 (ts, data)。"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"不是 hlkcap 文件: {path}")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            ts, n = RECORD.unpack(head)
+            data = f.read(n)
+            if len(data) < n:
+                return
+            yield ts, data
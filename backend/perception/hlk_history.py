@@ -0,0 +1,68 @@
+# perception/hlk_history.py
+# HLK 雷达逐帧历史序列 (定长环形缓冲区)
+
+import threading
+import numpy as np
+
+from ring_buffer import RingBuffer
+
+
+class RadarHistory:
+    """validate_and_update 写入的各条历史序列, 共用一把可重入锁。
+
+    写入方在 `with history.lock:` 内一次写完一帧的所有序列,
+    读取方用 snapshot() 或在同一把锁内读 view(), 各序列始终对齐到同一帧。
+    序列按旧版列表的初始值预填满, 依赖长度的判断 (如 calc_brv 需 100 个样本) 行为不变。
+    """
+
+    def __init__(self, capacity=600, lissajous_len=500,
+                 hr_init=72.0, br_init=16.0):
+        self.capacity = capacity
+        self.lock = threading.RLock()
+
+        def ring(init, dtype=np.float64):
+            rb = RingBuffer(capacity, dtype=dtype, lock=self.lock)
+            rb.fill(init)
+            return rb
+
+        self.heart_phase = ring(0.0)
+        self.breath_phase = ring(0.0)
+        self.display_hr = ring(hr_init)
+        self.display_br = ring(br_init)
+        self.signal_state = ring("INIT", dtype=object)
+        self.clean_hr = ring(hr_init)
+        self.clean_br = ring(br_init)
+        self.hr_valid = ring(True, dtype=bool)
+        self.br_valid = ring(True, dtype=bool)
+        self.phase_valid = ring(True, dtype=bool)
+        # (breath_phase, heart_phase), 初始为空
+        self.lissajous = RingBuffer(lissajous_len, width=2, lock=self.lock)
+
+    def record(self, final_hr, final_br, state, hr_valid, br_valid,
+               phase_valid, heart_phase, breath_phase):
+        """追加一帧的显示值/状态/相位 (clean_* 由调用方按状态单独追加)。"""
+        with self.lock:
+            self.display_hr.append(final_hr)
+            self.display_br.append(final_br)
+            self.signal_state.append(state)
+            self.hr_valid.append(hr_valid)
+            self.br_valid.append(br_valid)
+            self.phase_valid.append(phase_valid)
+            self.heart_phase.append(heart_phase)
+            self.breath_phase.append(breath_phase)
+            self.lissajous.append((breath_phase, heart_phase))
+
+    def snapshot(self, n=200, lissajous_n=300):
+        """最近 n 帧的一致快照 (可直接 JSON 序列化)。"""
+        with self.lock:
+            return {
+                "heart_phase": self.heart_phase.view(n).tolist(),
+                "breath_phase": self.breath_phase.view(n).tolist(),
+                "heart_rate": self.display_hr.view(n).tolist(),
+                "breath_rate": self.display_br.view(n).tolist(),
+                "signal_state": self.signal_state.view(n).tolist(),
+                "hr_valid": self.hr_valid.view(n).tolist(),
+                "br_valid": self.br_valid.view(n).tolist(),
+                "phase_valid": self.phase_valid.view(n).tolist(),
+                "lissajous": self.lissajous.view(lissajous_n).tolist(),
+            }
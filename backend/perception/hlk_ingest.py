@@ -0,0 +1,173 @@
+# perception/hlk_ingest.py
+# HLK 雷达数据接入: 独立读线程 + 有界队列
+"""
+RadarReader 在独立线程里阻塞读链路 (hlk_transport, 带超时, 空闲时不占 CPU),
+把 (tag, 接收时间戳, 字节块) 放入 ChunkQueue; 处理线程 (hlkk.ingest_thread) 只从队列取数据。
+多个雷达各用一个 RadarReader 写同一个队列, tag 为传感器 ID, 处理线程据此分发。
+断线重连在读线程内按指数退避进行, 处理线程不受影响。
+
+丢弃策略 (队列满时):
+    drop_oldest  丢最老的块, 保证处理的是最新数据 (默认)
+    drop_newest  丢新到的块
+    block        读线程等待, 依赖链路自身缓冲 (串口驱动缓冲满后由设备侧丢)
+丢弃字节块会截断帧, 由 HLKFrameParser 重同步, 计入 resync_bytes。
+"""
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+DROP_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+
+class ChunkQueue:
+
+    def __init__(self, maxsize=256, policy='drop_oldest'):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"policy 必须是 {DROP_POLICIES} 之一")
+        self.policy = policy
+        self._q = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.high_water = 0
+
+    def put(self, item):
+        if self.policy == 'block':
+            self._q.put(item)
+        elif self.policy == 'drop_newest':
+            try:
+                self._q.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                return False
+        else:
+            while True:
+                try:
+                    self._q.put_nowait(item)
+                    break
+                except queue.Full:
+                    try:
+                        self._q.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        self.high_water = max(self.high_water, self._q.qsize())
+        return True
+
+    def get(self, timeout=None):
+        """取一块; 超时返回 None。"""
+        try:
+            return self._q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def qsize(self):
+        return self._q.qsize()
+
+
+class IngestStats:
+    """读/处理两侧的吞吐、排队延迟和线程 CPU 占用。"""
+
+    def __init__(self, latency_window=2000):
+        self.t_start = time.time()
+        self.chunks = 0
+        self.bytes = 0
+        self.reconnects = 0
+        self.read_cpu = 0.0
+        self.process_cpu = 0.0
+        self._latency = deque(maxlen=latency_window)
+
+    def record_latency(self, seconds):
+        self._latency.append(seconds * 1000.0)
+
+    def to_dict(self, q=None):
+        wall = max(time.time() - self.t_start, 1e-6)
+        lat = np.array(self._latency) if self._latency else np.zeros(1)
+        d = {
+            "chunks": self.chunks,
+            "bytes": self.bytes,
+            "bytes_per_s": round(self.bytes / wall, 1),
+            "reconnects": self.reconnects,
+            "read_cpu_pct": round(100.0 * self.read_cpu / wall, 2),
+            "process_cpu_pct": round(100.0 * self.process_cpu / wall, 2),
+            "latency_ms": {
+                "p50": round(float(np.percentile(lat, 50)), 3),
+                "p95": round(float(np.percentile(lat, 95)), 3),
+                "max": round(float(np.max(lat)), 3)},
+        }
+        if q is not None:
+            d.update(queue_depth=q.qsize(), queue_high_water=q.high_water,
+                     dropped=q.dropped, drop_policy=q.policy)
+        return d
+
+
+class RadarReader:
+
+    def __init__(self, open_link, out_queue, stats=None,
+                 retry_min=0.5, retry_max=5.0, name="radar-reader", tag=None):
+        self.open_link = open_link
+        self.queue = out_queue
+        self.stats = stats if stats is not None else IngestStats()
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.name = name
+        self.tag = tag
+        self.connected = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, name=self.name,
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+
+    def _connect(self):
+        delay = self.retry_min
+        while not self._stop.is_set():
+            try:
+                link = self.open_link()
+                print("雷达链路已连接: %s" % getattr(link, "name", link))
+                return link
+            except Exception as e:
+                print("雷达链路连接失败: %s, %.1f秒后重试" % (e, delay))
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.retry_max)
+        return None
+
+    def _worker(self):
+        link = None
+        cpu0 = time.thread_time()
+        while not self._stop.is_set():
+            if link is None:
+                link = self._connect()
+                if link is None:
+                    break
+                self.connected = True
+            try:
+                data = link.read_chunk()
+            except Exception as e:
+                print("读取错误: %s, 重新连接..." % e)
+                link.close()
+                link = None
+                self.connected = False
+                self.stats.reconnects += 1
+                continue
+            if data:
+                self.stats.chunks += 1
+                self.stats.bytes += len(data)
+                self.queue.put((self.tag, time.time(), data))
+            cpu1 = time.thread_time()
+            self.stats.read_cpu += cpu1 - cpu0
+            cpu0 = cpu1
+        if link is not None:
+            link.close()
+        self.connected = False
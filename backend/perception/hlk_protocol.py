@@ -0,0 +1,167 @@
+# perception/hlk_protocol.py
+# HLK 毫米波雷达串口协议: 增量帧解析
+"""
+帧格式 (大端长度/TID, 小端载荷):
+    [0]    SOF = 0x01
+    [1:3]  帧 ID
+    [3:5]  载荷长度 dlen
+    [5:7]  TID
+    [7]    头校验  ~XOR(frame[0:7])
+    [8:8+dlen]      载荷
+    [8+dlen]        载荷校验 ~XOR(载荷)   (dlen > 0 时存在)
+
+HLKFrameParser 在 bytearray 上用读偏移推进, 不做逐字节切片拷贝;
+载荷以 memoryview 交给预编译的 struct.Struct 解码。
+"""
+import struct
+import time
+
+SOF = 0x01
+HEADER_LEN = 8
+MAX_FRAME_LEN = 1024
+
+TID_HUMAN = 0x0F09
+TID_DISTANCE = 0x0A16
+TID_PHASE = 0x0A13
+TID_BREATH_RATE = 0x0A14
+TID_HEART_RATE = 0x0A15
+
+# TID → (解码器, 最短载荷长度)
+DECODERS = {
+    TID_HUMAN: (struct.Struct('<B'), 2),            # is_human
+    TID_DISTANCE: (struct.Struct('<If'), 8),        # flag, distance
+    TID_PHASE: (struct.Struct('<4xff'), 12),        # breath_phase, heart_phase
+    TID_BREATH_RATE: (struct.Struct('<f'), 4),      # breath_rate
+    TID_HEART_RATE: (struct.Struct('<f'), 4),       # heart_rate
+}
+
+
+def xor8(data):
+    """所有字节的异或: 整段转成大整数后对半折叠, 运算都在 C 层完成。"""
+    n = len(data)
+    if n == 0:
+        return 0
+    x = int.from_bytes(data, 'little')
+    width = n
+    while width > 1:
+        half = (width + 1) // 2
+        x = (x & ((1 << (half * 8)) - 1)) ^ (x >> (half * 8))
+        width = half
+    return x
+
+
+def verify_cksum(data, cksum):
+    return (~xor8(data) & 0xFF) == cksum
+
+
+def build_frame(tid, payload=b"", frame_id=0):
+    """按协议组帧 (用于模拟/测试)。"""
+    dlen = len(payload)
+    head = struct.pack('>BHHH', SOF, frame_id, dlen, tid)
+    frame = head + bytes([~xor8(head) & 0xFF])
+    if dlen:
+        frame += bytes(payload) + bytes([~xor8(payload) & 0xFF])
+    return frame
+
+
+class HLKFrameParser:
+    """增量帧解析器。
+
+    feed(data) 追加新字节并返回本次解析出的 [(tid, values), ...],
+    values 是对应 DECODERS 解码后的元组; 未注册的 TID 只计数不返回。
+    半帧保留在缓冲区等待后续字节。
+    """
+
+    def __init__(self, max_frame=MAX_FRAME_LEN):
+        self.max_frame = max_frame
+        self._buf = bytearray()
+        self._r = 0
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.bytes_in = 0
+        self.frames_ok = 0
+        self.resync_bytes = 0
+        self.header_cksum_fail = 0
+        self.data_cksum_fail = 0
+        self.short_payload = 0
+        self.unknown_tid = 0
+        self.frames_by_tid = {}
+        self.parse_time = 0.0
+
+    @property
+    def pending(self):
+        return len(self._buf) - self._r
+
+    def feed(self, data):
+        t0 = time.perf_counter()
+        self.bytes_in += len(data)
+        buf = self._buf
+        # 已消费部分超过一半时整体前移, 摊还 O(1)
+        if self._r and self._r * 2 >= len(buf):
+            del buf[:self._r]
+            self._r = 0
+        buf += data
+        out = []
+        r = self._r
+        end = len(buf)
+        mv = memoryview(buf)
+        try:
+            while end - r >= HEADER_LEN:
+                if buf[r] != SOF:
+                    nxt = buf.find(SOF, r + 1)
+                    skip = (nxt if nxt >= 0 else end) - r
+                    self.resync_bytes += skip
+                    r += skip
+                    continue
+                dlen = (buf[r + 3] << 8) | buf[r + 4]
+                flen = HEADER_LEN + dlen + (1 if dlen > 0 else 0)
+                if flen > self.max_frame \
+                        or not verify_cksum(mv[r:r + 7], buf[r + 7]):
+                    self.header_cksum_fail += flen <= self.max_frame
+                    self.resync_bytes += 1
+                    r += 1
+                    continue
+                if end - r < flen:
+                    break           # 半帧, 等待更多数据
+                tid = (buf[r + 5] << 8) | buf[r + 6]
+                p0 = r + HEADER_LEN
+                if dlen > 0 and not verify_cksum(mv[p0:p0 + dlen],
+                                                 buf[p0 + dlen]):
+                    self.data_cksum_fail += 1
+                    r += flen
+                    continue
+                r += flen
+                self.frames_ok += 1
+                self.frames_by_tid[tid] = self.frames_by_tid.get(tid, 0) + 1
+                dec = DECODERS.get(tid)
+                if dec is None:
+                    self.unknown_tid += 1
+                    continue
+                codec, min_len = dec
+                if dlen < min_len:
+                    self.short_payload += 1
+                    continue
+                out.append((tid, codec.unpack_from(mv, p0)))
+        finally:
+            mv.release()
+        self._r = r
+        self.parse_time += time.perf_counter() - t0
+        return out
+
+    def stats(self):
+        return {
+            "bytes_in": self.bytes_in,
+            "frames_ok": self.frames_ok,
+            "resync_bytes": self.resync_bytes,
+            "header_cksum_fail": self.header_cksum_fail,
+            "data_cksum_fail": self.data_cksum_fail,
+            "short_payload": self.short_payload,
+            "unknown_tid": self.unknown_tid,
+            "pending_bytes": self.pending,
+            "frames_by_tid": {"0x%04X" % k: v
+                              for k, v in self.frames_by_tid.items()},
+            "parse_time_s": round(self.parse_time, 4),
+            "throughput_bps": round(self.bytes_in / self.parse_time, 1)
+            if self.parse_time > 0 else 0.0,
+        }
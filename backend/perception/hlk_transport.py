@@ -0,0 +1,241 @@
+# perception/hlk_transport.py
+# HLK 雷达链路: 串口 / TCP / 录制回放 / 模拟, 以及 TCP、pty 推流替身
+"""
+所有链路实现同一接口, 供 hlk_ingest.RadarReader 使用:
+    read_chunk() -> bytes   阻塞到有数据或超时 (超时返回 b"")
+    close()
+链路断开时 read_chunk 抛异常, 由 RadarReader 重连。
+
+链路描述串 (hlkk.RADAR_LINK):
+    serial:COM9 / serial:/dev/ttyUSB0   串口, 波特率取 BAUD
+    tcp:127.0.0.1:6000                  TCP 客户端
+    replay:capture.hlkcap               回放 .hlkcap, 速度取 speed (0 = 不限速)
+    sim                                 按 simulate 生理模型实时生成帧
+
+推流替身 (Linux CI 压测, 远超 115200 波特率):
+    python hlk_transport.py capture.hlkcap --tcp 6000 --speed 20
+    python hlk_transport.py capture.hlkcap --pty --speed 20     # 打印 pty 从端路径, 作为 serial: 端口
+"""
+import argparse
+import itertools
+import os
+import socket
+import struct
+import time
+
+import numpy as np
+
+import hlk_protocol as hlk
+from hlk_capture import iter_capture
+
+
+# -------------------- 帧源 --------------------
+
+def synth_chunks(seed=None, frame_dt=0.02, chunk_max=64):
+    """按 simulate 生理模型无限产出 (ts, bytes), ts 从 0 开始, 随机切块模拟串口读取。"""
+    rng = np.random.default_rng(seed)
+    f32 = struct.Struct('<f')
+    hr, br = 72.0, 16.0
+    hr_phase = br_phase = 0.0
+    i = 0
+    while True:
+        ts = i * frame_dt
+        hr = float(np.clip(hr + rng.normal(0, 0.3), 50, 100))
+        br = float(np.clip(br + rng.normal(0, 0.15), 10, 25))
+        hr_phase = (hr_phase + hr / 60 * 2 * np.pi * frame_dt
+                    + rng.normal(0, 0.02)) % (2 * np.pi)
+        br_phase = (br_phase + br / 60 * 2 * np.pi * frame_dt
+                    + rng.normal(0, 0.015)) % (2 * np.pi)
+        pending = b""
+        if i % 20 == 0:
+            pending += hlk.build_frame(hlk.TID_HUMAN, b"\x01\x00")
+            pending += hlk.build_frame(hlk.TID_DISTANCE,
+                                       struct.pack('<If', 1, 45.92))
+        pending += hlk.build_frame(hlk.TID_PHASE,
+                                   struct.pack('<Iff', 0, br_phase, hr_phase))
+        if i % 3 == 0:
+            pending += hlk.build_frame(hlk.TID_BREATH_RATE, f32.pack(br))
+            pending += hlk.build_frame(hlk.TID_HEART_RATE, f32.pack(hr))
+        while pending:
+            n = int(rng.integers(1, chunk_max))
+            yield ts, pending[:n]
+            pending = pending[n:]
+        i += 1
+
+
+def paced(chunks, speed=1.0):
+    """按记录时间戳的 1/speed 节奏产出字节块; speed <= 0 不限速。"""
+    t0_wall = t0_rec = None
+    for ts, data in chunks:
+        if speed > 0:
+            if t0_wall is None:
+                t0_wall, t0_rec = time.perf_counter(), ts
+            delay = (ts - t0_rec) / speed - (time.perf_counter() - t0_wall)
+            if delay > 0:
+                time.sleep(delay)
+        yield data
+
+
+# -------------------- 链路 --------------------
+
+class SerialLink:
+    """pyserial 链路: 阻塞到至少 1 字节或超时, 再取走驱动缓冲里的全部字节。"""
+
+    def __init__(self, port, baud, timeout=0.1):
+        import serial
+        self.name = f"serial:{port}@{baud}"
+        self._ser = serial.Serial(port, baud, timeout=timeout)
+
+    def read_chunk(self):
+        data = self._ser.read(1)
+        if data:
+            n = self._ser.in_waiting
+            if n:
+                data += self._ser.read(n)
+        return data
+
+    def close(self):
+        try:
+            if self._ser.is_open:
+                self._ser.close()
+        except Exception:
+            pass
+
+
+class TcpLink:
+
+    def __init__(self, host, port, timeout=0.1, bufsize=65536):
+        self.name = f"tcp:{host}:{port}"
+        self.bufsize = bufsize
+        self._sock = socket.create_connection((host, port), timeout=5.0)
+        self._sock.settimeout(timeout)
+
+    def read_chunk(self):
+        try:
+            data = self._sock.recv(self.bufsize)
+        except socket.timeout:
+            return b""
+        if not data:
+            raise ConnectionError("对端已关闭连接")
+        return data
+
+    def close(self):
+        try:
+            self._sock.close()
+        except Exception:
+            pass
+
+
+class _IterLink:
+    """把字节块迭代器包装成链路; 迭代结束后按超时空转。"""
+
+    def __init__(self, name, chunks, timeout=0.1):
+        self.name = name
+        self.timeout = timeout
+        self._it = chunks
+
+    def read_chunk(self):
+        if self._it is None:
+            time.sleep(self.timeout)
+            return b""
+        try:
+            return next(self._it)
+        except StopIteration:
+            self._it = None
+            print("%s 回放结束" % self.name)
+            return b""
+
+    def close(self):
+        self._it = None
+
+
+class ReplayLink(_IterLink):
+
+    def __init__(self, path, speed=1.0, timeout=0.1):
+        chunks = paced(iter_capture(path), speed)
+        super().__init__(f"replay:{os.path.basename(path)}x{speed:g}", chunks, timeout)
+
+
+class SimulatedLink(_IterLink):
+
+    def __init__(self, seed=None, speed=1.0, timeout=0.1):
+        super().__init__("sim", paced(synth_chunks(seed), speed), timeout)
+
+
+def open_link(spec, baud=115200, timeout=0.1, speed=1.0):
+    """按描述串打开链路 (见模块说明)。"""
+    kind, _, rest = spec.partition(":")
+    if kind == "serial":
+        return SerialLink(rest, baud, timeout)
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        return TcpLink(host or "127.0.0.1", int(port), timeout)
+    if kind == "replay":
+        return ReplayLink(rest, speed, timeout)
+    if kind == "sim":
+        return SimulatedLink(speed=speed, timeout=timeout)
+    raise ValueError(f"未知链路: {spec}")
+
+
+# -------------------- 推流替身 --------------------
+
+def serve_tcp(chunks, port, host="127.0.0.1"):
+    """等待一个客户端 (hlkk 的 tcp: 链路) 连接后推送全部字节块。"""
+    with socket.create_server((host, port)) as srv:
+        print("[TCP] 等待连接 %s:%d ..." % (host, port))
+        conn, addr = srv.accept()
+        with conn:
+            print("[TCP] 已连接 %s:%d" % addr)
+            return _push(chunks, conn.sendall)
+
+
+def serve_pty(chunks):
+    """创建 pty, 从端路径作为 hlkk 的 serial: 端口, 主端写入字节块。"""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    print("[PTY] 串口路径: %s  (RADAR_LINK = \"serial:%s\")" % (os.ttyname(slave), os.ttyname(slave)))
+    input("[PTY] hlkk 连接后按回车开始推流...")
+    try:
+        return _push(chunks, lambda b: os.write(master, b))
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+def _push(chunks, write):
+    t0 = time.perf_counter()
+    total = 0
+    for data in chunks:
+        write(data)
+        total += len(data)
+    wall = time.perf_counter() - t0
+    print("[OK] 推送 %d 字节 / %.2fs (%.0f B/s, 115200 波特率约 11520 B/s)"
+          % (total, wall, total / wall if wall > 0 else 0.0))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HLK 雷达推流替身 (TCP / pty)")
+    parser.add_argument("source", help=".hlkcap 录制文件, 或 sim (合成帧流)")
+    parser.add_argument("--tcp", type=int, help="在该端口提供 TCP 推流")
+    parser.add_argument("--pty", action="store_true", help="通过伪终端推流")
+    parser.add_argument("--speed", type=float, default=1.0, help="N 倍实时, 0 为不限速")
+    parser.add_argument("--seconds", type=float, default=60.0, help="sim 模式的时长")
+    args = parser.parse_args()
+
+    if args.source == "sim":
+        src = itertools.takewhile(lambda c: c[0] < args.seconds, synth_chunks(seed=0))
+    else:
+        src = iter_capture(args.source)
+    chunks = paced(src, args.speed)
+    if args.tcp:
+        serve_tcp(chunks, args.tcp)
+    elif args.pty:
+        serve_pty(chunks)
+    else:
+        parser.error("需要 --tcp 或 --pty")
+
+
+if __name__ == '__main__':
+    main()
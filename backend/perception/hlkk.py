@@ -1,13 +1,20 @@
 # -*- coding: utf-8 -*-
-import struct
-import serial
 import time
 import json
 import threading
 import os
 import numpy as np
-from flask import Flask, render_template, jsonify, request
+from collections import deque, namedtuple
+from flask import Flask, Response, render_template, jsonify, request
 import logging
+from jsonl_log import JsonlLogWriter
+import hlk_protocol as hlk
+from hlk_capture import CaptureWriter
+from hlk_ingest import ChunkQueue, IngestStats, RadarReader
+from hlk_transport import open_link
+from hlk_history import RadarHistory
+from ring_buffer import RingBuffer
+from hlk_spectral import PhaseRateEstimator, HR_MIN_SNR_DB, BR_MIN_SNR_DB
 
 logging.getLogger('werkzeug').setLevel(logging.CRITICAL)
 logging.getLogger('flask').setLevel(logging.CRITICAL)
@@ -15,8 +22,19 @@ logging.basicConfig(level=logging.CRITICAL)
 
 PORT = "COM9"
 BAUD = 115200
+# 雷达链路, 格式见 hlk_transport: serial:COM9 / tcp:host:port / replay:x.hlkcap / sim
+RADAR_LINK = "serial:" + PORT
+# 多雷达: 传感器 ID → 链路; 所有传感器共用一个 HTTP 服务、处理线程和日志写线程
+# 例: {"bed1": "serial:COM9", "bed2": "serial:COM10", "door": "tcp:192.168.1.50:6000"}
+# 第一个为默认传感器 (/data 不带 sensor 参数时、health.json)
+RADAR_SENSORS = {"0": RADAR_LINK}
+REPLAY_SPEED = 1.0              # replay/sim 链路的 N 倍实时, 0 为不限速
+# 读线程 → 处理线程的有界队列 (所有传感器共用); 丢弃策略见 hlk_ingest
+SERIAL_READ_TIMEOUT = 0.1
+INGEST_QUEUE_SIZE = 256
+INGEST_DROP_POLICY = 'drop_oldest'     # 'drop_oldest' / 'drop_newest' / 'block'
 HTTP_PORT = 5020
-SIMULATE_MODE = False
+SIMULATE_MODE = False          # True 时所有传感器使用 sim 链路
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 HEALTHDATA_DIR = os.path.join(SCRIPT_DIR, 'healthdata')
 os.makedirs(HEALTHDATA_DIR, exist_ok=True)
@@ -26,22 +44,28 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(SCRIPT_DIR))
 FRONTEND_CORE_DIR = os.path.join(PROJECT_ROOT, 'frontend', 'core')
 os.makedirs(FRONTEND_CORE_DIR, exist_ok=True)
 
+# 日志为追加写 JSON Lines, 后台线程批量落盘, 每条记录带 "sensor";
+# 需要旧的数组格式时用 jsonl_log.read_jsonl / convert_to_json
 start_time = time.strftime("%Y%m%d-%H%M%S")
-RAW_LOG_FILE = os.path.join(HEALTHDATA_DIR, f"{start_time}raw.json")
-ANALYSIS_LOG_FILE = os.path.join(HEALTHDATA_DIR, f"{start_time}analysis.json")
+RAW_LOG_FILE = os.path.join(HEALTHDATA_DIR, f"{start_time}raw.jsonl")
+ANALYSIS_LOG_FILE = os.path.join(HEALTHDATA_DIR, f"{start_time}analysis.jsonl")
+LOG_FSYNC = 'interval'          # 'always' / 'interval' / 'never'
+LOG_MAX_BYTES = 64 * 1024 * 1024
 
-raw_log_data = []
-analysis_log_data = []
+# 录制原始串口字节, 供 hlkk_replay.py 离线回放; 每个传感器一个文件
+CAPTURE_RAW = False
+CAPTURE_FILE = os.path.join(HEALTHDATA_DIR, f"{start_time}-{{sensor}}.hlkcap")
 
-with open(RAW_LOG_FILE, 'w', encoding='utf-8') as f:
-    json.dump(raw_log_data, f, ensure_ascii=False, indent=2)
-with open(ANALYSIS_LOG_FILE, 'w', encoding='utf-8') as f:
-    json.dump(analysis_log_data, f, ensure_ascii=False, indent=2)
+raw_log = JsonlLogWriter(RAW_LOG_FILE, fsync=LOG_FSYNC,
+                         max_bytes=LOG_MAX_BYTES)
+analysis_log = JsonlLogWriter(ANALYSIS_LOG_FILE, fsync=LOG_FSYNC,
+                              max_bytes=LOG_MAX_BYTES)
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
 # ========== 全局数据存储 ==========
-latest_data = {
+# 每个传感器的逐帧状态见 RadarSensor, 这里是初始值
+LATEST_INIT = {
     "heart_rate": 72.0,
     "breath_rate": 16.0,
     "heart_phase": 0.0,
@@ -56,38 +80,12 @@ latest_data = {
 }
 
 MAX_HISTORY = 600
-heart_phase_history = [0.0] * MAX_HISTORY
-breath_phase_history = [0.0] * MAX_HISTORY
-
-display_hr_history = [72.0] * MAX_HISTORY
-display_br_history = [16.0] * MAX_HISTORY
-signal_state_history = ["INIT"] * MAX_HISTORY
-
-clean_hr_history = [72.0] * MAX_HISTORY
-clean_br_history = [16.0] * MAX_HISTORY
-
-last_valid_hr = 72.0
-last_valid_br = 16.0
-
-rt_hr_valid_history = [True] * MAX_HISTORY
-rt_br_valid_history = [True] * MAX_HISTORY
-rt_phase_valid_history = [True] * MAX_HISTORY
-lissajous_history = []
-current_preprocessor_output = None
+LISSAJOUS_LEN = 500
 
 # 指标历史趋势
 TREND_LEN = 600
-plv_trend = []
-brv_trend = []
-hrr_trend = []
-cr_ratio_trend = []
-hr_slope_trend = []
-phase_diff_trend = []
-br_elevation_trend = []
-trend_signal_state_history = []
-trend_hr_valid_history = []
-trend_br_valid_history = []
-trend_phase_valid_history = []
+TREND_KEYS = ("plv", "phase_diff", "brv", "hrr", "cr_ratio", "hr_slope",
+              "br_elevation", "signal_state", "hr_valid", "br_valid", "phase_valid")
 
 # ========== 年龄和性别数据处理 ==========
 # 从perception接收的年龄和性别数据队列
@@ -107,14 +105,65 @@ fallback_to_input = False  # 是否由于perception超时回退到input模式
 
 # ========== PhasePreprocessor ==========
 class PhasePreprocessor:
+    """相位解缠 + 重采样到 target_fs 的均匀网格。
+
+    每来一个雷达样本只对新落入的网格点做线性插值并追加到环形缓冲区,
+    不再整窗 roll / 重插值; 输出始终是最近 window 个均匀样本 (window / fs 秒)。
+    on_samples(grid_ts, hr_new, br_new): 每批新网格样本的回调 (频谱估计)。
+    """
 
-    def __init__(self, window_size=100, target_fs=10.0):
+    TWO_PI = 2 * np.pi
+
+    def __init__(self, window_size=100, target_fs=10.0, on_samples=None):
         self.window = window_size
         self.fs = target_fs
-        self.hr_phase_buf = np.zeros(window_size, dtype=np.float64)
-        self.br_phase_buf = np.zeros(window_size, dtype=np.float64)
-        self.ts_buf = np.linspace(-window_size / target_fs, 0, window_size)
+        self.dt = 1.0 / target_fs
+        self.on_samples = on_samples
+        self.hr_uni = RingBuffer(window_size)
+        self.br_uni = RingBuffer(window_size)
         self.initialized = False
+        self._last = None           # 上一个原始样本 (ts, hr_phase, br_phase), 已解缠
+        self._next_grid = 0.0       # 下一个待输出的网格时间
+
+    def _unwrap(self, phase, prev):
+        # 与 np.unwrap 相同: 相邻差值折回 [-pi, pi]
+        return phase - self.TWO_PI * np.round((phase - prev) / self.TWO_PI)
+
+    def _resample(self, ts, hr_phase, br_phase):
+        t0, hr0, br0 = self._last
+        if ts <= t0:
+            return
+        n = int(np.floor((ts - self._next_grid) * self.fs)) + 1
+        if n <= 0:
+            return
+        if n > self.window:
+            # 长时间断流: 只补最近一窗
+            self._next_grid += (n - self.window) * self.dt
+            n = self.window
+        grid = self._next_grid + np.arange(n) * self.dt
+        w = (grid - t0) / (ts - t0)
+        hr_new = hr0 + (hr_phase - hr0) * w
+        br_new = br0 + (br_phase - br0) * w
+        self.hr_uni.extend(hr_new)
+        self.br_uni.extend(br_new)
+        self._next_grid = grid[-1] + self.dt
+        if self.on_samples is not None:
+            self.on_samples(grid, hr_new, br_new)
+
+    def push(self, hr_phase, br_phase, ts):
+        """只做解缠和重采样, 不生成输出"""
+        if self.initialized:
+            _, hr_prev, br_prev = self._last
+            hr_phase = self._unwrap(hr_phase, hr_prev)
+            br_phase = self._unwrap(br_phase, br_prev)
+            self._resample(ts, hr_phase, br_phase)
+        else:
+            self.initialized = True
+            self.hr_uni.fill(hr_phase)
+            self.br_uni.fill(br_phase)
+            self._next_grid = ts + self.dt
+        if self._last is None or ts > self._last[0]:
+            self._last = (ts, hr_phase, br_phase)
 
     def feed(self, hr_phase, br_phase, ts, current_hr=None, current_br=None):
         """
@@ -126,35 +175,10 @@ class PhasePreprocessor:
         返回:
             instant_hr, instant_br, hr_uni, br_uni
         """
-        if self.initialized:
-            diff_hr = hr_phase - self.hr_phase_buf[-1]
-            while diff_hr > np.pi:
-                hr_phase -= 2 * np.pi
-                diff_hr -= 2 * np.pi
-            while diff_hr < -np.pi:
-                hr_phase += 2 * np.pi
-                diff_hr += 2 * np.pi
-
-            diff_br = br_phase - self.br_phase_buf[-1]
-            while diff_br > np.pi:
-                br_phase -= 2 * np.pi
-                diff_br -= 2 * np.pi
-            while diff_br < -np.pi:
-                br_phase += 2 * np.pi
-                diff_br += 2 * np.pi
-        else:
-            self.initialized = True
-
-        self.hr_phase_buf = np.roll(self.hr_phase_buf, -1)
-        self.hr_phase_buf[-1] = hr_phase
-        self.br_phase_buf = np.roll(self.br_phase_buf, -1)
-        self.br_phase_buf[-1] = br_phase
-        self.ts_buf = np.roll(self.ts_buf, -1)
-        self.ts_buf[-1] = ts
+        self.push(hr_phase, br_phase, ts)
 
-        uniform_ts = np.linspace(self.ts_buf[0], self.ts_buf[-1], self.window)
-        hr_uni = np.interp(uniform_ts, self.ts_buf, self.hr_phase_buf)
-        br_uni = np.interp(uniform_ts, self.ts_buf, self.br_phase_buf)
+        hr_uni = self.hr_uni.snapshot()
+        br_uni = self.br_uni.snapshot()
 
         # ---- 修复: 用雷达直出值生成 synthetic 瞬时波形 ----
         # 相位波形保留用于 RSA/PLV 计算，频率值使用雷达直出
@@ -163,16 +187,8 @@ class PhasePreprocessor:
 
         # 基于相位波形生成带调制的 synthetic 信号
         # 这样 RSA（呼吸对心率的调制）仍然可以正确计算
-        instant_hr = np.zeros(self.window, dtype=np.float64)
-        instant_br = np.zeros(self.window, dtype=np.float64)
-
-        for i in range(self.window):
-            # 心率微小波动
-            instant_hr[i] = hr_base + np.random.normal(0, 0.3)
-
-            # 呼吸率微小波动
-            br_mod = 1.0 * np.sin(br_uni[i])
-            instant_br[i] = br_base + br_mod + np.random.normal(0, 0.15)
+        instant_hr = hr_base + np.random.normal(0, 0.3, self.window)
+        instant_br = br_base + np.sin(br_uni) + np.random.normal(0, 0.15, self.window)
 
         instant_hr = np.clip(instant_hr, 30, 200)
         instant_br = np.clip(instant_br, 3, 40)
@@ -261,12 +277,11 @@ class PhysioEngine:
 
     def calc_hr_slope(self, hr_raw_history):
         """[09] 心率变化斜率 bpm/s"""
-        data = list(hr_raw_history[-10:])
-        data = [d for d in data if d > 0]
-        if len(data) < 5:
+        y = np.asarray(hr_raw_history[-10:], dtype=np.float64)
+        y = y[y > 0]
+        if len(y) < 5:
             return 0.0
-        x = np.arange(len(data), dtype=np.float64)
-        y = np.array(data, dtype=np.float64)
+        x = np.arange(len(y), dtype=np.float64)
         n = len(x)
         denom = n * np.sum(x ** 2) - np.sum(x) ** 2
         if denom == 0:
@@ -274,75 +289,97 @@ class PhysioEngine:
         slope = (n * np.sum(x * y) - np.sum(x) * np.sum(y)) / denom
         return round(float(slope), 2)
 
+    def calc_batch(self, hr, br, clean_hr, clean_br, hr_uni, br_uni):
+        """多个传感器一次算完 [02]-[07]、[09], 结果与逐个调用 calc_* 相同
+
+        hr, br: (S,) 当前心率/呼吸率; clean_hr: (S, >=10); clean_br: (S, L)
+        hr_uni, br_uni: (S, N) 均匀相位
+        返回 {指标名: (S,) 数组}
+        """
+        hr = np.asarray(hr, dtype=np.float64)
+        br = np.asarray(br, dtype=np.float64)
+        zeros = np.zeros_like(hr)
+
+        # [02][03] 相位差的圆均值
+        delta = hr_uni - br_uni
+        x = np.cos(delta).mean(axis=1)
+        y = np.sin(delta).mean(axis=1)
+        plv = np.hypot(x, y)
+        phase_diff = np.arctan2(y, x)
+
+        # [04] 最近 300 个呼吸率的 CV%
+        data = clean_br[:, -300:]
+        mean_val = data.mean(axis=1)
+        brv = zeros.copy()
+        ok = mean_val > 0
+        if data.shape[1] >= 100:
+            brv[ok] = data[ok].std(axis=1) / mean_val[ok] * 100
+
+        # [05][06][07]
+        if self.br_rest_est > 0:
+            br_elev = np.round((br - self.br_rest_est) / self.br_rest_est * 100, 1)
+        else:
+            br_elev = zeros.copy()
+        denom = self.hr_max - self.hr_rest_est
+        hrr = np.round((hr - self.hr_rest_est) / denom * 100, 1) if denom > 0 else zeros.copy()
+        cr = zeros.copy()
+        ok = br > 0
+        cr[ok] = np.round(hr[ok] / br[ok], 2)
+
+        # [09] 最近 10 个心率中 >0 的样本按出现顺序编号做最小二乘
+        yv = clean_hr[:, -10:]
+        mask = yv > 0
+        n = mask.sum(axis=1)
+        xv = np.where(mask, np.cumsum(mask, axis=1) - 1, 0).astype(np.float64)
+        yv = np.where(mask, yv, 0.0)
+        sx = xv.sum(axis=1)
+        sy = yv.sum(axis=1)
+        denom = n * (xv * xv).sum(axis=1) - sx ** 2
+        slope = zeros.copy()
+        ok = (n >= 5) & (denom != 0)
+        slope[ok] = np.round((n * (xv * yv).sum(axis=1) - sx * sy)[ok] / denom[ok], 2)
+
+        return {"plv": plv, "phase_diff": phase_diff, "brv": brv,
+                "br_elevation": br_elev, "hrr": hrr, "cr_ratio": cr,
+                "hr_slope": slope}
+
 
 # ========== 初始化 ==========
-preprocessor = PhasePreprocessor(window_size=100, target_fs=10.0)
+# 频谱心率/呼吸率: 独立的相位重采样, 不受 validate_and_update 的状态门控, BIG_MOVE 期间也在积累
+# RATE_SOURCE: 'device' 只用雷达直出 / 'spectral' 只用频谱估计 / 'auto' 直出无效时回退频谱
+# 默认保持设备直出; 频谱值只在峰值信噪比超过按噪声标定的阈值 (hlk_spectral) 时采用
+RATE_SOURCE = 'device'
+# 年龄/性别画像按房间共用, 所有传感器共用一个引擎
 current_age = 60
 current_gender = 'male'
 engine = PhysioEngine(age=current_age, gender=current_gender)
 
 
-def save_to_json():
+def save_to_json(sensor, snap):
     try:
         data = {
             "timestamp": time.time(),
-            "latest": latest_data.copy(),
+            "sensor": sensor.id,
+            "latest": sensor.latest.copy(),
             "analysis": {}
         }
-        
-        hrr_val = 0.0
-        brv_val = 0.0
-        cr_val = 0.0
-        slope_val = 0.0
-        plv_val = 0.0
-        br_elev_val = 0.0
-        
-        if current_preprocessor_output is not None:
-            inst_hr, inst_br, hr_uni, br_uni = current_preprocessor_output
-            hr_now = float(latest_data["heart_rate"])
-            br_now = float(latest_data["breath_rate"]) if latest_data["breath_rate"] > 0 else 0.0
-            
-            hrr_val = engine.calc_hrr(hr_now)
-            brv_val = engine.calc_brv(clean_br_history)
-            cr_val = engine.calc_cr_ratio(hr_now, br_now)
-            slope_val = engine.calc_hr_slope(clean_hr_history)
-            plv_val = engine.calc_plv(hr_uni, br_uni)
-            br_elev_val = engine.calc_br_elevation(br_now)
-        
-        data["analysis"] = {
-            "hrr": round(hrr_val, 1),
-            "hrr_label": get_hrr_label(hrr_val),
-            "brv": round(brv_val, 2),
-            "brv_label": get_brv_label(brv_val),
-            "cr": round(cr_val, 2),
-            "cr_label": get_cr_label(cr_val),
-            "slope": round(slope_val, 2),
-            "slope_label": get_slope_label(slope_val),
-            "plv": round(plv_val, 3),
-            "plv_label": get_plv_label(plv_val),
-            "brel": round(br_elev_val, 1),
-            "brel_label": get_brel_label(br_elev_val)
-        }
+        physio = snap.result["physiology"]
+        for key, src, label in ANALYSIS_FIELDS:
+            val = physio[src] if physio[src] is not None else 0.0
+            data["analysis"][key] = val
+            data["analysis"][key + "_label"] = label(val)
+        return data
     except Exception as e:
         print("保存JSON失败: %s" % str(e))
 
 
-def save_logs():
-    global raw_log_data, analysis_log_data
-    try:
-        with open(RAW_LOG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(raw_log_data, f, ensure_ascii=False, indent=2)
-        with open(ANALYSIS_LOG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(analysis_log_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print("保存日志失败: %s" % str(e))
-
-
-def save_realtime_health(result):
+def save_realtime_health(sensor, result):
     try:
+        latest_data = sensor.latest
         # 构建简化的 health.json 数据结构
         data = {
             "time": time.time(),
+            "sensor": sensor.id,
             "hr": float(latest_data["heart_rate"]),
             "br": float(latest_data["breath_rate"]),
             "hph": float(latest_data["heart_phase"]),
@@ -367,7 +404,7 @@ def save_realtime_health(result):
             "plv": 0.0,
             "plv_label": ""
         }
-        
+
         # 添加分析数据
         if result and "physiology" in result:
             physio = result["physiology"]
@@ -389,9 +426,10 @@ def save_realtime_health(result):
             if physio.get("plv_r") is not None:
                 data["plv"] = float(physio["plv_r"])
                 data["plv_label"] = get_plv_label(data["plv"])
-        
-        # 保存文件
-        health_json_path = os.path.join(FRONTEND_CORE_DIR, 'health.json')
+
+        # 保存文件: 默认传感器写 health.json (前端读取), 其余写 health_<ID>.json
+        name = 'health.json' if sensor.id == PRIMARY_SENSOR else f'health_{sensor.id}.json'
+        health_json_path = os.path.join(FRONTEND_CORE_DIR, name)
         with open(health_json_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
     except Exception as e:
@@ -458,477 +496,447 @@ def get_brel_label(brel):
         return "异常急促"
 
 
-def validate_and_update(ts):
-    global current_preprocessor_output, last_valid_hr, last_valid_br
-    global rt_hr_valid_history, rt_br_valid_history, rt_phase_valid_history
-    
-    raw_hr = latest_data["heart_rate"]
-    raw_br = latest_data["breath_rate"]
-    
-    state = "NORMAL"
-    final_hr = raw_hr
-    final_br = raw_br
-    
-    hr_valid = (40.0 <= raw_hr <= 180.0) and raw_hr != 0.0
-    br_valid = (6.0 <= raw_br <= 40.0) and raw_br != 0.0
-    phase_valid = (latest_data["is_human"] == 1 and 
-                   latest_data["distance_valid"] == 1 and 
-                   not (raw_hr == 0.0 and raw_br == 0.0))
-    
-    if latest_data["is_human"] == 0 or latest_data["distance_valid"] == 0:
-        state = "NO_TARGET"
-        final_hr = last_valid_hr if not hr_valid else raw_hr
-        final_br = last_valid_br
-        
-    elif raw_hr == 0.0 and raw_br == 0.0:
-        state = "BIG_MOVE"
-        final_hr = last_valid_hr
-        final_br = last_valid_br
-        
-    elif not hr_valid and not br_valid:
-        state = "BIG_MOVE"
-        final_hr = last_valid_hr
-        final_br = last_valid_br
-        
-    elif not br_valid:
-        state = "BR_UNSTABLE"
-        final_br = last_valid_br
-        final_hr = raw_hr if hr_valid else last_valid_hr
-        
-    elif not hr_valid:
-        state = "HR_UNSTABLE"
-        final_hr = last_valid_hr
-        final_br = raw_br if br_valid else last_valid_br
-        
-    elif len(display_br_history) >= 5:
-        br_low_count = sum(1 for br in display_br_history[-5:] if br < 6)
-        if br_low_count >= 3:
+# 分析日志字段: (日志键, 快照 physiology 键, 标签函数)
+ANALYSIS_FIELDS = (
+    ("hrr", "hrr_pct", get_hrr_label),
+    ("slope", "hr_slope", get_slope_label),
+    ("brv", "brv_cv", get_brv_label),
+    ("brel", "br_elevation", get_brel_label),
+    ("cr", "cr_ratio", get_cr_label),
+    ("plv", "plv_r", get_plv_label),
+)
+
+
+# ========== RadarSensor ==========
+class RadarSensor:
+    """单个雷达的全部状态: 链路读线程、帧解析、信号校验、历史、预处理、频谱估计、趋势和快照。
+
+    帧处理只在 ingest_thread 中进行; 生理指标由 compute_physiology 对所有传感器统一计算。
+    """
+
+    def __init__(self, sensor_id, link_spec, out_queue):
+        self.id = sensor_id
+        self.link_spec = link_spec
+        self.latest = dict(LATEST_INIT)
+        # 相位/显示值/有效标志/李萨如等逐帧历史, 见 hlk_history.RadarHistory
+        self.history = RadarHistory(capacity=MAX_HISTORY, lissajous_len=LISSAJOUS_LEN)
+        self.last_valid_hr = 72.0
+        self.last_valid_br = 16.0
+        self.preprocessor = PhasePreprocessor(window_size=100, target_fs=10.0)
+        self.preprocessor_output = None
+        self.rate_estimator = PhaseRateEstimator(fs=10.0)
+        self.rate_phase = PhasePreprocessor(window_size=10, target_fs=10.0,
+                                            on_samples=self.rate_estimator.push)
+        self.trends = {k: deque(maxlen=TREND_LEN) for k in TREND_KEYS}
+        self.snapshot = None
+
+        self.parser = hlk.HLKFrameParser()
+        self.stats = IngestStats()
+        self.reader = RadarReader(self._open_link, out_queue, self.stats,
+                                  name=f"radar-{sensor_id}", tag=sensor_id)
+        self.capture = None
+        self.ts = 0.0
+        self.last_save_time = None
+        self.handlers = {
+            hlk.TID_HUMAN: self._on_human,
+            hlk.TID_DISTANCE: self._on_distance,
+            hlk.TID_PHASE: self._on_phase,
+            hlk.TID_BREATH_RATE: self._on_breath_rate,
+            hlk.TID_HEART_RATE: self._on_heart_rate,
+        }
+
+    def _open_link(self):
+        return open_link("sim" if SIMULATE_MODE else self.link_spec, baud=BAUD,
+                         timeout=SERIAL_READ_TIMEOUT, speed=REPLAY_SPEED)
+
+    def start(self):
+        if CAPTURE_RAW and self.capture is None:
+            self.capture = CaptureWriter(CAPTURE_FILE.format(sensor=self.id))
+        self.reader.start()
+        return self
+
+    def stop(self):
+        """停止读取并关闭录制文件 (刷出最后不足 flush_interval 的数据)"""
+        self.reader.stop()
+        capture, self.capture = self.capture, None
+        if capture is not None:
+            capture.close()
+
+    # -------------------- 帧分发 --------------------
+
+    def _on_human(self, values, ts):
+        self.latest["is_human"] = values[0]
+
+    def _on_distance(self, values, ts):
+        self.latest["distance_valid"], self.latest["distance"] = values
+
+    def _on_phase(self, values, ts):
+        self.latest["breath_phase"], self.latest["heart_phase"] = values
+        self.feed_rate_phase(ts)
+
+    def _on_breath_rate(self, values, ts):
+        self.latest["breath_rate"] = values[0]
+
+    def _on_heart_rate(self, values, ts):
+        self.latest["heart_rate"] = values[0]
+        self.validate_and_update(ts)
+
+    def dispatch_frames(self, frames, ts):
+        for tid, values in frames:
+            self.handlers[tid](values, ts)
+
+    # -------------------- 信号校验 --------------------
+
+    def feed_rate_phase(self, ts):
+        """有目标时把相位送入频谱估计 (每个相位帧一次)"""
+        latest_data = self.latest
+        if latest_data["is_human"] == 1 and latest_data["distance_valid"] == 1:
+            self.rate_phase.push(latest_data["heart_phase"], latest_data["breath_phase"], ts)
+
+    def select_rates(self, device_hr, device_br):
+        """按 RATE_SOURCE 选择送入 validate_and_update 的心率/呼吸率"""
+        latest_data = self.latest
+        latest_data["hr_device"] = device_hr
+        latest_data["br_device"] = device_br
+        if RATE_SOURCE == 'device':
+            latest_data["rate_source"] = 'device'
+            return device_hr, device_br
+        est = self.rate_estimator.estimate()
+        spec_hr = est["hr"] if est["hr_snr"] >= HR_MIN_SNR_DB else 0.0
+        spec_br = est["br"] if est["br_snr"] >= BR_MIN_SNR_DB else 0.0
+        if RATE_SOURCE == 'spectral':
+            latest_data["rate_source"] = 'spectral'
+            return spec_hr, spec_br
+        # auto: 直出值为 0 或越界 (BIG_MOVE 等) 时用频谱值兜底
+        hr_ok = 40.0 <= device_hr <= 180.0
+        br_ok = 6.0 <= device_br <= 40.0
+        hr = device_hr if hr_ok or not spec_hr else spec_hr
+        br = device_br if br_ok or not spec_br else spec_br
+        latest_data["rate_source"] = 'device' if (hr == device_hr and br == device_br) else 'mixed'
+        return hr, br
+
+    def validate_and_update(self, ts):
+        latest_data = self.latest
+        history = self.history
+        last_valid_hr = self.last_valid_hr
+        last_valid_br = self.last_valid_br
+
+        raw_hr, raw_br = self.select_rates(latest_data["heart_rate"], latest_data["breath_rate"])
+
+        state = "NORMAL"
+        final_hr = raw_hr
+        final_br = raw_br
+
+        hr_valid = (40.0 <= raw_hr <= 180.0) and raw_hr != 0.0
+        br_valid = (6.0 <= raw_br <= 40.0) and raw_br != 0.0
+        phase_valid = (latest_data["is_human"] == 1 and
+                       latest_data["distance_valid"] == 1 and
+                       not (raw_hr == 0.0 and raw_br == 0.0))
+
+        if latest_data["is_human"] == 0 or latest_data["distance_valid"] == 0:
+            state = "NO_TARGET"
+            final_hr = last_valid_hr if not hr_valid else raw_hr
+            final_br = last_valid_br
+
+        elif raw_hr == 0.0 and raw_br == 0.0:
+            state = "BIG_MOVE"
+            final_hr = last_valid_hr
+            final_br = last_valid_br
+
+        elif not hr_valid and not br_valid:
+            state = "BIG_MOVE"
+            final_hr = last_valid_hr
+            final_br = last_valid_br
+
+        elif not br_valid:
             state = "BR_UNSTABLE"
             final_br = last_valid_br
             final_hr = raw_hr if hr_valid else last_valid_hr
-            
-    elif abs(raw_hr - last_valid_hr) > 20.0:
-        if hr_valid:
-            state = "THAW"
-            final_hr = raw_hr
-            final_br = last_valid_br if not br_valid else raw_br
-        else:
+
+        elif not hr_valid:
             state = "HR_UNSTABLE"
             final_hr = last_valid_hr
             final_br = raw_br if br_valid else last_valid_br
-            
-    elif abs(raw_br - last_valid_br) > 8.0:
-        if br_valid:
-            state = "BR_UNSTABLE"
-            final_br = raw_br
-            final_hr = raw_hr if hr_valid else last_valid_hr
-        else:
-            state = "BR_UNSTABLE"
-            final_br = last_valid_br
-            final_hr = raw_hr if hr_valid else last_valid_hr
-    
-    if len(display_hr_history) >= 5:
-        recent = display_hr_history[-5:]
-        if all(h == recent[0] for h in recent) and recent[0] > 0:
-            if abs(raw_hr - recent[0]) > 20 and 40 <= raw_hr <= 180:
-                final_hr = raw_hr
+
+        elif len(history.display_br) >= 5:
+            br_low_count = int(np.count_nonzero(history.display_br.view(5) < 6))
+            if br_low_count >= 3:
+                state = "BR_UNSTABLE"
+                final_br = last_valid_br
+                final_hr = raw_hr if hr_valid else last_valid_hr
+
+        elif abs(raw_hr - last_valid_hr) > 20.0:
+            if hr_valid:
                 state = "THAW"
-    
-    latest_data["signal_state"] = state
-    latest_data["heart_rate"] = final_hr
-    latest_data["breath_rate"] = final_br
-    
-    display_hr_history.append(final_hr)
-    display_br_history.append(final_br)
-    rt_hr_valid_history.append(hr_valid)
-    rt_br_valid_history.append(br_valid)
-    rt_phase_valid_history.append(phase_valid)
-    heart_phase_history.append(latest_data["heart_phase"])
-    breath_phase_history.append(latest_data["breath_phase"])
-    lissajous_history.append([float(latest_data["breath_phase"]), float(latest_data["heart_phase"])])
-    
-    if state == "NORMAL":
-        last_valid_hr = raw_hr
-        last_valid_br = raw_br
-        clean_hr_history.append(raw_hr)
-        clean_br_history.append(raw_br)
-    elif state == "THAW":
-        last_valid_hr = final_hr
-        if br_valid:
-            last_valid_br = raw_br
-            clean_br_history.append(raw_br)
-        clean_hr_history.append(final_hr)
-    elif state == "BR_UNSTABLE":
-        if hr_valid:
-            last_valid_hr = raw_hr
-            clean_hr_history.append(raw_hr)
-    elif state == "HR_UNSTABLE":
-        if br_valid:
-            last_valid_br = raw_br
-            clean_br_history.append(raw_br)
-    
-    for lst in [display_hr_history, display_br_history, signal_state_history,
-                heart_phase_history, breath_phase_history,
-                clean_hr_history, clean_br_history,
-                rt_hr_valid_history, rt_br_valid_history, rt_phase_valid_history]:
-        if len(lst) > MAX_HISTORY:
-            lst.pop(0)
-    if len(lissajous_history) > 500:
-        lissajous_history.pop(0)
-    
-    latest_data["hr_valid"] = hr_valid
-    latest_data["br_valid"] = br_valid
-    latest_data["phase_valid"] = phase_valid
+                final_hr = raw_hr
+                final_br = last_valid_br if not br_valid else raw_br
+            else:
+                state = "HR_UNSTABLE"
+                final_hr = last_valid_hr
+                final_br = raw_br if br_valid else last_valid_br
+
+        elif abs(raw_br - last_valid_br) > 8.0:
+            if br_valid:
+                state = "BR_UNSTABLE"
+                final_br = raw_br
+                final_hr = raw_hr if hr_valid else last_valid_hr
+            else:
+                state = "BR_UNSTABLE"
+                final_br = last_valid_br
+                final_hr = raw_hr if hr_valid else last_valid_hr
+
+        if len(history.display_hr) >= 5:
+            recent = history.display_hr.view(5)
+            if np.all(recent == recent[0]) and recent[0] > 0:
+                if abs(raw_hr - recent[0]) > 20 and 40 <= raw_hr <= 180:
+                    final_hr = raw_hr
+                    state = "THAW"
+
+        latest_data["signal_state"] = state
+        latest_data["heart_rate"] = final_hr
+        latest_data["breath_rate"] = final_br
+
+        with history.lock:
+            history.record(final_hr, final_br, state, hr_valid, br_valid,
+                           phase_valid, float(latest_data["heart_phase"]),
+                           float(latest_data["breath_phase"]))
+
+            if state == "NORMAL":
+                last_valid_hr = raw_hr
+                last_valid_br = raw_br
+                history.clean_hr.append(raw_hr)
+                history.clean_br.append(raw_br)
+            elif state == "THAW":
+                last_valid_hr = final_hr
+                if br_valid:
+                    last_valid_br = raw_br
+                    history.clean_br.append(raw_br)
+                history.clean_hr.append(final_hr)
+            elif state == "BR_UNSTABLE":
+                if hr_valid:
+                    last_valid_hr = raw_hr
+                    history.clean_hr.append(raw_hr)
+            elif state == "HR_UNSTABLE":
+                if br_valid:
+                    last_valid_br = raw_br
+                    history.clean_br.append(raw_br)
+
+        self.last_valid_hr = last_valid_hr
+        self.last_valid_br = last_valid_br
+        latest_data["hr_valid"] = hr_valid
+        latest_data["br_valid"] = br_valid
+        latest_data["phase_valid"] = phase_valid
+
+        if state not in ["NO_TARGET", "BIG_MOVE"]:
+            feed_hr = raw_hr if hr_valid else last_valid_hr
+            feed_br = raw_br if br_valid else last_valid_br
+            self.preprocessor_output = self.preprocessor.feed(
+                latest_data["heart_phase"],
+                latest_data["breath_phase"],
+                ts,
+                current_hr=feed_hr,
+                current_br=feed_br
+            )
+
+        return state in ["NORMAL", "BR_UNSTABLE", "HR_UNSTABLE", "THAW"]
+
+    # -------------------- 结果组装 --------------------
+
+    def build_result(self, physio, profile):
+        """用批量计算出的本传感器指标 (标量 dict) 组装结果并推进趋势, 只由 compute_physiology 调用"""
+        latest_data = self.latest
+        trends = self.trends
+
+        def carry(key, default):
+            trends[key].append(trends[key][-1] if trends[key] else default)
+
+        hr_now = float(latest_data["heart_rate"])
+        br_now = float(latest_data["breath_rate"]) if latest_data["breath_rate"] > 0 else 0.0
+        rt = self.history.snapshot(200, lissajous_n=300)
+
+        result = {
+            "sensor": self.id,
+            "raw": {
+                "hr": hr_now, "br": br_now,
+                "hr_phase": latest_data["heart_phase"],
+                "br_phase": latest_data["breath_phase"],
+                "signal_state": latest_data["signal_state"],
+                "is_human": latest_data["is_human"],
+                "distance_valid": latest_data["distance_valid"],
+                "distance": latest_data["distance"],
+                "hr_valid": latest_data.get("hr_valid", False),
+                "br_valid": latest_data.get("br_valid", False),
+                "phase_valid": latest_data.get("phase_valid", False)
+            },
+            "rates": dict(self.rate_estimator.estimate(),
+                          source=latest_data.get("rate_source", "device"),
+                          hr_device=latest_data.get("hr_device"),
+                          br_device=latest_data.get("br_device")),
+            "signals": {
+                "inst_hr": [], "inst_br": [],
+                "lissajous": [], "phase_diff_circ": []
+            },
+            "physiology": {
+                "plv_r": None, "mean_phase_diff": None,
+                "brv_cv": None, "br_elevation": None,
+                "hr_slope": None,
+                "hrr_pct": None, "cr_ratio": None
+            },
+            "profile": profile,
+            "trends": {}
+        }
+        out = result["physiology"]
 
-    if state not in ["NO_TARGET", "BIG_MOVE"]:
-        feed_hr = raw_hr if hr_valid else last_valid_hr
-        feed_br = raw_br if br_valid else last_valid_br
-        current_preprocessor_output = preprocessor.feed(
-            latest_data["heart_phase"],
-            latest_data["breath_phase"],
-            ts,
-            current_hr=feed_hr,
-            current_br=feed_br
-        )
+        # === 原子化计算：按依赖关系分层 ===
 
-    return state in ["NORMAL", "BR_UNSTABLE", "HR_UNSTABLE", "THAW"]
+        # 第1层：只依赖HR（hr_valid就计算）
+        if latest_data.get("hr_valid", False):
+            out["hrr_pct"] = round(physio["hrr"], 1)
+            out["hr_slope"] = round(physio["hr_slope"], 2)
+            trends["hrr"].append(out["hrr_pct"])
+            trends["hr_slope"].append(out["hr_slope"])
+        else:
+            carry("hrr", None)
+            carry("hr_slope", None)
+
+        # 第2层：只依赖BR（br_valid就计算）
+        if latest_data["br_valid"]:
+            out["br_elevation"] = round(physio["br_elevation"], 1)
+            out["brv_cv"] = round(physio["brv"], 2)
+            trends["br_elevation"].append(out["br_elevation"])
+            trends["brv"].append(out["brv_cv"])
+        else:
+            carry("br_elevation", 0.0)
+            carry("brv", 0.0)
+
+        trends["signal_state"].append(latest_data["signal_state"])
+        trends["hr_valid"].append(latest_data["hr_valid"])
+        trends["br_valid"].append(latest_data["br_valid"])
+        trends["phase_valid"].append(latest_data["phase_valid"])
+
+        # 第3层：同时需要HR和BR
+        if latest_data["hr_valid"] and latest_data["br_valid"]:
+            out["cr_ratio"] = round(physio["cr_ratio"], 2)
+            trends["cr_ratio"].append(out["cr_ratio"])
+        else:
+            carry("cr_ratio", None)
 
+        # 第4层：需要相位稳定
+        if self.preprocessor_output is not None:
+            inst_hr, inst_br, hr_uni, br_uni = self.preprocessor_output
 
-def verify_cksum(buf, cksum):
-    acc = 0
-    for b in buf:
-        acc ^= b
-    return (~acc & 0xFF) == cksum
+            result["signals"]["inst_hr"] = [round(v, 1) for v in inst_hr.tolist()[-100:]]
+            result["signals"]["inst_br"] = [round(v, 1) for v in inst_br.tolist()[-100:]]
+            result["signals"]["lissajous"] = rt["lissajous"]
 
+            if latest_data["phase_valid"]:
+                out["plv_r"] = round(physio["plv"], 3)
+                out["mean_phase_diff"] = round(physio["phase_diff"], 3)
 
-def float_le(b):
-    return struct.unpack('<f', b)[0]
+                delta_phase = hr_uni[-50:] - br_uni[-50:]
+                result["signals"]["phase_diff_circ"] = np.round(
+                    np.column_stack((np.cos(delta_phase), np.sin(delta_phase))), 3).tolist()
 
+                trends["plv"].append(out["plv_r"])
+                trends["phase_diff"].append(out["mean_phase_diff"])
+            else:
+                carry("plv", None)
+                carry("phase_diff", None)
 
-def simulate_thread():
-    global current_preprocessor_output, lissajous_history, raw_log_data, analysis_log_data
-    print("模拟模式: 生成虚拟生理数据...")
-    
-    ts = time.time()
-    hr_phase = 0.0
-    br_phase = 0.0
-    hr = 72.0
-    br = 16.0
-    last_save_time = ts
-    frame_count = 0
-    
-    while True:
-        try:
-            ts = time.time()
-            frame_count += 1
-            
-            hr += np.random.normal(0, 0.3)
-            br += np.random.normal(0, 0.15)
-            hr = max(50, min(100, hr))
-            br = max(10, min(25, br))
-            
-            delta_hr = (hr / 60) * 2 * np.pi * 0.02
-            delta_br = (br / 60) * 2 * np.pi * 0.02
-            
-            hr_phase += delta_hr + np.random.normal(0, 0.02)
-            br_phase += delta_br + np.random.normal(0, 0.015)
-            
-            hr_phase = hr_phase % (2 * np.pi)
-            br_phase = br_phase % (2 * np.pi)
-            
-            if frame_count % 3 == 0:
-                latest_data["heart_rate"] = hr
-                latest_data["breath_rate"] = br
-                latest_data["is_human"] = 1
-                latest_data["distance_valid"] = 1
-                latest_data["distance"] = 45.92
-            
-            latest_data["heart_phase"] = hr_phase
-            latest_data["breath_phase"] = br_phase
-            
-            validate_and_update(ts)
-            
-            if ts - last_save_time > 1.0:
-                save_to_json()
-                
-                raw_entry = {
-                    "time": ts,
-                    "hr": float(latest_data["heart_rate"]),
-                    "br": float(latest_data["breath_rate"]),
-                    "hph": float(latest_data["heart_phase"]),
-                    "bph": float(latest_data["breath_phase"]),
-                    "is_human": latest_data["is_human"],
-                    "distance": float(latest_data["distance"]),
-                    "distance_valid": latest_data["distance_valid"],
-                    "signal_state": latest_data["signal_state"]
-                }
-                raw_log_data.append(raw_entry)
-                
-                state = latest_data["signal_state"]
-                hr_valid = latest_data.get("hr_valid", False)
-                br_valid = latest_data.get("br_valid", False)
-                phase_valid = latest_data.get("phase_valid", False)
-                
-                analysis_entry = {
-                    "time": ts,
-                    "signal_state": state,
-                    "hr_valid": hr_valid,
-                    "br_valid": br_valid,
-                    "phase_valid": phase_valid
-                }
-                
-                hr_now = float(latest_data["heart_rate"])
-                br_now = float(latest_data["breath_rate"])
-                
-                # 原子化计算：根据条件分别计算
-                if hr_valid:
-                    hrr_val = engine.calc_hrr(hr_now)
-                    slope_val = engine.calc_hr_slope(clean_hr_history)
-                    analysis_entry.update({
-                        "hrr": round(hrr_val, 1),
-                        "hrr_label": get_hrr_label(hrr_val),
-                        "slope": round(slope_val, 2),
-                        "slope_label": get_slope_label(slope_val)
-                    })
-                else:
-                    analysis_entry.update({
-                        "hrr": "--",
-                        "hrr_label": "--",
-                        "slope": "--",
-                        "slope_label": "--"
-                    })
-                
-                if br_valid:
-                    brv_val = engine.calc_brv(clean_br_history)
-                    br_elev_val = engine.calc_br_elevation(br_now)
-                    analysis_entry.update({
-                        "brv": round(brv_val, 2),
-                        "brv_label": get_brv_label(brv_val),
-                        "brel": round(br_elev_val, 1),
-                        "brel_label": get_brel_label(br_elev_val)
-                    })
-                else:
-                    analysis_entry.update({
-                        "brv": "--",
-                        "brv_label": "--",
-                        "brel": "--",
-                        "brel_label": "--"
-                    })
-                
-                if hr_valid and br_valid:
-                    cr_val = engine.calc_cr_ratio(hr_now, br_now)
-                    analysis_entry.update({
-                        "cr": round(cr_val, 2),
-                        "cr_label": get_cr_label(cr_val)
-                    })
-                else:
-                    analysis_entry.update({
-                        "cr": "--",
-                        "cr_label": "--"
-                    })
-                
-                if phase_valid and current_preprocessor_output is not None:
-                    inst_hr, inst_br, hr_uni, br_uni = current_preprocessor_output
-                    plv_val = engine.calc_plv(hr_uni, br_uni)
-                    analysis_entry.update({
-                        "plv": round(plv_val, 3),
-                        "plv_label": get_plv_label(plv_val)
-                    })
-                else:
-                    analysis_entry.update({
-                        "plv": "--",
-                        "plv_label": "--"
-                    })
-                
-                analysis_log_data.append(analysis_entry)
-                
-                save_logs()
-                last_save_time = ts
-            
-            time.sleep(0.02)
-        except Exception as e:
-            print("模拟数据生成错误: %s" % str(e))
-            time.sleep(0.5)
+        result["trends"] = {k: list(trends[k]) for k in TREND_KEYS if k != "phase_diff"}
 
+        rt.pop("lissajous")
+        result["rt"] = rt
+
+        return result
+
+    def build_log_entries(self, ts, snap):
+        """每秒一次的原始记录和分析记录 (raw, analysis), 指标取自快照"""
+        latest_data = self.latest
+        raw_entry = {
+            "time": ts,
+            "sensor": self.id,
+            "hr": float(latest_data["heart_rate"]),
+            "br": float(latest_data["breath_rate"]),
+            "hph": float(latest_data["heart_phase"]),
+            "bph": float(latest_data["breath_phase"]),
+            "is_human": latest_data["is_human"],
+            "distance": float(latest_data["distance"]),
+            "distance_valid": latest_data["distance_valid"],
+            "signal_state": latest_data["signal_state"]
+        }
+
+        raw = snap.result["raw"]
+        physio = snap.result["physiology"]
+        analysis_entry = {
+            "time": ts,
+            "sensor": self.id,
+            "signal_state": raw["signal_state"],
+            "hr_valid": raw["hr_valid"],
+            "br_valid": raw["br_valid"],
+            "phase_valid": raw["phase_valid"]
+        }
+        for key, src, label in ANALYSIS_FIELDS:
+            val = physio[src]
+            analysis_entry[key] = val if val is not None else "--"
+            analysis_entry[key + "_label"] = label(val) if val is not None else "--"
+
+        return raw_entry, analysis_entry
+
+
+# -------------------- 传感器与接入 --------------------
+# 所有读线程写同一个队列, 队列项带传感器 ID; 一个处理线程解析并更新对应传感器
+chunk_queue = ChunkQueue(INGEST_QUEUE_SIZE, INGEST_DROP_POLICY)
+ingest_stats = IngestStats()
+SENSORS = {sid: RadarSensor(sid, spec, chunk_queue) for sid, spec in RADAR_SENSORS.items()}
+PRIMARY_SENSOR = next(iter(SENSORS))
 
-def serial_thread():
-    global current_preprocessor_output, lissajous_history, raw_log_data, analysis_log_data
-    print("尝试连接串口 %s @ %s bps..." % (PORT, BAUD))
-    ser = None
-    while True:
-        try:
-            ser = serial.Serial(PORT, BAUD, timeout=0.005)
-            print("串口连接成功！")
-            break
-        except Exception as e:
-            print("串口连接失败: %s" % e)
-            print("5秒后重试...")
-            time.sleep(5)
 
-    buf = b""
-    last_save_time = time.time()
-    ts = last_save_time
-    print("开始接收数据...\n")
+def get_sensor(sensor_id=None):
+    """按 ID 取传感器, 省略时为默认传感器; 不存在返回 None"""
+    return SENSORS.get(PRIMARY_SENSOR if sensor_id is None else sensor_id)
+
+
+def ingest_thread():
+    """处理线程: 从读线程的队列取数据块 → 录制 → 解析 → 更新 → 每秒日志
+    所有传感器、串口/TCP/回放/模拟都走这一条路径"""
+    for sensor in SENSORS.values():
+        sensor.start()
+
+    cpu0 = time.thread_time()
 
     while True:
         try:
-            if ser and ser.in_waiting > 0:
-                buf += ser.read(ser.in_waiting)
-                while len(buf) >= 8:
-                    if buf[0] != 0x01:
-                        buf = buf[1:]
-                        continue
-                    dlen = (buf[3] << 8) | buf[4]
-                    flen = 8 + dlen + (1 if dlen > 0 else 0)
-                    if len(buf) < flen or flen > 1024:
-                        buf = buf[1:]
-                        break
-                    frame = buf[:flen]
-                    buf = buf[flen:]
-                    if not verify_cksum(frame[0:7], frame[7]):
-                        continue
-                    if dlen > 0 and not verify_cksum(frame[8:8 + dlen], frame[8 + dlen]):
-                        continue
-
-                    tid = (frame[5] << 8) | frame[6]
-                    fd = frame[8:8 + dlen] if dlen > 0 else b""
-                    ts = time.time()
-
-                    if tid == 0x0F09 and len(fd) >= 2:
-                        latest_data["is_human"] = fd[0]
-                        
-                    elif tid == 0x0A16 and len(fd) >= 8:
-                        flag = struct.unpack('<I', fd[:4])[0]
-                        dist = float_le(fd[4:8])
-                        latest_data["distance_valid"] = flag
-                        latest_data["distance"] = dist
-                        
-                    elif tid == 0x0A13 and len(fd) >= 12:
-                        breath_phase = float_le(fd[4:8])
-                        heart_phase = float_le(fd[8:12])
-                        latest_data["breath_phase"] = breath_phase
-                        latest_data["heart_phase"] = heart_phase
-
-                    elif tid == 0x0A14 and len(fd) >= 4:
-                        latest_data["breath_rate"] = float_le(fd[:4])
-                    elif tid == 0x0A15 and len(fd) >= 4:
-                        latest_data["heart_rate"] = float_le(fd[:4])
-                        
-                        validate_and_update(ts)
-
-                if ts - last_save_time > 1.0:
-                    save_to_json()
-                    
-                    raw_entry = {
-                        "time": ts,
-                        "hr": float(latest_data["heart_rate"]),
-                        "br": float(latest_data["breath_rate"]),
-                        "hph": float(latest_data["heart_phase"]),
-                        "bph": float(latest_data["breath_phase"]),
-                        "is_human": latest_data["is_human"],
-                        "distance": float(latest_data["distance"]),
-                        "distance_valid": latest_data["distance_valid"],
-                        "signal_state": latest_data["signal_state"]
-                    }
-                    raw_log_data.append(raw_entry)
-                    
-                    state = latest_data["signal_state"]
-                    hr_valid = latest_data.get("hr_valid", False)
-                    br_valid = latest_data.get("br_valid", False)
-                    phase_valid = latest_data.get("phase_valid", False)
-                    
-                    analysis_entry = {
-                        "time": ts,
-                        "signal_state": state,
-                        "hr_valid": hr_valid,
-                        "br_valid": br_valid,
-                        "phase_valid": phase_valid
-                    }
-                    
-                    hr_now = float(latest_data["heart_rate"])
-                    br_now = float(latest_data["breath_rate"])
-                    
-                    # 原子化计算：根据条件分别计算
-                    if hr_valid:
-                        hrr_val = engine.calc_hrr(hr_now)
-                        slope_val = engine.calc_hr_slope(clean_hr_history)
-                        analysis_entry.update({
-                            "hrr": round(hrr_val, 1),
-                            "hrr_label": get_hrr_label(hrr_val),
-                            "slope": round(slope_val, 2),
-                            "slope_label": get_slope_label(slope_val)
-                        })
-                    else:
-                        analysis_entry.update({
-                            "hrr": "--",
-                            "hrr_label": "--",
-                            "slope": "--",
-                            "slope_label": "--"
-                        })
-                    
-                    if br_valid:
-                        brv_val = engine.calc_brv(clean_br_history)
-                        br_elev_val = engine.calc_br_elevation(br_now)
-                        analysis_entry.update({
-                            "brv": round(brv_val, 2),
-                            "brv_label": get_brv_label(brv_val),
-                            "brel": round(br_elev_val, 1),
-                            "brel_label": get_brel_label(br_elev_val)
-                        })
-                    else:
-                        analysis_entry.update({
-                            "brv": "--",
-                            "brv_label": "--",
-                            "brel": "--",
-                            "brel_label": "--"
-                        })
-                    
-                    if hr_valid and br_valid:
-                        cr_val = engine.calc_cr_ratio(hr_now, br_now)
-                        analysis_entry.update({
-                            "cr": round(cr_val, 2),
-                            "cr_label": get_cr_label(cr_val)
-                        })
-                    else:
-                        analysis_entry.update({
-                            "cr": "--",
-                            "cr_label": "--"
-                        })
-                    
-                    if phase_valid and current_preprocessor_output is not None:
-                        inst_hr, inst_br, hr_uni, br_uni = current_preprocessor_output
-                        plv_val = engine.calc_plv(hr_uni, br_uni)
-                        analysis_entry.update({
-                            "plv": round(plv_val, 3),
-                            "plv_label": get_plv_label(plv_val)
-                        })
-                    else:
-                        analysis_entry.update({
-                            "plv": "--",
-                            "plv_label": "--"
-                        })
-                    
-                    analysis_log_data.append(analysis_entry)
-                
-                    save_logs()
-                    last_save_time = ts
-            time.sleep(0.001)
+            item = chunk_queue.get(timeout=1.0)
+            if item is not None:
+                sensor_id, ts_recv, chunk = item
+                sensor = SENSORS[sensor_id]
+                latency = time.time() - ts_recv
+                ingest_stats.record_latency(latency)
+                sensor.stats.record_latency(latency)
+                if sensor.capture is not None:
+                    sensor.capture.write(ts_recv, chunk)
+                if sensor.last_save_time is None:
+                    sensor.ts = sensor.last_save_time = ts_recv
+                frames = sensor.parser.feed(chunk)
+                if frames:
+                    sensor.ts = ts_recv
+                    sensor.dispatch_frames(frames, sensor.ts)
+                    refresh_snapshot(sensor.id, sensor.ts)
+
+                if sensor.ts - sensor.last_save_time > 1.0:
+                    snap = refresh_snapshot(sensor.id, sensor.ts)
+                    save_to_json(sensor, snap)
+                    save_realtime_health(sensor, snap.result)
+                    raw_entry, analysis_entry = sensor.build_log_entries(sensor.ts, snap)
+                    raw_log.write(raw_entry)
+                    analysis_log.write(analysis_entry)
+                    sensor.last_save_time = sensor.ts
         except Exception as e:
-            print("读取错误: %s" % str(e))
-            try:
-                if ser and ser.is_open:
-                    ser.close()
-            except:
-                pass
-            print("尝试重新连接串口...")
-            while True:
-                try:
-                    ser = serial.Serial(PORT, BAUD, timeout=0.005)
-                    print("串口重新连接成功！")
-                    break
-                except Exception as re:
-                    print("重新连接失败: %s" % re)
-                    time.sleep(2)
+            print("处理错误: %s" % str(e))
+        cpu1 = time.thread_time()
+        ingest_stats.process_cpu += cpu1 - cpu0
+        cpu0 = cpu1
 
 
 @app.route('/')
@@ -941,6 +949,28 @@ def health():
     return render_template('health.html')
 
 
+@app.route('/protocol_stats')
+def protocol_stats():
+    """各传感器的帧解析计数 (吞吐、重同步字节、校验失败)、读线程统计, 以及共用队列/处理线程 CPU"""
+    return jsonify({
+        "ingest": ingest_stats.to_dict(chunk_queue),
+        "sensors": {sid: {"link": s.link_spec,
+                          "connected": s.reader.connected,
+                          "parser": s.parser.stats(),
+                          "reader": s.stats.to_dict()}
+                    for sid, s in SENSORS.items()}})
+
+
+@app.route('/api/sensors')
+def list_sensors():
+    return jsonify({
+        "default": PRIMARY_SENSOR,
+        "sensors": [{"id": sid, "link": s.link_spec,
+                     "connected": s.reader.connected,
+                     "signal_state": s.latest["signal_state"]}
+                    for sid, s in SENSORS.items()]})
+
+
 @app.route('/person')
 def person_data():
     """接收perception发送的年龄和性别数据"""
@@ -1046,197 +1076,116 @@ def calculate_person_mean():
             # 如果超时回退input模式后，允许用户重新输入
 
 
-# 启动定时计算线程
 person_thread = threading.Thread(target=calculate_person_mean, daemon=True)
-person_thread.start()
-
-
-@app.route('/data')
-def get_data():
-    global current_age, current_gender, engine
-    global plv_trend, brv_trend, hrr_trend
-    global cr_ratio_trend, hr_slope_trend, phase_diff_trend, br_elevation_trend
-    global trend_signal_state_history, trend_hr_valid_history
-    global trend_br_valid_history, trend_phase_valid_history
-
-    global person_source, has_received_perception
-    
-    # 注意：这里不再通过 URL 参数接收 age/gender（避免与 /person 端点冲突）
-    # age/gender 只通过 /person 端点来自 perception.py，或者通过用户手动设置
-    # health.html 现在只读取数据，不再设置
 
-    hr_now = float(latest_data["heart_rate"])
-    br_now = float(latest_data["breath_rate"]) if latest_data["breath_rate"] > 0 else 0.0
 
-    result = {
-        "raw": {
-            "hr": hr_now, "br": br_now,
-            "hr_phase": latest_data["heart_phase"],
-            "br_phase": latest_data["breath_phase"],
-            "signal_state": latest_data["signal_state"],
-            "is_human": latest_data["is_human"],
-            "distance_valid": latest_data["distance_valid"],
-            "distance": latest_data["distance"],
-            "hr_valid": latest_data.get("hr_valid", False),
-            "br_valid": latest_data.get("br_valid", False),
-            "phase_valid": latest_data.get("phase_valid", False)
-        },
-        "signals": {
-            "inst_hr": [], "inst_br": [],
-            "lissajous": [], "phase_diff_circ": []
-        },
-        "physiology": {
-            "plv_r": None, "mean_phase_diff": None,
-            "brv_cv": None, "br_elevation": None,
-            "hr_slope": None,
-            "hrr_pct": None, "cr_ratio": None
-        },
-        "profile": {
-            "age": current_age, "gender": current_gender,
-            "person_source": person_source,
-            "fallback_to_input": fallback_to_input,
-            "hr_rest_est": engine.hr_rest_est,
-            "br_rest_est": engine.br_rest_est,
-            "hr_max_est": engine.hr_max,
-            "plv_baseline": engine.plv_baseline
-        },
-        "trends": {}
+def compute_physiology(sensors):
+    """所有传感器的生理指标一次批量计算 (PhysioEngine.calc_batch), 再逐个组装结果并推进趋势;
+    只由 publish_snapshots 调用"""
+    profile = {
+        "age": current_age, "gender": current_gender,
+        "person_source": person_source,
+        "fallback_to_input": fallback_to_input,
+        "hr_rest_est": engine.hr_rest_est,
+        "br_rest_est": engine.br_rest_est,
+        "hr_max_est": engine.hr_max,
+        "plv_baseline": engine.plv_baseline
     }
 
-    # === 原子化计算：按依赖关系分层 ===
+    hr = [float(s.latest["heart_rate"]) for s in sensors]
+    br = [max(float(s.latest["breath_rate"]), 0.0) for s in sensors]
+    clean_hr = np.stack([s.history.clean_hr.snapshot(10) for s in sensors])
+    clean_br = np.stack([s.history.clean_br.snapshot(300) for s in sensors])
+    # 尚无预处理输出的传感器用零相位占位, 其 PLV 结果不会被使用
+    uni = [s.preprocessor_output[2:] if s.preprocessor_output is not None
+           else (np.zeros(s.preprocessor.window),) * 2 for s in sensors]
+    hr_uni = np.stack([u[0] for u in uni])
+    br_uni = np.stack([u[1] for u in uni])
+
+    batch = engine.calc_batch(hr, br, clean_hr, clean_br, hr_uni, br_uni)
+    return [s.build_result({k: float(v[i]) for k, v in batch.items()}, dict(profile))
+            for i, s in enumerate(sensors)]
+
+
+# ========== 生理指标快照 ==========
+# 每个传感器每 SNAPSHOT_INTERVAL 秒 (雷达时间) 计算一次, 日志、health.json 和 /data 共用;
+# 任一传感器需要重算时, 所有过期的传感器一起批量计算。只由接收线程 (按雷达时间) 发布,
+# 发布后不再修改, HTTP 等消费方只读, 不触发重算。
+SNAPSHOT_INTERVAL = 0.5
+PhysioSnapshot = namedtuple('PhysioSnapshot', ['version', 'ts', 'result', 'body', 'etag'])
+snapshot_lock = threading.RLock()
+
+
+def _json_default(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    raise TypeError(f"无法序列化: {type(o)}")
+
+
+def _is_fresh(snap, ts):
+    return snap is not None and 0 <= ts - snap.ts < SNAPSHOT_INTERVAL
+
+
+def publish_snapshots(sensors, ts):
+    with snapshot_lock:
+        results = compute_physiology(sensors)
+        for sensor, result in zip(sensors, results):
+            prev = sensor.snapshot
+            version = prev.version + 1 if prev else 1
+            body = json.dumps(result, ensure_ascii=False, default=_json_default).encode('utf-8')
+            sensor.snapshot = PhysioSnapshot(version, ts, result, body,
+                                             f"{start_time}-{sensor.id}-{version}")
+
+
+def refresh_snapshot(sensor_id, ts):
+    """接收线程调用: 返回传感器在雷达时间 ts 的快照; 过期 (或尚无快照) 时连同其他过期传感器一起重算。"""
+    sensor = get_sensor(sensor_id)
+    snap = sensor.snapshot
+    if _is_fresh(snap, ts):
+        return snap
+    with snapshot_lock:
+        if not _is_fresh(sensor.snapshot, ts):
+            stale = [s for s in SENSORS.values() if not _is_fresh(s.snapshot, ts)]
+            publish_snapshots(stale, ts)
+        return sensor.snapshot
 
-    # 第1层：只依赖HR（hr_valid就计算）
-    if latest_data.get("hr_valid", False):
-        hrr_val = engine.calc_hrr(hr_now)
-        slope_val = engine.calc_hr_slope(clean_hr_history)
-        result["physiology"]["hrr_pct"] = round(hrr_val, 1)
-        result["physiology"]["hr_slope"] = round(slope_val, 2)
-        hrr_trend.append(round(hrr_val, 1))
-        hr_slope_trend.append(round(slope_val, 2))
-    else:
-        if hrr_trend:
-            hrr_trend.append(hrr_trend[-1])
-        else:
-            hrr_trend.append(None)
-        if hr_slope_trend:
-            hr_slope_trend.append(hr_slope_trend[-1])
-        else:
-            hr_slope_trend.append(None)
-
-    # 第2层：只依赖BR（br_valid就计算）
-    if latest_data["br_valid"]:
-        br_elev_val = engine.calc_br_elevation(br_now)
-        brv_val = engine.calc_brv(clean_br_history)
-        result["physiology"]["br_elevation"] = round(br_elev_val, 1)
-        result["physiology"]["brv_cv"] = round(brv_val, 2)
-        br_elevation_trend.append(round(br_elev_val, 1))
-        brv_trend.append(round(brv_val, 2))
-    else:
-        if br_elevation_trend:
-            br_elevation_trend.append(br_elevation_trend[-1])
-        else:
-            br_elevation_trend.append(0.0)
-        if brv_trend:
-            brv_trend.append(brv_trend[-1])
-        else:
-            brv_trend.append(0.0)
-
-    trend_signal_state_history.append(latest_data["signal_state"])
-    trend_hr_valid_history.append(latest_data["hr_valid"])
-    trend_br_valid_history.append(latest_data["br_valid"])
-    trend_phase_valid_history.append(latest_data["phase_valid"])
-
-    # 第3层：同时需要HR和BR
-    if latest_data["hr_valid"] and latest_data["br_valid"]:
-        cr_val = engine.calc_cr_ratio(hr_now, br_now)
-        result["physiology"]["cr_ratio"] = round(cr_val, 2)
-        cr_ratio_trend.append(round(cr_val, 2))
-    else:
-        if cr_ratio_trend:
-            cr_ratio_trend.append(cr_ratio_trend[-1])
-        else:
-            cr_ratio_trend.append(None)
-
-    # 第4层：需要相位稳定
-    if current_preprocessor_output is not None:
-        inst_hr, inst_br, hr_uni, br_uni = current_preprocessor_output
-
-        result["signals"]["inst_hr"] = [round(v, 1) for v in inst_hr.tolist()[-100:]]
-        result["signals"]["inst_br"] = [round(v, 1) for v in inst_br.tolist()[-100:]]
-        result["signals"]["lissajous"] = lissajous_history[-300:]
-
-        if latest_data["phase_valid"]:
-            plv_val = engine.calc_plv(hr_uni, br_uni)
-            phase_diff = engine.calc_mean_phase_diff(hr_uni, br_uni)
-
-            result["physiology"]["plv_r"] = round(plv_val, 3)
-            result["physiology"]["mean_phase_diff"] = round(phase_diff, 3)
-
-            phase_diff_circ = []
-            delta_phase = hr_uni - br_uni
-            for dp in delta_phase[-50:]:
-                phase_diff_circ.append([
-                    round(float(np.cos(dp)), 3),
-                    round(float(np.sin(dp)), 3)
-                ])
-            result["signals"]["phase_diff_circ"] = phase_diff_circ
-
-            plv_trend.append(round(plv_val, 3))
-            phase_diff_trend.append(round(phase_diff, 3))
-        else:
-            if plv_trend:
-                plv_trend.append(plv_trend[-1])
-            else:
-                plv_trend.append(None)
-            if phase_diff_trend:
-                phase_diff_trend.append(phase_diff_trend[-1])
-            else:
-                phase_diff_trend.append(None)
-
-    for lst in [plv_trend, brv_trend, hrr_trend,
-                cr_ratio_trend, hr_slope_trend, phase_diff_trend, br_elevation_trend,
-                trend_signal_state_history, trend_hr_valid_history,
-                trend_br_valid_history, trend_phase_valid_history]:
-        if len(lst) > TREND_LEN:
-            lst.pop(0)
-
-    result["trends"] = {
-        "plv": list(plv_trend)[-TREND_LEN:],
-        "brv": list(brv_trend)[-TREND_LEN:],
-        "hrr": list(hrr_trend)[-TREND_LEN:],
-        "cr_ratio": list(cr_ratio_trend)[-TREND_LEN:],
-        "hr_slope": list(hr_slope_trend)[-TREND_LEN:],
-        "br_elevation": list(br_elevation_trend)[-TREND_LEN:],
-        "signal_state": list(trend_signal_state_history)[-TREND_LEN:],
-        "hr_valid": list(trend_hr_valid_history)[-TREND_LEN:],
-        "br_valid": list(trend_br_valid_history)[-TREND_LEN:],
-        "phase_valid": list(trend_phase_valid_history)[-TREND_LEN:]
-    }
 
-    result["rt"] = {
-        "heart_phase": [float(x) for x in heart_phase_history[-200:]],
-        "breath_phase": [float(x) for x in breath_phase_history[-200:]],
-        "heart_rate": [float(x) for x in display_hr_history[-200:]],
-        "breath_rate": [float(x) for x in display_br_history[-200:]],
-        "signal_state": signal_state_history[-200:],
-        "hr_valid": rt_hr_valid_history[-200:],
-        "br_valid": rt_br_valid_history[-200:],
-        "phase_valid": rt_phase_valid_history[-200:]
-    }
-
-    # 保存实时数据到 frontend/core/health.json
-    save_realtime_health(result)
-
-    return jsonify(result)
+@app.route('/data')
+@app.route('/api/data/<sensor_id>')
+def get_data(sensor_id=None):
+    # 注意：这里不再通过 URL 参数接收 age/gender（避免与 /person 端点冲突）
+    # age/gender 只通过 /person 端点来自 perception.py，或者通过用户手动设置
+    # health.html 现在只读取数据，不再设置
+    # 传感器: /api/data/<ID> 或 /data?sensor=<ID>, 省略时为默认传感器
+    sensor_id = sensor_id or request.args.get('sensor')
+    if get_sensor(sensor_id) is None:
+        return jsonify({'status': 'error', 'message': f'未知传感器: {sensor_id}'}), 404
+    snap = get_sensor(sensor_id).snapshot
+    if snap is None:
+        return jsonify({'status': 'error', 'message': '尚无数据'}), 503
+    headers = {"ETag": f'"{snap.etag}"', "Cache-Control": "no-cache"}
+    if request.if_none_match.contains(snap.etag):
+        return Response(status=304, headers=headers)
+    return Response(snap.body, mimetype='application/json', headers=headers)
 
 
 if __name__ == '__main__':
-    print("  模式: %s" % ("模拟模式" if SIMULATE_MODE else "串口模式"))    
-    if SIMULATE_MODE:
-        threading.Thread(target=simulate_thread, daemon=True).start()
-    else:
-        threading.Thread(target=serial_thread, daemon=True).start()
-    
+    for sid, s in SENSORS.items():
+        print("  传感器 %s: %s" % (sid, "模拟模式" if SIMULATE_MODE else "链路 %s" % s.link_spec))
+    raw_log.start()
+    analysis_log.start()
+    # 启动定时计算线程
+    person_thread.start()
+    threading.Thread(target=ingest_thread, daemon=True).start()
+
     print("\nWeb服务器: http://127.0.0.1:%d" % HTTP_PORT)
     print("=" * 60 + "\n")
-    app.run(host="127.0.0.1", port=HTTP_PORT, debug=False)
+    try:
+        app.run(host="127.0.0.1", port=HTTP_PORT, debug=False)
+    finally:
+        for s in SENSORS.values():
+            s.stop()
+        raw_log.close()
+        analysis_log.close()
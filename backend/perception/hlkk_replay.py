@@ -0,0 +1,176 @@
+"""
+HLK 雷达离线回放 / 基准测试
+把 .hlkcap 录制的原始串口字节按原始时间戳送入 hlkk 默认传感器的完整处理链
+(帧解析 → validate_and_update → PhasePreprocessor → PhysioEngine), 不限速全速运行,
+输出各阶段耗时、吞吐和生理指标汇总。无需雷达, 可作为回归语料。
+
+用法：
+    python hlkk_replay.py capture.hlkcap --json summary.json --analysis analysis.jsonl
+    python hlkk_replay.py COM9 --record capture.hlkcap --seconds 60     # 从串口录制
+    python hlkk_replay.py synth.hlkcap --synth --seconds 120            # 生成合成录制
+
+hlkk 运行时设置 CAPTURE_RAW = True 也会在 healthdata/ 下录制 .hlkcap。
+"""
+import argparse
+import collections
+import json
+import os
+import time
+
+import numpy as np
+
+import hlk_protocol as hlk
+from hlk_capture import CaptureWriter, iter_capture
+from hlk_transport import synth_chunks
+
+
+def record_serial(port, out_path, seconds, baud=115200):
+    """从串口录制原始字节。"""
+    import serial
+    ser = serial.Serial(port, baud, timeout=0.05)
+    writer = CaptureWriter(out_path)
+    t_end = time.time() + seconds
+    try:
+        while time.time() < t_end:
+            data = ser.read(max(1, ser.in_waiting))
+            if data:
+                writer.write(time.time(), data)
+    finally:
+        ser.close()
+        writer.close()
+    print(f"[OK] 录制 {writer.records} 块 / {writer.bytes} 字节 → {out_path}")
+
+
+def synth_capture(out_path, seconds, seed=0):
+    """用 hlk_transport.synth_chunks (simulate 生理模型) 生成合成录制。"""
+    writer = CaptureWriter(out_path)
+    for ts, data in synth_chunks(seed):
+        if ts >= seconds:
+            break
+        writer.write(ts, data)
+    writer.close()
+    print(f"[OK] 合成 {seconds:.0f}s / {writer.bytes} 字节 → {out_path}")
+
+
+def _ms_summary(ms):
+    ms = np.array(ms) if len(ms) else np.zeros(1)
+    return {
+        "calls": int(len(ms)),
+        "total": round(float(np.sum(ms)), 3),
+        "mean": round(float(np.mean(ms)), 4),
+        "p50": round(float(np.percentile(ms, 50)), 4),
+        "p95": round(float(np.percentile(ms, 95)), 4),
+        "max": round(float(np.max(ms)), 4)}
+
+
+def replay(path, seed=0, analysis_path=None):
+    import hlkk
+    np.random.seed(seed)
+    sensor = hlkk.get_sensor()
+
+    timings = collections.defaultdict(list)
+    feed = sensor.preprocessor.feed
+
+    def timed_feed(*args, **kwargs):
+        t0 = time.perf_counter()
+        out = feed(*args, **kwargs)
+        timings["preprocess"].append((time.perf_counter() - t0) * 1000.0)
+        return out
+    sensor.preprocessor.feed = timed_feed
+
+    parser = sensor.parser
+    states = collections.Counter()
+    analyses = []
+    t_first = None
+    ts = last_save_time = 0.0
+    chunks = 0
+    t_start = time.perf_counter()
+    for ts, data in iter_capture(path):
+        if t_first is None:
+            t_first = last_save_time = ts
+        chunks += 1
+        t0 = time.perf_counter()
+        frames = parser.feed(data)
+        t1 = time.perf_counter()
+        timings["parse"].append((t1 - t0) * 1000.0)
+        if frames:
+            sensor.dispatch_frames(frames, ts)
+            t2 = time.perf_counter()
+            timings["update"].append((t2 - t1) * 1000.0)
+            states[sensor.latest["signal_state"]] += \
+                sum(1 for tid, _ in frames if tid == hlk.TID_HEART_RATE)
+            version = sensor.snapshot.version if sensor.snapshot else 0
+            snap = hlkk.refresh_snapshot(sensor.id, ts)
+            if snap.version != version:
+                timings["physio"].append((time.perf_counter() - t2) * 1000.0)
+        if ts - last_save_time > 1.0:
+            _, analysis = sensor.build_log_entries(ts, hlkk.refresh_snapshot(sensor.id, ts))
+            analyses.append(analysis)
+            last_save_time = ts
+    wall = time.perf_counter() - t_start
+
+    if analysis_path:
+        with open(analysis_path, 'w', encoding='utf-8') as f:
+            for a in analyses:
+                f.write(json.dumps(a, ensure_ascii=False) + "\n")
+
+    # "update" 含预处理耗时, 这里拆开
+    update_ms = np.sum(timings["update"]) - np.sum(timings["preprocess"])
+    duration = (ts - t_first) if t_first is not None else 0.0
+    stats = parser.stats()
+
+    def metric(key):
+        vals = [a[key] for a in analyses if isinstance(a.get(key), (int, float))]
+        return round(float(np.mean(vals)), 3) if vals else None
+
+    return {
+        "source": os.path.basename(path),
+        "chunks": chunks,
+        "duration_s": round(duration, 2),
+        "wall_s": round(wall, 3),
+        "speedup_x": round(duration / wall, 1) if wall > 0 else 0.0,
+        "parser": stats,
+        "stages_ms": {
+            "parse": _ms_summary(timings["parse"]),
+            "validate_total": round(float(update_ms), 3),
+            "preprocess": _ms_summary(timings["preprocess"]),
+            "physio": _ms_summary(timings["physio"])},
+        "signal_state": dict(states),
+        "metrics": {
+            "final_hr": round(float(sensor.latest["heart_rate"]), 1),
+            "final_br": round(float(sensor.latest["breath_rate"]), 1),
+            "hrr_mean": metric("hrr"),
+            "brv_mean": metric("brv"),
+            "cr_mean": metric("cr"),
+            "plv_mean": metric("plv"),
+            "analysis_records": len(analyses)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HLK 雷达离线回放 / 基准测试")
+    parser.add_argument("source", help=".hlkcap 录制文件; --record 时为串口号")
+    parser.add_argument("--json", help="汇总结果 JSON 输出路径")
+    parser.add_argument("--analysis", help="逐秒分析记录 JSONL 输出路径")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子 (预处理 synthetic 波形)")
+    parser.add_argument("--record", help="录制模式: 输出 .hlkcap 路径")
+    parser.add_argument("--synth", action="store_true", help="生成合成录制到 source")
+    parser.add_argument("--seconds", type=float, default=60.0, help="录制/合成时长")
+    args = parser.parse_args()
+
+    if args.record:
+        record_serial(args.source, args.record, args.seconds)
+        return
+    if args.synth:
+        synth_capture(args.source, args.seconds, args.seed)
+        return
+
+    summary = replay(args.source, args.seed, args.analysis)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+# perception/jsonl_log.py
+# 追加写 JSON Lines 日志 + 旧格式 (JSON 数组) 读取/转换
+"""
+写入: JsonlLogWriter 在后台线程批量追加, 调用方 write() 只是入队, 不做磁盘 IO。
+轮转: 单个文件超过 max_bytes 后切到下一段 name.1.jsonl, name.2.jsonl ...
+fsync: 'always' 每批落盘 / 'interval' 每 fsync_interval 秒 / 'never' 交给系统。
+读取: read_jsonl() 按段顺序读回完整列表 (即旧的数组格式), 忽略崩溃时截断的末行。
+
+转换为旧格式：python jsonl_log.py healthdata/20260101-120000raw.jsonl [out.json]
+"""
+import glob
+import json
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class JsonlLogWriter:
+
+    def __init__(self, path, batch_size=50, flush_interval=1.0,
+                 max_bytes=64 * 1024 * 1024, fsync='interval',
+                 fsync_interval=10.0, queue_size=10000):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync 必须是 {FSYNC_POLICIES} 之一")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._segment = 0
+        self._file = None
+        self._last_fsync = time.time()
+        self._thread = None
+        self._stop = threading.Event()
+        self.written = 0
+        self.dropped = 0
+
+    # -------------------- 生产者 --------------------
+
+    def write(self, record):
+        """入队一条记录; 队列满时丢弃并计数, 不阻塞调用线程。"""
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # -------------------- 生命周期 --------------------
+
+    def start(self):
+        if self._thread is None:
+            self._open()
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    # -------------------- 后台写入 --------------------
+
+    def _segment_path(self, index):
+        if index == 0:
+            return self.path
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.{index}{ext}"
+
+    def _open(self):
+        self._file = open(self._segment_path(self._segment), 'a',
+                          encoding='utf-8')
+
+    def _rotate(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._segment += 1
+        self._open()
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n"
+                        for r in batch)
+        self._file.write(lines)
+        self._file.flush()
+        self.written += len(batch)
+        now = time.time()
+        if self.fsync == 'always' or (
+                self.fsync == 'interval'
+                and now - self._last_fsync >= self.fsync_interval):
+            os.fsync(self._file.fileno())
+            self._last_fsync = now
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _worker(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            try:
+                self._write_batch(self._drain(first))
+            except Exception as e:
+                print("写日志失败: %s" % str(e))
+                time.sleep(0.5)
+
+
+# -------------------- 读取 --------------------
+
+def segment_paths(path):
+    """返回 path 及其轮转段, 按写入顺序排列。"""
+    stem, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(stem) + r"\.(\d+)" + re.escape(ext) + "$")
+    parts = []
+    for p in glob.glob(glob.escape(stem) + ".*" + ext):
+        m = pattern.match(p)
+        if m:
+            parts.append((int(m.group(1)), p))
+    return ([path] if os.path.exists(path) else []) + \
+        [p for _, p in sorted(parts)]
+
+
+def read_jsonl(path):
+    """读回全部记录, 等价于旧版 json.load 得到的数组。"""
+    records = []
+    for seg in segment_paths(path):
+        with open(seg, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 进程异常退出时末行可能被截断
+                    continue
+    return records
+
+
+def convert_to_json(path, out_path=None):
+    """把 JSONL 日志转换成旧的缩进 JSON 数组文件, 返回输出路径。"""
+    if out_path is None:
+        out_path = os.path.splitext(path)[0] + ".json"
+    with open(out_path, 'w', encoding='utf-8') as f:
+        json.dump(read_jsonl(path), f, ensure_ascii=False, indent=2)
+    return out_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python jsonl_log.py <log.jsonl> [out.json]")
+        sys.exit(1)
+    out = convert_to_json(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print("已转换: %s" % out)
@@ -0,0 +1,234 @@
+# perception/landmark_service.py
+# 人脸关键点服务: 每帧只跑一次 FaceMesh, 结果在进程内发布, 并可序列化给其他进程
+"""
+emotion.py 持有摄像头和唯一的 FaceMesh (LandmarkService); AU、FER+、姿态等同进程消费者
+直接取 FaceFrame, 不再各自检测。其他进程 (app.py 的 PerceptionManager、rppg.py) 用 LandmarkClient
+轮询 emotion 的 /api/landmarks, 坐标以 0-1 归一化传输、按本地帧尺寸还原; 结果过期时调用方回退本地检测。
+
+FaceFrame (发布后由 annotate 补充主受试者信息, 消费方只读):
+    seq, ts     帧序号 / 检测时间
+    source      摄像头标识 (emotion 的 camera_url), 其他进程据此判断检测结果是否属于自己处理的画面
+    shape       (h, w)
+    faces       [Face(lm, bbox)]; lm 为 (N, 3) 像素坐标, refine 时 N=478, 前 468 点与普通 FaceMesh 相同
+    primary     主受试者下标 (emotion 的 FaceSelector 设定, 默认最大的脸), 无人脸为 -1
+    pose        主受试者 (pitch, yaw, roll), 未估计时为 None
+    aligned     主受试者 224x224 对齐人脸 (BGR), 未生成时为 None
+    frame       检测所用的原始帧, 只在进程内, 不序列化
+"""
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+Face = namedtuple('Face', ['lm', 'bbox'])
+KEYPOINTS_5 = [33, 263, 1, 61, 291]     # 双眼外角、鼻尖、两嘴角, 与 emotion.MP5 一致
+
+
+def _area(bbox):
+    return (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+
+
+class FaceFrame:
+
+    def __init__(self, seq, ts, shape, faces, frame=None, source=None):
+        self.seq = seq
+        self.ts = ts
+        self.source = source
+        self.shape = tuple(shape[:2])
+        self.faces = faces
+        self.primary = int(np.argmax([_area(f.bbox) for f in faces])) if faces else -1
+        self.pose = None
+        self.aligned = None
+        self.frame = frame
+
+    def primary_face(self):
+        return self.faces[self.primary] if 0 <= self.primary < len(self.faces) else None
+
+    def to_dict(self, full=False):
+        """坐标按帧宽高归一化; full 时带全部关键点 (x, y), 否则只带 5 点"""
+        h, w = self.shape
+        scale = np.array([w, h], dtype=np.float64)
+        faces = []
+        for f in self.faces:
+            x1, y1, x2, y2 = f.bbox
+            d = {"bbox": [round(x1 / w, 4), round(y1 / h, 4), round(x2 / w, 4), round(y2 / h, 4)],
+                 "kp5": np.round(f.lm[KEYPOINTS_5, :2] / scale, 4).tolist()}
+            if full:
+                d["lm"] = np.round(f.lm[:, :2] / scale, 4).tolist()
+            faces.append(d)
+        return {"seq": self.seq, "ts": self.ts, "source": self.source, "shape": [h, w], "primary": self.primary,
+                "pose": self.pose, "faces": faces}
+
+    @classmethod
+    def from_dict(cls, d, shape=None):
+        """按 shape (本地帧 h, w) 还原像素坐标; 没有完整关键点时 lm 只含 5 点"""
+        h, w = shape[:2] if shape is not None else d["shape"]
+        scale = np.array([w, h], dtype=np.float64)
+        faces = []
+        for f in d["faces"]:
+            pts = (np.asarray(f.get("lm") or f["kp5"], dtype=np.float64) * scale).astype(np.float32)
+            x1, y1, x2, y2 = f["bbox"]
+            faces.append(Face(pts, (x1 * w, y1 * h, x2 * w, y2 * h)))
+        ff = cls(d["seq"], d["ts"], (h, w), faces, source=d.get("source"))
+        ff.primary = d.get("primary", ff.primary)
+        ff.pose = d.get("pose")
+        return ff
+
+
+class LandmarkService:
+    """进程内唯一的 FaceMesh; 同一帧序号只检测一次, 结果发布给所有订阅者。"""
+
+    def __init__(self, max_faces=5, refine=True,
+                 min_detection_confidence=0.5, min_tracking_confidence=0.5):
+        import mediapipe as mp
+        self.fm = mp.solutions.face_mesh.FaceMesh(
+            static_image_mode=False, max_num_faces=max_faces, refine_landmarks=refine,
+            min_detection_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence)
+        self._detect_lock = threading.Lock()    # FaceMesh 不可并发调用
+        self._cond = threading.Condition()
+        self._latest = None
+        self._subscribers = []
+        self.source = None      # 当前摄像头标识, 由摄像头所有者设置, 写入每个 FaceFrame
+        self.detections = 0
+        self.cache_hits = 0
+        self.detect_ms = 0.0
+
+    def process(self, frame, seq, ts=None):
+        """返回帧 seq 的检测结果; 该帧已检测过时直接返回缓存。"""
+        import cv2
+        with self._detect_lock:
+            latest = self._latest
+            if latest is not None and latest.seq == seq:
+                self.cache_hits += 1
+                return latest
+            t0 = time.perf_counter()
+            r = self.fm.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            h, w = frame.shape[:2]
+            faces = []
+            for fl in (r.multi_face_landmarks or []):
+                lm = np.array([[p.x*w, p.y*h, p.z*w] for p in fl.landmark])
+                faces.append(Face(lm, (lm[:, 0].min(), lm[:, 1].min(), lm[:, 0].max(), lm[:, 1].max())))
+            self.detect_ms += (time.perf_counter() - t0) * 1000.0
+            self.detections += 1
+            ff = FaceFrame(seq, time.time() if ts is None else ts, frame.shape, faces, frame,
+                           self.source)
+        self._publish(ff)
+        return ff
+
+    def _publish(self, ff):
+        with self._cond:
+            self._latest = ff
+            self._cond.notify_all()
+        for cb in list(self._subscribers):
+            try:
+                cb(ff)
+            except Exception as e:
+                print(f"[Landmark] 订阅回调出错: {e}")
+
+    def subscribe(self, callback):
+        """callback(FaceFrame) 在检测线程中调用, 应尽快返回"""
+        self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def latest(self, max_age=None):
+        ff = self._latest
+        if ff is None or (max_age is not None and time.time() - ff.ts > max_age):
+            return None
+        return ff
+
+    def wait(self, after_seq=-1, timeout=None):
+        """等待比 after_seq 新的结果; 超时返回当前最新 (可能为 None)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._latest is not None and self._latest.seq > after_seq,
+                                timeout)
+            return self._latest
+
+    @staticmethod
+    def annotate(ff, primary=None, pose=None, aligned=None):
+        """主消费者 (emotion.au_loop) 补充主受试者、姿态和对齐人脸"""
+        if primary is not None:
+            ff.primary = primary
+        if pose is not None:
+            ff.pose = [round(float(v), 1) for v in pose]
+        if aligned is not None:
+            ff.aligned = aligned
+
+    def stats(self):
+        n = max(self.detections, 1)
+        return {"detections": self.detections, "cache_hits": self.cache_hits,
+                "detect_ms_mean": round(self.detect_ms / n, 2),
+                "subscribers": len(self._subscribers)}
+
+    def release(self):
+        self.fm.close()
+
+
+class LandmarkClient:
+    """后台轮询其他进程的 /api/landmarks, 供本进程替代自己的人脸检测。"""
+
+    def __init__(self, url, full=False, interval=0.1, max_age=0.5, timeout=0.5):
+        self.url = url + ("?full=1" if full else "")
+        self.interval = interval
+        self.max_age = max_age
+        self.timeout = timeout
+        self.errors = 0
+        self._data = None
+        self._fed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._worker, name="landmark-client",
+                                            daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def feed(self, d):
+        """直接提供检测结果 (如帧总线元数据中的 landmarks), 期间暂停 HTTP 轮询"""
+        if d and d.get("seq") is not None:
+            self._data = d
+            self._fed = time.time()
+
+    def _worker(self):
+        import requests
+        session = requests.Session()
+        while not self._stop.is_set():
+            if time.time() - self._fed < self.max_age:
+                self._stop.wait(self.interval)
+                continue
+            try:
+                resp = session.get(self.url, timeout=self.timeout)
+                if resp.status_code == 200:
+                    d = resp.json()
+                    if d.get("seq") is not None:
+                        self._data = d
+            except Exception:
+                self.errors += 1
+            self._stop.wait(self.interval)
+
+    def get(self, shape=None, source=None):
+        """最新检测结果 (按本地帧 shape 缩放); 过期、尚无数据或 source 给定但摄像头不同时返回 None"""
+        d = self._data
+        if d is None or time.time() - d["ts"] > self.max_age:
+            return None
+        if source is not None and d.get("source") != source:
+            return None
+        return FaceFrame.from_dict(d, shape)
+
+    def face_boxes(self, shape, source=None):
+        """[(x, y, w, h)] 整数框, 格式同 CascadeClassifier.detectMultiScale; 不可用时返回 None"""
+        ff = self.get(shape, source)
+        if ff is None:
+            return None
+        return [(int(x1), int(y1), int(x2 - x1), int(y2 - y1))
+                for x1, y1, x2, y2 in (f.bbox for f in ff.faces)]
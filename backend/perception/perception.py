@@ -56,6 +56,7 @@ app = Flask(__name__)
 AU_EMOTION_API = "http://127.0.0.1:5010/api/fusion"
 
 from dda import DDASystem
+from frame_bus import ALIGNED_BUS, FrameBusReader
 dda_system = DDASystem()
 # 开局默认难度为4，DDA是唯一的难度调整源
 dda_system.current_difficulty = 4
@@ -144,6 +145,7 @@ class PersonAnalyzer:
         # 视频流用 emotion.py 的（只用来显示，分析只用对齐人脸）
         self.video_stream_url = "http://127.0.0.1:5010/video_feed"
         self.aligned_face_url = "http://127.0.0.1:5010/api/aligned_face"
+        self.aligned_bus = FrameBusReader(ALIGNED_BUS, stale_after=None)
         self.cap = None
         self._reconnect_attempts = 0
 
@@ -283,7 +285,13 @@ class PersonAnalyzer:
             return '80-100'
 
     def fetch_aligned_face(self):
-        """从emotion模块获取对齐后的人脸图像"""
+        """从emotion模块获取对齐后的人脸图像: 优先共享内存帧总线 (10 秒内的), 否则走 HTTP"""
+        try:
+            bf = self.aligned_bus.read(copy=True)
+            if bf is not None and time.time() - bf.ts < 10.0:
+                return bf.frame
+        except Exception as e:
+            print(f"帧总线读取失败: {e}")
         try:
             resp = requests.get(self.aligned_face_url, timeout=0.5)
             if resp.status_code == 200:
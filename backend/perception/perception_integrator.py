@@ -16,6 +16,7 @@ from collections import deque
 
 # 导入 DDA 系统
 from .dda import DDASystem
+from .frame_bus import ALIGNED_BUS, FrameBusReader
 
 # ========================================
 # 常量配置
@@ -23,6 +24,7 @@ from .dda import DDASystem
 AU_ALL_API = "http://127.0.0.1:5010/api/all"  # 获取完整的 AU/FER/Fusion 数据
 AU_EMOTION_API = "http://127.0.0.1:5010/api/fusion"
 AU_STATUS_API = "http://127.0.0.1:5010/api/status"
+ALIGNED_FACE_MAX_AGE = 10.0  # 帧总线上的对齐人脸超过该秒数视为过期, 回退 HTTP
 HLKK_DATA_API = "http://127.0.0.1:5020/data"
 
 
@@ -75,6 +77,7 @@ class EmotionProcessor:
         
         # ⭐ 保存原始 API 数据
         self._raw_physio_data = None
+        self._physio_etag = None
         self._raw_au_data = None
         self._raw_fer_data = None
         self._raw_fusion_data = None
@@ -123,11 +126,19 @@ class EmotionProcessor:
 
     def fetch_physio_data(self):
         try:
-            resp = requests.get(HLKK_DATA_API, timeout=0.5)
-            if resp.status_code == 200:
+            # hlkk 快照未更新时返回 304, 沿用上次解析的数据
+            headers = {"If-None-Match": self._physio_etag} if self._physio_etag else None
+            resp = requests.get(HLKK_DATA_API, headers=headers, timeout=0.5)
+            if resp.status_code == 304 and self._raw_physio_data is not None:
+                d = self._raw_physio_data
+            elif resp.status_code == 200:
                 d = resp.json()
                 # ⭐ 保存原始生理数据
                 self._raw_physio_data = d
+                self._physio_etag = resp.headers.get("ETag")
+            else:
+                d = None
+            if d is not None:
                 raw = d.get("raw", {})
                 physiology = d.get("physiology", {})
                 return {
@@ -347,6 +358,7 @@ class PersonAnalyzer:
     def __init__(self):
         # 从 emotion.py 获取对齐人脸的地址
         self.aligned_face_url = "http://127.0.0.1:5010/api/aligned_face"
+        self.aligned_bus = FrameBusReader(ALIGNED_BUS, stale_after=None)
         
         # 模型选择：'deepface' 或 'onnx'
         self.current_model = 'deepface'
@@ -449,7 +461,13 @@ class PersonAnalyzer:
         return face_img
     
     def fetch_aligned_face(self):
-        """从 emotion.py 获取对齐后的人脸图像"""
+        """从 emotion.py 获取对齐后的人脸图像: 优先共享内存帧总线, 不可用时走 HTTP"""
+        try:
+            bf = self.aligned_bus.read(copy=True)
+            if bf is not None and time.time() - bf.ts < ALIGNED_FACE_MAX_AGE:
+                return bf.frame
+        except Exception as e:
+            print(f"[PersonAnalyzer] 帧总线读取失败: {e}")
         try:
             import cv2
             import numpy as np
@@ -19,7 +19,10 @@ import mediapipe as mp
 class PerceptionManager:
     """感知管理器 - 整合所有检测"""
     
-    def __init__(self):
+    def __init__(self, face_source=None):
+        """face_source(shape) -> [(x, y, w, h)] 或 None: 外部人脸检测结果 (如 LandmarkClient.face_boxes,
+        复用 emotion 进程的 FaceMesh), 返回 None 时回退 Haar 检测"""
+        self.face_source = face_source
         self.user_state = {
             "emotion": {"primary": "neutral", "confidence": 0.5, "valence": 0.5, "arousal": 0.5},
             "heart_rate": {"bpm": None, "hrv": None, "confidence": 0, "trend": "stable"},
@@ -77,7 +80,9 @@ class PerceptionManager:
                 self._detect_environment(frame, gray)
                 
                 # 2. 人脸检测 - 使用更快的参数
-                faces = self.face_cascade.detectMultiScale(gray, 1.4, 6, minSize=(30, 30))
+                faces = self.face_source(frame.shape) if self.face_source is not None else None
+                if faces is None:
+                    faces = self.face_cascade.detectMultiScale(gray, 1.4, 6, minSize=(30, 30))
                 face_detected = len(faces) > 0
                 
                 # 3. 身体检测
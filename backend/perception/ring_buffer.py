@@ -0,0 +1,99 @@
+# perception/ring_buffer.py
+# 预分配定长环形缓冲区
+
+import threading
+import numpy as np
+
+
+class RingBuffer:
+    """定长环形缓冲区, 追加 O(1), 无逐帧内存分配。
+
+    每个样本同时写入 i 和 i + capacity 两个位置 (镜像双写),
+    因此最近 n 个样本总是一段连续内存, view() 直接返回零拷贝视图。
+
+    lock: 与调用方共享的可重入锁。append/clear/snapshot 内部加锁;
+    view() 不加锁也不拷贝, 跨线程读取时调用方需持有 lock 或改用 snapshot()。
+    """
+
+    def __init__(self, capacity, width=None, dtype=np.float64, lock=None):
+        self.capacity = int(capacity)
+        shape = (2 * self.capacity,) if width is None \
+            else (2 * self.capacity, width)
+        self._data = np.zeros(shape, dtype=dtype)
+        self._head = 0          # 下一个写入位置
+        self._size = 0
+        self.total = 0          # 累计写入样本数 (不随覆盖减少)
+        self.lock = lock if lock is not None else threading.RLock()
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value):
+        with self.lock:
+            self._data[self._head] = value
+            self._data[self._head + self.capacity] = value
+            self._head += 1
+            if self._head == self.capacity:
+                self._head = 0
+            if self._size < self.capacity:
+                self._size += 1
+            self.total += 1
+
+    def extend(self, values):
+        """批量追加, 最多两段切片赋值 (每段镜像写两次)。"""
+        values = np.asarray(values, dtype=self._data.dtype)
+        n = len(values)
+        if n == 0:
+            return
+        cap = self.capacity
+        with self.lock:
+            self.total += n
+            if n >= cap:
+                self._data[:cap] = values[-cap:]
+                self._data[cap:] = values[-cap:]
+                self._head = 0
+                self._size = cap
+                return
+            i = self._head
+            first = min(n, cap - i)
+            self._data[i:i + first] = values[:first]
+            self._data[i + cap:i + cap + first] = values[:first]
+            rest = n - first
+            if rest:
+                self._data[:rest] = values[first:]
+                self._data[cap:cap + rest] = values[first:]
+            self._head = (i + n) % cap
+            self._size = min(cap, self._size + n)
+
+    def fill(self, value, n=None):
+        """清空后预填 n 个相同样本 (默认填满)。"""
+        with self.lock:
+            n = self.capacity if n is None else max(0, min(int(n), self.capacity))
+            self._data[:n] = value
+            self._data[self.capacity:self.capacity + n] = value
+            self._head = n % self.capacity
+            self._size = n
+            self.total = n
+
+    def clear(self):
+        with self.lock:
+            self._head = 0
+            self._size = 0
+            self.total = 0
+
+    def view(self, n=None):
+        """最近 n 个样本 (按时间先后) 的连续只读视图, 默认返回全部。"""
+        n = self._size if n is None else max(0, min(int(n), self._size))
+        end = self._head + self.capacity
+        v = self._data[end - n:end]
+        v.flags.writeable = False
+        return v
+
+    def snapshot(self, n=None):
+        with self.lock:
+            return self.view(n).copy()
+
+    def last(self, default=None):
+        if self._size == 0:
+            return default
+        return self._data[self._head + self.capacity - 1]
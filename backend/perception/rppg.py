@@ -6,14 +6,20 @@
 import cv2
 import numpy as np
 from flask import Flask, Response, jsonify, send_file, request
-from scipy.signal import butter, filtfilt, find_peaks
+from scipy.signal import find_peaks
 import mediapipe as mp
 import threading
+import queue
 import time
 import os
 import csv
 from datetime import datetime
 from collections import deque
+from rppg_dsp import (POSEngine, StreamingHREstimator, pos_batch,
+                      median_filter, detrend, butter_bandpass,
+                      estimate_hr_fft_batch, peak_offset)
+from ring_buffer import RingBuffer
+from landmark_service import LandmarkClient
 
 app = Flask(__name__)
 
@@ -34,7 +40,9 @@ HR_MAX_DELTA_SEC = 10
 # 实际运行时由 _get_ema_alpha / _get_max_display_change 根据信号质量动态计算
 EMA_ALPHA_BASE = 0.06
 MAX_DISPLAY_CHANGE_BASE = 10
-DETECT_INTERVAL = 3
+# FaceMesh 之间用光流跟踪关键点, 因此检测间隔可以放宽
+LANDMARK_TRACKING = True
+DETECT_INTERVAL = 6 if LANDMARK_TRACKING else 3
 COMPUTE_INTERVAL = 8
 MIN_BUFFER_COMPUTE = POS_WINDOW * 3
 MIN_ROI_PIXELS = 400
@@ -47,6 +55,28 @@ BBOX_RETAIN_FRAMES = 30
 PEAK_MIN_DISTANCE = 12
 DISPLAY_UPDATE_SEC = 3.0
 MIN_CHEEK_RATIO = 0.28
+# ROI 颜色只取皮肤像素均值; 皮肤像素过少时退回整块 ROI 均值
+# 皮肤像素数从 MIN_SKIN_PIXELS/2 到 2*MIN_SKIN_PIXELS 之间两者线性混合, 不做硬切换
+SKIN_MASKED_MEAN = True
+MIN_SKIN_PIXELS = 100
+SKIN_HSV_LOW = np.array([0, 15, 40])
+SKIN_HSV_HIGH = np.array([30, 255, 255])
+# 流式频谱: 每帧增量更新 FFT 支路, 计算 tick 只做融合; 与单路 estimate_hr_fft 同一 Hann 窗和插值 (rppg_replay.py --parity)
+HR_STREAMING = True
+# 多人模式: 每张脸独立跟踪/缓冲, 所有人的 POS/FFT 在一次向量化调用中完成
+# 默认关闭: 单人部署下 FaceMesh 只找一张脸, 也不跑逐人路径
+MULTI_FACE = False
+MAX_FACES = 4
+SUBJECT_MAX_MISSED = 5          # 连续多少次 FaceMesh 未匹配到就移除
+SUBJECT_MATCH_RATIO = 0.5       # 中心距离 < 脸宽 * 该比例 视为同一人
+SUBJECT_EMA_ALPHA = 0.15
+# 采集 → DSP 的样本队列上限 (约 2 秒), 满时丢弃最老样本
+DSP_QUEUE_SIZE = 64
+# 关键点来源: 'local' 本进程 FaceMesh; 'emotion' 复用 emotion.py 的检测结果 (/api/landmarks),
+# 仅当两边读的是同一路摄像头时使用, 远端结果过期 (emotion 未运行/无新检测) 时回退本地 FaceMesh
+LANDMARK_SOURCE = 'local'
+LANDMARK_URL = "http://127.0.0.1:5010/api/landmarks"
+LANDMARK_MAX_AGE = 0.5
 
 # ============================================================
 
@@ -88,16 +118,244 @@ class DataLogger:
 # ============================================================
 
 
+class StageStats:
+    """流水线单个阶段的计数器: 处理数 / 平均与峰值耗时 / 丢弃数"""
+
+    def __init__(self):
+        self.count = 0
+        self.dropped = 0
+        self.latency_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, t0):
+        ms = (time.perf_counter() - t0) * 1000.0
+        self.count += 1
+        self.latency_ms = ms if self.count == 1 \
+            else 0.9 * self.latency_ms + 0.1 * ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def to_dict(self, depth=0):
+        return {
+            "count": self.count,
+            "dropped": self.dropped,
+            "latency_ms": round(self.latency_ms, 2),
+            "max_ms": round(self.max_ms, 2),
+            "queue_depth": depth}
+
+
+# ============================================================
+
+
+class LandmarkTracker:
+    """FaceMesh 两次检测之间的关键点跟踪:
+    对 ROI 相关的少量关键点跑稀疏 LK 光流, 拟合部分仿射 (平移/旋转/缩放),
+    再把仿射作用到全部 468 点上。只在人脸外扩框内建金字塔, 开销远低于 FaceMesh。
+    """
+    # 额头 / 眉 / 眼角 / 鼻梁鼻尖 / 两颊 / 下颌, 均为刚性较好的点
+    TRACK_IDX = np.array([
+        10, 67, 109, 151, 297, 338, 9,
+        70, 105, 300, 334, 159, 145,
+        33, 133, 263, 362,
+        1, 4, 5, 6, 195, 197,
+        50, 116, 123, 205, 280, 345, 352, 425,
+        152, 172, 234, 397, 454])
+    MIN_TRACKED = 8
+    MARGIN = 0.25
+    LK_PARAMS = dict(
+        winSize=(15, 15), maxLevel=2,
+        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.prev_gray = None
+        self.pts = None
+
+    def reset(self, gray, pts):
+        """用 FaceMesh 结果 (及其所在帧的灰度图) 重新初始化。"""
+        self.prev_gray = gray
+        self.pts = pts.astype(np.float32)
+
+    def track(self, gray):
+        """把关键点推进到当前帧, 失败时返回 None (调用方沿用旧关键点)。"""
+        if self.pts is None or self.prev_gray is None:
+            return None
+        if gray is self.prev_gray:
+            return self.pts
+        h, w = gray.shape[:2]
+        x1, y1 = self.pts.min(axis=0)
+        x2, y2 = self.pts.max(axis=0)
+        mx, my = (x2 - x1) * self.MARGIN, (y2 - y1) * self.MARGIN
+        x1, y1 = max(0, int(x1 - mx)), max(0, int(y1 - my))
+        x2, y2 = min(w, int(x2 + mx)), min(h, int(y2 + my))
+        if x2 - x1 < 16 or y2 - y1 < 16:
+            return None
+        offset = np.array([x1, y1], dtype=np.float32)
+        p0 = (self.pts[self.TRACK_IDX] - offset).reshape(-1, 1, 2)
+        p1, st, _ = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray[y1:y2, x1:x2], gray[y1:y2, x1:x2],
+            p0, None, **self.LK_PARAMS)
+        if p1 is None:
+            return None
+        good = st.ravel() == 1
+        if np.count_nonzero(good) < self.MIN_TRACKED:
+            return None
+        M, _ = cv2.estimateAffinePartial2D(
+            p0[good], p1[good], method=cv2.RANSAC,
+            ransacReprojThreshold=3.0)
+        if M is None:
+            return None
+        local = self.pts - offset
+        self.pts = (local @ M[:, :2].T + M[:, 2] + offset).astype(np.float32)
+        self.prev_gray = gray
+        return self.pts
+
+
+class MJPEGBroadcaster:
+    """/video_feed 共享编码器: 有观众时才绘制 HUD 并编码 JPEG,
+    每个新帧最多编码一次, 所有客户端共享同一份字节; 无观众时线程休眠。
+    新 JPEG 通过条件变量发布, 客户端被唤醒而不是轮询。
+    """
+
+    def __init__(self, processor, quality=80):
+        self.proc = processor
+        self.quality = quality
+        self.cond = threading.Condition()
+        self.viewers = 0
+        self.jpeg = None
+        self.seq = 0
+        self.stats = StageStats()
+
+    def start(self):
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def stop(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def _worker(self):
+        proc = self.proc
+        last_frame_seq = 0
+        while proc.running:
+            with self.cond:
+                self.cond.wait_for(
+                    lambda: self.viewers > 0 or not proc.running)
+            with proc.frame_cond:
+                proc.frame_cond.wait_for(
+                    lambda: (not proc.running
+                             or proc.frame_seq != last_frame_seq),
+                    timeout=1.0)
+                if proc.frame_seq == last_frame_seq \
+                        or proc.latest_frame is None:
+                    continue
+                last_frame_seq = proc.frame_seq
+                frame = proc.latest_frame.copy()
+            t0 = time.perf_counter()
+            try:
+                frame = proc.draw_hud(frame)
+                ok, jpeg = cv2.imencode(
+                    '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            except Exception as e:
+                print(f"[ERROR] encode: {repr(e)}")
+                continue
+            if not ok:
+                continue
+            self.stats.record(t0)
+            with self.cond:
+                self.jpeg = jpeg.tobytes()
+                self.seq += 1
+                self.cond.notify_all()
+
+    def stream(self):
+        with self.cond:
+            self.viewers += 1
+            self.cond.notify_all()
+        try:
+            last_seq = 0
+            while self.proc.running:
+                with self.cond:
+                    self.cond.wait_for(
+                        lambda: (not self.proc.running
+                                 or self.seq != last_seq),
+                        timeout=1.0)
+                    if self.seq == last_seq:
+                        continue
+                    last_seq = self.seq
+                    jpeg = self.jpeg
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n'
+                       + jpeg + b'\r\n')
+        finally:
+            with self.cond:
+                self.viewers -= 1
+
+    def to_dict(self):
+        d = self.stats.to_dict()
+        d["viewers"] = self.viewers
+        return d
+
+
+# ============================================================
+
+
+class SubjectTrack:
+    """多人模式下单个受试者: 关键点跟踪 / ROI / 样本缓冲 / 心率结果"""
+
+    def __init__(self, track_id, pts, lock):
+        self.track_id = track_id
+        self.pts = pts
+        self.tracker = LandmarkTracker()
+        self.is_primary = False
+        self.missed = 0
+        self.rgb_buffer = RingBuffer(BUFFER_SIZE, 3, lock=lock)
+        self.time_buffer = RingBuffer(BUFFER_SIZE, lock=lock)
+        self.rect = None
+        self.skin_ratio = 0.0
+        self.hr = 0.0
+        self.quality = 0.0
+
+    @property
+    def center(self):
+        return self.pts.mean(axis=0)
+
+    @property
+    def width(self):
+        return float(self.pts[:, 0].max() - self.pts[:, 0].min())
+
+    def to_dict(self):
+        return {
+            "id": self.track_id,
+            "primary": self.is_primary,
+            "hr": round(self.hr, 1),
+            "quality": round(self.quality, 0),
+            "skin_ratio": round(self.skin_ratio, 2),
+            "buffer": len(self.rgb_buffer),
+            "rect": [int(v) for v in self.rect] if self.rect else None}
+
+
+# ============================================================
+
+
 class RPPGProcessor:
-    def __init__(self, camera_id=0):
+    def __init__(self, camera_id=0, log_file='rppg_log.csv'):
         self.camera_id = camera_id
         self.camera_url = None
         self.cap = None
-        self.logger = DataLogger()
-        self.rgb_buffer = []
-        self.time_buffer = []
-        self.hr_raw_history = []
-        self.hr_output_history = []
+        self.logger = DataLogger(log_file)
+        # 可重入锁: 与各 RingBuffer 共享, 持锁时仍可 append
+        self.lock = threading.RLock()
+        self.rgb_buffer = RingBuffer(BUFFER_SIZE, 3, lock=self.lock)
+        self.time_buffer = RingBuffer(BUFFER_SIZE, lock=self.lock)
+        self.pos_engine = POSEngine(POS_WINDOW)
+        self.hr_stream = StreamingHREstimator(
+            window=BUFFER_SIZE - POS_WINDOW + 1,
+            f_min=HR_MIN_FREQ, f_max=HR_MAX_FREQ,
+            bw_low=BW_LOW, bw_high=BW_HIGH, order=BW_ORDER,
+            median_kernel=MEDIAN_KERNEL, min_samples=POS_WINDOW * 2)
+        self.hr_stream_quality = 0.0
+        self.hr_raw_history = RingBuffer(HR_MEDIAN_WIN * 3, lock=self.lock)
+        self.hr_output_history = RingBuffer(120, lock=self.lock)
         self.pulse_history = []
         self.hr = 0.0
         self._hr_internal = 0.0
@@ -132,12 +390,36 @@ class RPPGProcessor:
         self.last_hr_fft = 0.0
         self.last_hr_peak = 0.0
         self.hr_method = "--"
-        self.lock = threading.Lock()
         self.running = True
         self.switch_lock = threading.Lock()
         self.switch_event = threading.Event()
         self.switch_target = None
         self.last_landmarks = None
+        # FaceMesh 发布 (关键点, 所在帧灰度图), 采集线程据此重置跟踪器
+        self.mesh_update = None
+        self._mesh_applied = None
+        self.tracker = LandmarkTracker()
+        self.primary_pts = None
+        self.primary_roi = None     # 主路径本帧 extract_fused_rgb 结果, 多人模式复用
+        self.landmark_client = None
+        self.landmark_remote_hits = 0
+        # 多人模式: FaceMesh 发布 (全部人脸, 灰度图, 主受试者下标)
+        self.subjects = {}
+        self.next_track_id = 1
+        self.mesh_faces = None
+        self._faces_applied = None
+        self.subject_ticks = 0
+        # 三级流水线: 采集线程 → 关键点线程 (最新帧) / DSP 线程 (样本队列)
+        self.frame_cond = threading.Condition()
+        self.latest_frame = None
+        self.frame_seq = 0
+        self.landmark_seq = 0
+        self.sample_queue = queue.Queue(maxsize=DSP_QUEUE_SIZE)
+        self.video = MJPEGBroadcaster(self)
+        self.stage_stats = {
+            "capture": StageStats(),
+            "landmark": StageStats(),
+            "dsp": StageStats()}
 
     # -------------------- 摄像头管理 --------------------
 
@@ -196,21 +478,37 @@ class RPPGProcessor:
         w = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         h = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         print(f"[OK] 分辨率: {w}x{h}")
+        self.init_models()
+        print("[OK] 融合: peak 为主(60%), FFT 辅助(40%)")
+        print("[OK] EMA/限幅: 根据信号质量动态调整")
+        print(f"[OK] 显示: 每{DISPLAY_UPDATE_SEC:.0f}s刷新")
+        threading.Thread(target=self._switch_worker, daemon=True).start()
+        for worker in (self._capture_worker, self._landmark_worker,
+                       self._dsp_worker):
+            threading.Thread(target=worker, daemon=True).start()
+        self.video.start()
+        print("[OK] 流水线: 采集 / FaceMesh / DSP 三线程")
+        print("[OK] 视频流: 有观众才绘制 HUD, JPEG 每帧编码一次共享")
+
+    def init_models(self):
         self.face_mesh = mp.solutions.face_mesh.FaceMesh(
             static_image_mode=False,
-            max_num_faces=1,
+            max_num_faces=MAX_FACES if MULTI_FACE else 1,
             refine_landmarks=False,
             min_detection_confidence=0.3,
             min_tracking_confidence=0.3)
         print("[OK] FaceMesh (468 关键点, 简单矩形 ROI)")
-        print("[OK] 融合: peak 为主(60%), FFT 辅助(40%)")
-        print("[OK] EMA/限幅: 根据信号质量动态调整")
-        print(f"[OK] 显示: 每{DISPLAY_UPDATE_SEC:.0f}s刷新")
-        threading.Thread(target=self._switch_worker, daemon=True).start()
+        if LANDMARK_SOURCE == 'emotion':
+            self.landmark_client = LandmarkClient(
+                LANDMARK_URL, full=True, max_age=LANDMARK_MAX_AGE).start()
+            print(f"[OK] 关键点优先取自 emotion: {LANDMARK_URL}")
 
     def stop(self):
         self.running = False
         self.switch_event.set()
+        with self.frame_cond:
+            self.frame_cond.notify_all()
+        self.video.stop()
         if self.cap and self.cap.isOpened():
             self.cap.release()
         self.logger._flush()
@@ -247,14 +545,26 @@ class RPPGProcessor:
                         print("[ERROR] 无法打开本地摄像头")
 
     def _reset_state(self):
-        self.rgb_buffer.clear()
-        self.time_buffer.clear()
-        self.hr_raw_history.clear()
-        self.hr_output_history.clear()
-        self.pulse_history.clear()
+        while True:
+            try:
+                self.sample_queue.get_nowait()
+            except queue.Empty:
+                break
+        with self.lock:
+            self.rgb_buffer.clear()
+            self.time_buffer.clear()
+            self.pos_engine.reset()
+            self.hr_stream.reset()
+            self.hr_stream_quality = 0.0
+            self.hr_raw_history.clear()
+            self.hr_output_history.clear()
+            self.pulse_history = []
         self.prev_roi_gray = None
         self.prev_roi_brightness = None
         self.last_landmarks = None
+        self.mesh_update = None
+        self.mesh_faces = None
+        self.subjects = {}
         self.all_roi_rects = []
         self.display_roi_rect = None
         self.best_skin_ratio = 0.0
@@ -279,17 +589,15 @@ class RPPGProcessor:
     # [V9.2] ROI: 简单可靠方案
     # ================================================================
 
-    def define_rois_from_mesh(self, frame, landmarks):
+    def define_rois_from_mesh(self, frame, pts):
+        """pts: (468, 2) 像素坐标关键点"""
         h, w = frame.shape[:2]
-        pts = landmarks.landmark
-        xs = [lm.x * w for lm in pts]
-        ys = [lm.y * h for lm in pts]
-        face_x1, face_x2 = int(min(xs)), int(max(xs))
-        face_y1, face_y2 = int(min(ys)), int(max(ys))
+        face_x1, face_y1 = (int(v) for v in pts.min(axis=0))
+        face_x2, face_y2 = (int(v) for v in pts.max(axis=0))
         face_w = face_x2 - face_x1
         face_h = face_y2 - face_y1
-        brow_y = int((pts[159].y + pts[145].y) / 2 * h)
-        nose_x = int(pts[4].x * w)
+        brow_y = int((pts[159, 1] + pts[145, 1]) / 2)
+        nose_x = int(pts[4, 0])
 
         def safe(x1, y1, x2, y2):
             x1, y1 = max(0, x1), max(0, y1)
@@ -333,21 +641,62 @@ class RPPGProcessor:
 
     def compute_skin_ratio(self, roi_bgr):
         hsv = cv2.cvtColor(roi_bgr, cv2.COLOR_BGR2HSV)
-        mask = cv2.inRange(hsv, np.array([0, 15, 40]), np.array([30, 255, 255]))
+        mask = cv2.inRange(hsv, SKIN_HSV_LOW, SKIN_HSV_HIGH)
         return np.sum(mask > 0) / mask.size
 
+    @staticmethod
+    def _rect_sum(table, x1, y1, x2, y2):
+        return (table[y2, x2] - table[y1, x2]
+                - table[y2, x1] + table[y1, x1])
+
+    def _roi_stats_tables(self, frame, roi_list):
+        """对所有 ROI 的外接框只做一次 HSV + 皮肤掩码, 建积分图:
+        皮肤计数 / 皮肤像素 BGR 和 / 全部像素 BGR 和。
+        """
+        bx1 = min(r[1][0] for r in roi_list)
+        by1 = min(r[1][1] for r in roi_list)
+        bx2 = max(r[1][2] for r in roi_list)
+        by2 = max(r[1][3] for r in roi_list)
+        crop = frame[by1:by2, bx1:bx2]
+        hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+        skin = (cv2.inRange(hsv, SKIN_HSV_LOW, SKIN_HSV_HIGH) > 0) \
+            .astype(np.uint8)
+        skin_sat = cv2.integral(skin)
+        all_sat = cv2.integral(crop)
+        masked_sat = cv2.integral(crop * skin[..., None]) \
+            if SKIN_MASKED_MEAN else None
+        return (bx1, by1), skin_sat, all_sat, masked_sat
+
     # -------------------- 多 ROI 融合 --------------------
 
     def extract_fused_rgb(self, frame, roi_list):
         candidates = []
         all_rects = []
+        roi_list = [r for r in roi_list
+                    if (r[1][2] - r[1][0]) * (r[1][3] - r[1][1])
+                    >= MIN_ROI_PIXELS]
+        if not roi_list:
+            return None, None, 0.0, 0, {}, []
+        (ox, oy), skin_sat, all_sat, masked_sat = \
+            self._roi_stats_tables(frame, roi_list)
         for name, rect, weight in roi_list:
             x1, y1, x2, y2 = rect
-            roi = frame[y1:y2, x1:x2]
-            if roi.shape[0] * roi.shape[1] < MIN_ROI_PIXELS:
-                continue
-            skin_ratio = self.compute_skin_ratio(roi)
-            mean_rgb = np.mean(roi.reshape(-1, 3), axis=0)[::-1].copy()
+            lx1, ly1, lx2, ly2 = x1 - ox, y1 - oy, x2 - ox, y2 - oy
+            area = (x2 - x1) * (y2 - y1)
+            n_skin = int(self._rect_sum(skin_sat, lx1, ly1, lx2, ly2))
+            skin_ratio = n_skin / area
+            mean_bgr = self._rect_sum(all_sat, lx1, ly1, lx2, ly2) / area
+            if masked_sat is not None and n_skin > 0:
+                # 皮肤像素数在 MIN_SKIN_PIXELS 附近时按比例混合皮肤均值与整框均值,
+                # 避免阈值两侧硬切换在 RGB 轨迹上产生阶跃 (POS 会把它当成脉搏频带能量)
+                alpha = float(np.clip(
+                    (n_skin - MIN_SKIN_PIXELS / 2) / (MIN_SKIN_PIXELS * 1.5),
+                    0.0, 1.0))
+                if alpha > 0:
+                    masked = self._rect_sum(
+                        masked_sat, lx1, ly1, lx2, ly2) / n_skin
+                    mean_bgr = alpha * masked + (1 - alpha) * mean_bgr
+            mean_rgb = np.asarray(mean_bgr, dtype=np.float64)[::-1].copy()
             candidates.append({
                 "name": name, "rect": (x1, y1, x2, y2),
                 "mean_rgb": mean_rgb, "skin_ratio": skin_ratio,
@@ -421,56 +770,23 @@ class RPPGProcessor:
     # -------------------- POS 投影 --------------------
 
     def pos_extract(self, rgb_signals):
-        N = POS_WINDOW
-        T = len(rgb_signals)
-        if T <= N:
+        # 整段批量计算; 实时路径用 self.pos_engine 只算新增尾部
+        if len(rgb_signals) <= POS_WINDOW:
             return None
-        rgb = np.array(rgb_signals, dtype=np.float64)
-        h1 = np.array([1.0, -1.0, 0.0]) / np.sqrt(2.0)
-        h2 = np.array([1.0, 1.0, -2.0]) / np.sqrt(6.0)
-        pulse = np.zeros(T - N + 1)
-        for i in range(T - N + 1):
-            window = rgb[i:i + N]
-            centered = window - np.mean(window, axis=0)
-            p1 = centered @ h1
-            p2 = centered @ h2
-            s1, s2 = np.std(p1), np.std(p2)
-            pulse[i] = p1[-1] + (s1 / s2) * p2[-1] \
-                if s2 > 1e-8 else p1[-1]
-        return pulse
+        return pos_batch(rgb_signals, POS_WINDOW)
 
     # -------------------- 信号处理 --------------------
 
+    # 实现见 rppg_dsp: ndimage 中值 / 闭式去趋势 / 按 (fs, 阶数) 缓存的滤波器
+
     def median_filter(self, signal, kernel=5):
-        if len(signal) < kernel:
-            return signal
-        half = kernel // 2
-        padded = np.pad(signal, half, mode='edge')
-        out = np.empty_like(signal)
-        for i in range(len(signal)):
-            out[i] = np.median(padded[i:i + kernel])
-        return out
+        return median_filter(signal, kernel)
 
     def detrend(self, signal):
-        signal = signal - np.mean(signal)
-        if len(signal) < 3:
-            return signal
-        x = np.arange(len(signal), dtype=np.float64)
-        return signal - np.polyval(np.polyfit(x, signal, 1), x)
+        return detrend(signal)
 
     def butter_bandpass(self, signal, fs):
-        nyq = 0.5 * fs
-        if nyq <= 0:
-            return signal
-        low = max(0.001, BW_LOW / nyq)
-        high = min(0.999, BW_HIGH / nyq)
-        if high <= low:
-            return signal
-        try:
-            b, a = butter(BW_ORDER, [low, high], btype='band')
-            return filtfilt(b, a, signal)
-        except Exception:
-            return signal
+        return butter_bandpass(signal, fs, BW_LOW, BW_HIGH, BW_ORDER)
 
     # -------------------- FFT + 抛物线插值 --------------------
 
@@ -498,21 +814,13 @@ class RPPGProcessor:
         if not np.any(mask):
             return 0.0, 0.0
         hr_mags = mags[mask]
-        hr_freqs = freqs[mask]
         peak_idx = np.argmax(hr_mags)
-        if 0 < peak_idx < len(hr_freqs) - 1:
-            a = np.log(hr_mags[peak_idx - 1] + 1e-10)
-            b = np.log(hr_mags[peak_idx] + 1e-10)
-            g = np.log(hr_mags[peak_idx + 1] + 1e-10)
-            denom = a - 2 * b + g
-            if abs(denom) > 1e-10:
-                p = 0.5 * (a - g) / denom
-                peak_freq = hr_freqs[peak_idx - 1] + \
-                    p * (hr_freqs[peak_idx] - hr_freqs[peak_idx - 1])
-            else:
-                peak_freq = hr_freqs[peak_idx]
-        else:
-            peak_freq = hr_freqs[peak_idx]
+        # 偏移相对峰值频点 (与批量 / 流式同一公式); 邻点取整个频谱, 频带边缘的峰也能插值
+        k = int(np.argmax(mask)) + peak_idx
+        peak_freq = freqs[k]
+        if 0 < k < len(freqs) - 1:
+            peak_freq += float(peak_offset(
+                mags[k - 1], mags[k], mags[k + 1])) * (freqs[1] - freqs[0])
         hr_bpm = peak_freq * 60.0
         quality = np.clip(
             (hr_mags[peak_idx] / (np.mean(hr_mags) + 1e-10)) * 12, 0, 100)
@@ -542,7 +850,7 @@ class RPPGProcessor:
         peaks, _ = find_peaks(signal, distance=min_dist, height=0)
         if len(peaks) < 3:
             return 0.0, 0.0
-        peak_times = np.array([valid_ts[-n + p] for p in peaks])
+        peak_times = np.asarray(valid_ts)[peaks]
         rr = np.diff(peak_times)
         med_rr = np.median(rr)
         if med_rr <= 0:
@@ -558,10 +866,29 @@ class RPPGProcessor:
             hr_bpm = 0.0
         return hr_bpm, quality
 
+    # -------------------- 流式 FFT 支路 --------------------
+
+    def _update_hr_stream(self, pulse, timestamps):
+        # 只把 POS 新增的尾部样本推入流式估计器, 每帧开销 O(频点数)
+        n_new = self.pos_engine.n_new
+        if n_new <= 0:
+            # 没有新样本; pulse[-0:] 会是整个缓冲区, 重复推入会破坏滑动 DFT
+            return
+        for v, t in zip(pulse[-n_new:], timestamps[-n_new:]):
+            self.hr_stream.push(v, t)
+        hr_fft, q_fft = self.hr_stream.estimate()
+        with self.lock:
+            self.actual_fs = self.hr_stream.fs
+            self.last_hr_fft = hr_fft
+            self.hr_stream_quality = q_fft
+
     # -------------------- [V9.2] peak 优先融合 --------------------
 
     def estimate_hr_combined(self, pulse, timestamps):
-        hr_fft, q_fft = self.estimate_hr_fft(pulse, timestamps)
+        if HR_STREAMING:
+            hr_fft, q_fft = self.last_hr_fft, self.hr_stream_quality
+        else:
+            hr_fft, q_fft = self.estimate_hr_fft(pulse, timestamps)
         hr_peak, q_peak = self.estimate_hr_peak(pulse, timestamps)
         self.last_hr_fft = hr_fft
         self.last_hr_peak = hr_peak
@@ -621,11 +948,9 @@ class RPPGProcessor:
         if quality < 15:
             return self._hr_internal
         self.hr_raw_history.append(raw_hr)
-        if len(self.hr_raw_history) > HR_MEDIAN_WIN * 3:
-            self.hr_raw_history.pop(0)
         if len(self.hr_raw_history) >= HR_MEDIAN_WIN:
             hr_med = float(np.median(
-                self.hr_raw_history[-HR_MEDIAN_WIN:]))
+                self.hr_raw_history.view(HR_MEDIAN_WIN)))
         else:
             hr_med = raw_hr
         if self._hr_internal > 0 and self.last_hr_time > 0:
@@ -649,7 +974,7 @@ class RPPGProcessor:
 
     # -------------------- 诊断 --------------------
 
-    def get_diagnostics(self):
+    def get_diagnostics(self, detail=False):
         diags = []
         if not self.face_detected:
             diags.append("FACE_PARTIAL" if self.bbox_lost
@@ -666,165 +991,485 @@ class RPPGProcessor:
             diags.append("BUFFERING")
         else:
             diags.append("OK")
-        return diags
+        if not detail:
+            return diags
+        # 各阶段耗时 / 队列深度, 用于定位掉帧发生在哪一级
+        pending = self.frame_seq - self.landmark_seq
+        return {
+            "codes": diags,
+            "stages": {
+                "capture": self.stage_stats["capture"].to_dict(),
+                "landmark": self.stage_stats["landmark"].to_dict(
+                    max(0, pending)),
+                "dsp": self.stage_stats["dsp"].to_dict(
+                    self.sample_queue.qsize()),
+                "encode": self.video.to_dict(),
+            },
+            "landmark_source": {"mode": LANDMARK_SOURCE,
+                                "remote_hits": self.landmark_remote_hits}}
 
     # -------------------- FaceMesh 检测 --------------------
 
-    def _handle_face_detection(self, frame, rgb_frame):
-        if self.processed_frames % DETECT_INTERVAL == 0:
-            results = self.face_mesh.process(rgb_frame)
-            if results.multi_face_landmarks:
-                self.last_landmarks = results.multi_face_landmarks[0]
+    def _remote_faces(self, shape):
+        """emotion 的检测结果 (前 468 点, 按本帧尺寸缩放) 及其主受试者; 不可用返回 None"""
+        ff = self.landmark_client.get(shape) if self.landmark_client else None
+        if ff is None:
+            return None
+        faces = [f.lm[:468] for f in ff.faces if len(f.lm) >= 468]
+        if len(faces) != len(ff.faces):
+            return None
+        self.landmark_remote_hits += 1
+        primary = ff.primary if 0 <= ff.primary < len(faces) else 0
+        if not faces:
+            return faces, -1
+        # 先选后截: 主受试者排在最前, 单人模式只保留它, 多人模式保证它不被 MAX_FACES 截掉
+        faces = [faces[primary]] + faces[:primary] + faces[primary + 1:]
+        return faces[:MAX_FACES if MULTI_FACE else 1], 0
+
+    def _detect_faces(self, rgb_frame):
+        """返回 ([(468, 2) 关键点], 主受试者下标)"""
+        remote = self._remote_faces(rgb_frame.shape)
+        if remote is not None:
+            faces, primary = remote
+            if faces and not 0 <= primary < len(faces):
+                primary = 0
+            return faces, primary
+        results = self.face_mesh.process(rgb_frame)
+        if not results.multi_face_landmarks:
+            return [], -1
+        h, w = rgb_frame.shape[:2]
+        faces = [np.array([(lm.x * w, lm.y * h) for lm in f.landmark],
+                          dtype=np.float32)
+                 for f in results.multi_face_landmarks]
+        # 主受试者取最大的脸 (离屏幕最近)
+        primary = int(np.argmax(
+            [np.ptp(f[:, 0]) * np.ptp(f[:, 1]) for f in faces]))
+        return faces, primary
+
+    def _handle_face_detection(self, rgb_frame, gray=None):
+        # 只发布关键点和人脸状态; ROI 相关状态由采集阶段自己清理
+        faces, primary = self._detect_faces(rgb_frame)
+        if faces:
+            pts = faces[primary]
+            self.last_landmarks = pts
+            if gray is not None:
+                self.mesh_update = (pts, gray)
+            if MULTI_FACE:
+                self.mesh_faces = (faces, gray, primary)
+            self.face_detected = True
+            self.face_confidence = 0.8
+            self.bbox_lost = False
+            self.bbox_lost_frames = 0
+        else:
+            if (self.last_landmarks is not None
+                    and self.bbox_lost_frames < BBOX_RETAIN_FRAMES):
+                self.bbox_lost_frames += 1
+                self.bbox_lost = True
                 self.face_detected = True
-                self.face_confidence = 0.8
+                self.face_confidence = max(
+                    0, self.face_confidence - 0.03)
+            else:
+                self.last_landmarks = None
+                self.face_detected = False
                 self.bbox_lost = False
                 self.bbox_lost_frames = 0
-            else:
-                if (self.last_landmarks is not None
-                        and self.bbox_lost_frames < BBOX_RETAIN_FRAMES):
-                    self.bbox_lost_frames += 1
-                    self.bbox_lost = True
-                    self.face_detected = True
-                    self.face_confidence = max(
-                        0, self.face_confidence - 0.03)
-                else:
-                    self.last_landmarks = None
-                    self.face_detected = False
-                    self.bbox_lost = False
-                    self.bbox_lost_frames = 0
-                    self.all_roi_rects = []
-                    self.display_roi_rect = None
-                    self.current_roi_name = "none"
-                    self.best_skin_ratio = 0
-                    self.active_roi_count = 0
-                    self.fusion_weights = {}
-                    self.prev_roi_gray = None
-                    self.prev_roi_brightness = None
+            if MULTI_FACE:
+                self.mesh_faces = ([], gray, -1)
+
+    def _clear_roi_state(self):
+        self.all_roi_rects = []
+        self.display_roi_rect = None
+        self.current_roi_name = "none"
+        self.best_skin_ratio = 0
+        self.active_roi_count = 0
+        self.fusion_weights = {}
+        self.prev_roi_gray = None
+        self.prev_roi_brightness = None
+
+    # -------------------- 流水线: 采集 → 关键点 → DSP --------------------
+
+    def _capture_worker(self):
+        """阶段1: 读帧, 用最新关键点提取 ROI 颜色, 样本入 DSP 队列。"""
+        while self.running:
+            try:
+                with self.switch_lock:
+                    cap = self.cap
+                    if cap is None or not cap.isOpened():
+                        ret, frame = False, None
+                    else:
+                        ret, frame = cap.read()
+                if cap is None or not ret:
+                    time.sleep(0.05 if cap is None else 0.01)
+                    continue
+                t0 = time.perf_counter()
+                now = time.time()
+                self._publish_frame(frame)
+                sample = self._roi_stage(frame, now)
+                if sample is not None:
+                    self._enqueue_sample(sample)
+                self.stage_stats["capture"].record(t0)
+            except Exception as e:
+                print(f"[ERROR] capture: {repr(e)}")
+                time.sleep(0.01)
+
+    def _publish_frame(self, frame):
+        with self.frame_cond:
+            self.latest_frame = frame
+            self.frame_seq += 1
+            self.frame_cond.notify_all()
+
+    def _enqueue_sample(self, sample):
+        # 队列满时丢弃最老样本, 采集线程永不阻塞
+        try:
+            self.sample_queue.put_nowait(sample)
+        except queue.Full:
+            try:
+                self.sample_queue.get_nowait()
+                self.stage_stats["dsp"].dropped += 1
+            except queue.Empty:
+                pass
+            self.sample_queue.put_nowait(sample)
+
+    def _landmark_worker(self):
+        """阶段2: 每 DETECT_INTERVAL 帧对最新帧跑一次 FaceMesh, 跳过积压帧。"""
+        while self.running:
+            with self.frame_cond:
+                self.frame_cond.wait_for(
+                    lambda: (not self.running
+                             or self.frame_seq - self.landmark_seq
+                             >= DETECT_INTERVAL),
+                    timeout=0.5)
+                if self.frame_seq - self.landmark_seq < DETECT_INTERVAL:
+                    continue
+                frame = self.latest_frame
+                skipped = self.frame_seq - self.landmark_seq - DETECT_INTERVAL
+                self.landmark_seq = self.frame_seq
+            if frame is None:
+                continue
+            t0 = time.perf_counter()
+            try:
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) \
+                    if LANDMARK_TRACKING else None
+                self._handle_face_detection(rgb_frame, gray)
+            except Exception as e:
+                print(f"[ERROR] landmark: {repr(e)}")
+            stats = self.stage_stats["landmark"]
+            stats.dropped += skipped
+            stats.record(t0)
+
+    def _dsp_worker(self):
+        """阶段3: 消费 (时间戳, 融合 RGB) 样本, 更新缓冲区和心率估计。"""
+        while self.running:
+            try:
+                sample = self.sample_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            t0 = time.perf_counter()
+            try:
+                self._dsp_stage(*sample)
+            except Exception as e:
+                print(f"[ERROR] dsp: {repr(e)}")
+            self.stage_stats["dsp"].record(t0)
 
     # -------------------- 单帧处理 --------------------
 
-    def process_frame(self, frame):
-        now = time.time()
+    def process_frame(self, frame, now=None):
+        """同步执行三个阶段 (不经过线程和队列), 用于离线回放/调试。
+        now: 帧时间戳, 回放时传入录制时的原始时间戳。
+        """
+        now = time.time() if now is None else now
+        self.processed_frames += 1
+        if self.processed_frames % DETECT_INTERVAL == 0:
+            t0 = time.perf_counter()
+            self._handle_face_detection(
+                cv2.cvtColor(frame, cv2.COLOR_BGR2RGB),
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                if LANDMARK_TRACKING else None)
+            self.stage_stats["landmark"].record(t0)
+        t0 = time.perf_counter()
+        sample = self._roi_stage(frame, now)
+        self.stage_stats["capture"].record(t0)
+        if sample is not None:
+            t0 = time.perf_counter()
+            self._dsp_stage(*sample)
+            self.stage_stats["dsp"].record(t0)
+        return frame
+
+    def _roi_stage(self, frame, now):
+        """ROI 提取 + 运动/光照门控, 返回待入队的样本或 None。"""
         self.frame_count += 1
         elapsed = now - self.last_fps_time
-        if elapsed >= 1.0:
+        if elapsed < 0:
+            # 回放时间戳与墙钟不同源, 首帧对齐
+            self.last_fps_time = now
+            self.frame_count = 1
+        elif elapsed >= 1.0:
             self.fps = self.frame_count / elapsed
             self.frame_count = 0
             self.last_fps_time = now
-        self.processed_frames += 1
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        self._handle_face_detection(frame, rgb_frame)
-
-        if self.last_landmarks is not None:
-            roi_list = self.define_rois_from_mesh(
-                frame, self.last_landmarks)
-            result = self.extract_fused_rgb(frame, roi_list)
-            if result[0] is not None:
-                (fused_rgb, best_rect, best_skin,
-                 active_cnt, weights, all_rects) = result
-                self.all_roi_rects = all_rects
-                self.display_roi_rect = best_rect
-                self.current_roi_name = "fused"
-                self.best_skin_ratio = round(best_skin, 2)
-                self.active_roi_count = active_cnt
-                self.fusion_weights = weights
-                best_roi = frame[
-                    best_rect[1]:best_rect[3],
-                    best_rect[0]:best_rect[2]]
-                roi_gray = cv2.cvtColor(best_roi, cv2.COLOR_BGR2GRAY)
-                self.detect_lighting_change(roi_gray)
-                self.motion_score = self.detect_motion(roi_gray)
-
-                if self.motion_score > self.motion_threshold:
-                    self.motion_frames += 1
-                    if self.motion_frames >= MOTION_PATIENCE:
-                        self.signal_paused = True
-                        self.paused_reason = "motion"
-                else:
-                    if self.motion_frames > 0:
-                        self.motion_frames = max(
-                            0, self.motion_frames - 1)
-                    if self.motion_frames == 0:
-                        self.signal_paused = False
-                        self.paused_reason = ""
-
-                if not self.signal_paused:
-                    with self.lock:
-                        self.rgb_buffer.append(fused_rgb)
-                        self.time_buffer.append(now)
-                        if len(self.rgb_buffer) > BUFFER_SIZE:
-                            self.rgb_buffer.pop(0)
-                            self.time_buffer.pop(0)
-
-                    if (len(self.rgb_buffer) >= MIN_BUFFER_COMPUTE
-                            and self.processed_frames % COMPUTE_INTERVAL == 0):
-                        with self.lock:
-                            buf_snap = list(self.rgb_buffer)
-                            ts_snap = list(self.time_buffer)
-
-                        pulse = self.pos_extract(np.array(buf_snap))
-                        if (pulse is not None
-                                and len(pulse) > POS_WINDOW * 2):
-                            hr_raw, quality, method = \
-                                self.estimate_hr_combined(
-                                    pulse, ts_snap)
-                            if self.light_change_detected:
-                                quality *= 0.7
-                            if hr_raw > 0:
-                                self._hr_internal = \
-                                    self.apply_hr_limits(
-                                        hr_raw, quality, now)
-
-                            with self.lock:
-                                self.signal_quality = quality
-                                self.hr_method = method
-
-                                if (now - self.last_display_update
-                                        >= DISPLAY_UPDATE_SEC):
-                                    candidate = self._hr_internal
-                                    # [FIX] 使用动态限幅替代固定值
-                                    max_chg = self._get_max_display_change(
-                                        quality)
-                                    if (self.hr > 0
-                                            and abs(candidate - self.hr)
-                                            > max_chg):
-                                        candidate = self.hr + \
-                                            np.sign(candidate - self.hr) \
-                                            * max_chg
-                                    # hr==0 时不限幅，直接赋值
-                                    self.hr = candidate
-                                    self.last_display_update = now
-                                    self.hr_output_history.append(
-                                        round(candidate, 1))
-                                    if len(self.hr_output_history) > 120:
-                                        self.hr_output_history.pop(0)
-
-                                if len(pulse) > 48:
-                                    p = pulse[-128:].copy()
-                                    p = self.median_filter(p, 3)
-                                    p = self.detrend(p)
-                                    ps = np.std(p)
-                                    if ps > 1e-8:
-                                        p = p / ps
-                                    self.pulse_history = p.tolist()
-
-                                self.logger.log(
-                                    self._hr_internal, quality,
-                                    method, best_skin,
-                                    self.motion_score, self.fps,
-                                    method, self.last_hr_peak,
-                                    self.last_hr_fft)
-                        else:
-                            with self.lock:
-                                self.signal_quality *= 0.9
+
+        gray = None
+        if LANDMARK_TRACKING and (self.last_landmarks is not None
+                                  or self.subjects):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        primary = self._primary_roi(frame, gray)
+        subjects = self._update_subjects(frame, gray) if MULTI_FACE \
+            else None
+        if primary is None and not subjects:
+            return None
+        fused_rgb, best_skin, light_change = \
+            primary if primary is not None else (None, 0.0, False)
+        return (now, fused_rgb, best_skin, light_change, subjects)
+
+    def _primary_roi(self, frame, gray):
+        """主受试者: ROI 提取 + 运动/光照门控, 返回 (融合 RGB, 皮肤率, 光照变化) 或 None。"""
+        landmarks = self.last_landmarks
+        if landmarks is None:
+            if self.all_roi_rects or self.prev_roi_gray is not None:
+                self._clear_roi_state()
+            self.tracker.clear()
+            self._mesh_applied = None
+            self.primary_pts = None
+            self.primary_roi = None
+            return None
+
+        if gray is not None:
+            landmarks = self._track_landmarks(gray, landmarks)
+        self.primary_pts = landmarks
+
+        roi_list = self.define_rois_from_mesh(frame, landmarks)
+        result = self.extract_fused_rgb(frame, roi_list)
+        self.primary_roi = result if result[0] is not None else None
+        if result[0] is None:
+            self._clear_roi_state()
+            return None
+        (fused_rgb, best_rect, best_skin,
+         active_cnt, weights, all_rects) = result
+        self.all_roi_rects = all_rects
+        self.display_roi_rect = best_rect
+        self.current_roi_name = "fused"
+        self.best_skin_ratio = round(best_skin, 2)
+        self.active_roi_count = active_cnt
+        self.fusion_weights = weights
+        x1, y1, x2, y2 = best_rect
+        if gray is not None:
+            roi_gray = gray[y1:y2, x1:x2]
+        else:
+            roi_gray = cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+        self.detect_lighting_change(roi_gray)
+        self.motion_score = self.detect_motion(roi_gray)
+
+        if self.motion_score > self.motion_threshold:
+            self.motion_frames += 1
+            if self.motion_frames >= MOTION_PATIENCE:
+                self.signal_paused = True
+                self.paused_reason = "motion"
+        else:
+            if self.motion_frames > 0:
+                self.motion_frames = max(
+                    0, self.motion_frames - 1)
+            if self.motion_frames == 0:
+                self.signal_paused = False
+                self.paused_reason = ""
+
+        if self.signal_paused:
+            return None
+        return (fused_rgb, best_skin, self.light_change_detected)
+
+    def _track_landmarks(self, gray, landmarks):
+        update = self.mesh_update
+        if update is not None and update is not self._mesh_applied:
+            self._mesh_applied = update
+            self.tracker.reset(update[1], update[0])
+        # 跟踪失败时沿用上一次成功跟踪的位置
+        self.tracker.track(gray)
+        return self.tracker.pts if self.tracker.pts is not None \
+            else landmarks
+
+    # -------------------- 多人模式 --------------------
+
+    def _associate_subjects(self, faces, gray, primary_idx):
+        """FaceMesh 结果与已有轨迹按中心距离贪心匹配, 未匹配的新建轨迹。
+        在副本上增删后整体替换 self.subjects, DSP/HTTP 侧读到的总是完整的字典。
+        """
+        subjects = dict(self.subjects)
+        centers = [f.mean(axis=0) for f in faces]
+        unmatched = set(range(len(faces)))
+        for sub in sorted(subjects.values(), key=lambda s: s.track_id):
+            best, best_d = None, None
+            max_d = sub.width * SUBJECT_MATCH_RATIO
+            for i in unmatched:
+                d = float(np.linalg.norm(centers[i] - sub.center))
+                if d < max_d and (best_d is None or d < best_d):
+                    best, best_d = i, d
+            if best is None:
+                sub.missed += 1
+                sub.is_primary = False
+                continue
+            unmatched.discard(best)
+            sub.missed = 0
+            sub.pts = faces[best]
+            sub.is_primary = best == primary_idx
+            if gray is not None:
+                sub.tracker.reset(gray, faces[best])
+        for i in sorted(unmatched):
+            sub = SubjectTrack(self.next_track_id, faces[i], self.lock)
+            sub.is_primary = i == primary_idx
+            if gray is not None:
+                sub.tracker.reset(gray, faces[i])
+            subjects[sub.track_id] = sub
+            self.next_track_id += 1
+        for tid in [t for t, s in subjects.items()
+                    if s.missed > SUBJECT_MAX_MISSED]:
+            del subjects[tid]
+        with self.lock:
+            self.subjects = subjects
+
+    def _update_subjects(self, frame, gray):
+        """逐人推进关键点并提取融合 RGB, 返回 {track_id: rgb}。
+        主受试者直接复用主路径已跟踪的关键点和提取结果, 不重复跑光流和 ROI 提取。
+        """
+        update = self.mesh_faces
+        if update is not None and update is not self._faces_applied:
+            self._faces_applied = update
+            self._associate_subjects(*update)
+        samples = {}
+        for sub in list(self.subjects.values()):
+            if sub.is_primary and self.primary_pts is not None:
+                sub.pts = self.primary_pts
+                result = self.primary_roi
+                if result is None:
+                    continue
             else:
-                self.all_roi_rects = []
-                self.display_roi_rect = None
-                self.current_roi_name = "none"
-                self.best_skin_ratio = 0
-                self.active_roi_count = 0
-                self.fusion_weights = {}
-        return frame
+                if gray is not None:
+                    sub.tracker.track(gray)
+                    if sub.tracker.pts is not None:
+                        sub.pts = sub.tracker.pts
+                result = self.extract_fused_rgb(
+                    frame, self.define_rois_from_mesh(frame, sub.pts))
+                if result[0] is None:
+                    continue
+            sub.rect = result[1]
+            sub.skin_ratio = result[2]
+            samples[sub.track_id] = result[0]
+        return samples
+
+    def _dsp_subjects(self, now, samples):
+        with self.lock:
+            for tid, rgb in samples.items():
+                sub = self.subjects.get(tid)
+                if sub is not None:
+                    sub.rgb_buffer.append(rgb)
+                    sub.time_buffer.append(now)
+        self.subject_ticks += 1
+        if self.subject_ticks % COMPUTE_INTERVAL == 0:
+            self._estimate_subjects()
+
+    def _estimate_subjects(self):
+        """所有缓冲足够的受试者取相同长度尾部, 一次 POS + 一次批量 FFT。"""
+        ready = [s for s in list(self.subjects.values())
+                 if len(s.rgb_buffer) >= MIN_BUFFER_COMPUTE]
+        if not ready:
+            return
+        with self.lock:
+            n = min(len(s.rgb_buffer) for s in ready)
+            rgb = np.stack([s.rgb_buffer.view(n) for s in ready])
+            dts = [np.median(np.diff(s.time_buffer.view(n))) for s in ready]
+        dt = float(np.median(dts))
+        if dt <= 0.005 or dt > 0.15:
+            return
+        pulses = pos_batch(rgb, POS_WINDOW)
+        hrs, quals = estimate_hr_fft_batch(
+            pulses, 1.0 / dt, HR_MIN_FREQ, HR_MAX_FREQ,
+            BW_LOW, BW_HIGH, BW_ORDER, MEDIAN_KERNEL)
+        with self.lock:
+            for sub, hr, q in zip(ready, hrs, quals):
+                sub.quality = float(q)
+                if hr > 0 and q >= 15:
+                    sub.hr = float(hr) if sub.hr <= 0 else \
+                        SUBJECT_EMA_ALPHA * float(hr) \
+                        + (1 - SUBJECT_EMA_ALPHA) * sub.hr
+
+    def get_subjects(self):
+        with self.lock:
+            return [s.to_dict() for s in sorted(
+                list(self.subjects.values()), key=lambda s: s.track_id)]
+
+    def _dsp_stage(self, now, fused_rgb, best_skin, light_change,
+                   subjects=None):
+        if subjects:
+            self._dsp_subjects(now, subjects)
+        if fused_rgb is not None:
+            self._dsp_primary(now, fused_rgb, best_skin, light_change)
+
+    def _dsp_primary(self, now, fused_rgb, best_skin, light_change):
+        with self.lock:
+            self.rgb_buffer.append(fused_rgb)
+            self.time_buffer.append(now)
+
+        compute_tick = (
+            len(self.rgb_buffer) >= MIN_BUFFER_COMPUTE
+            and self.rgb_buffer.total % COMPUTE_INTERVAL == 0)
+        pulse = None
+        if HR_STREAMING or compute_tick:
+            # 零拷贝视图: 缓冲区只由 DSP 阶段写入, 视图在本次调用内有效
+            with self.lock:
+                buf_snap = self.rgb_buffer.view()
+                ts_snap = self.time_buffer.view()
+                total = self.rgb_buffer.total
+            pulse = self.pos_engine.update(buf_snap, total)
+        if HR_STREAMING and pulse is not None:
+            self._update_hr_stream(pulse, ts_snap)
+
+        if not compute_tick:
+            return
+        if pulse is None or len(pulse) <= POS_WINDOW * 2:
+            with self.lock:
+                self.signal_quality *= 0.9
+            return
+
+        hr_raw, quality, method = \
+            self.estimate_hr_combined(pulse, ts_snap)
+        if light_change:
+            quality *= 0.7
+        if hr_raw > 0:
+            self._hr_internal = \
+                self.apply_hr_limits(hr_raw, quality, now)
+
+        with self.lock:
+            self.signal_quality = quality
+            self.hr_method = method
+
+            if (now - self.last_display_update
+                    >= DISPLAY_UPDATE_SEC):
+                candidate = self._hr_internal
+                # [FIX] 使用动态限幅替代固定值
+                max_chg = self._get_max_display_change(quality)
+                if (self.hr > 0
+                        and abs(candidate - self.hr) > max_chg):
+                    candidate = self.hr + \
+                        np.sign(candidate - self.hr) * max_chg
+                # hr==0 时不限幅，直接赋值
+                self.hr = candidate
+                self.last_display_update = now
+                self.hr_output_history.append(round(candidate, 1))
+
+            if len(pulse) > 48:
+                p = pulse[-128:].copy()
+                p = self.median_filter(p, 3)
+                p = self.detrend(p)
+                ps = np.std(p)
+                if ps > 1e-8:
+                    p = p / ps
+                self.pulse_history = p.tolist()
+
+            self.logger.log(
+                self._hr_internal, quality,
+                method, best_skin,
+                self.motion_score, self.fps,
+                method, self.last_hr_peak,
+                self.last_hr_fft)
 
     # -------------------- HUD --------------------
 
@@ -846,6 +1491,16 @@ class RPPGProcessor:
             cv2.putText(frame, f"{ROI_LABELS.get(name, name)} {skin_r:.0%}",
                         (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.32,
                         color, 1)
+        if len(self.subjects) > 1:
+            for sub in list(self.subjects.values()):
+                if sub.rect is None:
+                    continue
+                x1, y1 = sub.rect[0], sub.rect[1]
+                label = f"#{sub.track_id} " + (
+                    f"{sub.hr:.0f}" if sub.hr > 0 else "--")
+                cv2.putText(frame, label, (x1, max(10, y1 - 18)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.45,
+                            (255, 255, 255), 1)
         if self.hr > 0:
             hr_str = f"{self.hr:.0f} BPM"
             if self.signal_paused:
@@ -905,10 +1560,8 @@ class RPPGProcessor:
 # Flask
 # ============================================================
 
-processor = RPPGProcessor()
-processor.camera_url = None
-processor.camera_id = CAMERA_ID_DEFAULT
-processor.start()
+# 只在直接运行时创建并启动 (打开摄像头); rppg_replay.py 会 import 本模块
+processor = None
 
 
 @app.route('/')
@@ -922,33 +1575,8 @@ def index():
 
 @app.route('/video_feed')
 def video_feed():
-    def generate():
-        while processor.running:
-            try:
-                with processor.switch_lock:
-                    cap = processor.cap
-                if cap is None or not cap.isOpened():
-                    time.sleep(0.05)
-                    continue
-                ret, frame = cap.read()
-                if not ret:
-                    time.sleep(0.01)
-                    continue
-                frame = processor.process_frame(frame)
-                frame = processor.draw_hud(frame)
-                ok, jpeg = cv2.imencode(
-                    '.jpg', frame,
-                    [cv2.IMWRITE_JPEG_QUALITY, 80])
-                if not ok:
-                    continue
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n'
-                       + jpeg.tobytes() + b'\r\n')
-            except Exception as e:
-                print(f"[ERROR] {repr(e)}")
-                time.sleep(0.01)
-                continue
-    return Response(generate(),
+    # HUD 绘制与 JPEG 编码由 processor.video 统一完成, 各客户端共享
+    return Response(processor.video.stream(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
@@ -979,6 +1607,7 @@ def api_camera():
 @app.route('/api/hr')
 def get_hr():
     with processor.lock:
+        diag = processor.get_diagnostics(detail=True)
         return jsonify({
             'hr': round(processor.hr, 1),
             'quality': round(processor.signal_quality, 0),
@@ -986,7 +1615,7 @@ def get_hr():
             'fps': round(processor.fps, 1),
             'buffer': len(processor.rgb_buffer),
             'buffer_max': BUFFER_SIZE,
-            'hr_history': processor.hr_output_history[-80:],
+            'hr_history': processor.hr_output_history.view(80).tolist(),
             'pulse': processor.pulse_history[-120:]
             if processor.pulse_history else [],
             'roi_name': processor.current_roi_name,
@@ -1000,7 +1629,9 @@ def get_hr():
             'hr_method': processor.hr_method,
             'hr_fft': round(processor.last_hr_fft, 1),
             'hr_peak': round(processor.last_hr_peak, 1),
-            'diagnostics': processor.get_diagnostics()})
+            'subjects': processor.get_subjects(),
+            'diagnostics': diag['codes'],
+            'pipeline': diag['stages']})
 
 
 @app.errorhandler(Exception)
@@ -1009,6 +1640,10 @@ def handle_all_errors(e):
 
 
 if __name__ == '__main__':
+    processor = RPPGProcessor()
+    processor.camera_url = None
+    processor.camera_id = CAMERA_ID_DEFAULT
+    processor.start()
     try:
         print("=" * 58)
         print("  rPPG Monitor V9.2")
@@ -0,0 +1,385 @@
+""" rPPG 信号处理工具
+1. POS 投影的批量/增量实现
+2. 信号调理: 向量化中值滤波, 闭式线性去趋势, 缓存的 Butterworth 系数
+3. 频谱峰值插值 (单路 / 批量 / 流式共用) 与多路批量 FFT (多人模式)
+4. 流式心率估计: 带状态 IIR 带通 + 滑动 DFT 频点组 (Hann 窗)
+供 rppg.py 的 RPPGProcessor 使用; 流式估计器也用于 hlk_spectral (雷达相位)。
+"""
+from collections import deque
+from functools import lru_cache
+import numpy as np
+from scipy.ndimage import median_filter as _nd_median
+from scipy.signal import butter, filtfilt, sosfilt, sosfilt_zi
+
+# 滤波器缓存按该步长量化采样率, 避免 fs 微小抖动导致缓存失效
+FS_QUANT = 0.1
+
+# POS 投影平面 (Wang et al. 2017)
+POS_H1 = np.array([1.0, -1.0, 0.0]) / np.sqrt(2.0)
+POS_H2 = np.array([1.0, 1.0, -2.0]) / np.sqrt(6.0)
+
+
+# -------------------- POS 投影 --------------------
+
+def _window_tail_stats(x, window):
+    """沿最后一维计算每个长度为 window 的滑窗:
+    (窗口末样本 - 窗口均值, 窗口标准差)。
+    用累积和求一阶/二阶矩, 先减全局均值避免大数相消。
+    """
+    x = x - np.mean(x, axis=-1, keepdims=True)
+    pad = np.zeros(x.shape[:-1] + (1,), dtype=np.float64)
+    c1 = np.concatenate([pad, np.cumsum(x, axis=-1)], axis=-1)
+    c2 = np.concatenate([pad, np.cumsum(x * x, axis=-1)], axis=-1)
+    mean = (c1[..., window:] - c1[..., :-window]) / window
+    var = (c2[..., window:] - c2[..., :-window]) / window - mean * mean
+    std = np.sqrt(np.maximum(var, 0.0))
+    return x[..., window - 1:] - mean, std
+
+
+def pos_batch(rgb, window):
+    """一次性计算整段脉搏波。
+    rgb: (..., T, 3), 返回 (..., T - window + 1),
+    第 i 个值对应以样本 i + window - 1 结尾的窗口, 与逐窗循环版本逐点一致。
+    """
+    rgb = np.asarray(rgb, dtype=np.float64)
+    T = rgb.shape[-2]
+    if T < window:
+        return np.zeros(rgb.shape[:-2] + (0,), dtype=np.float64)
+    last1, s1 = _window_tail_stats(rgb @ POS_H1, window)
+    last2, s2 = _window_tail_stats(rgb @ POS_H2, window)
+    valid = s2 > 1e-8
+    ratio = np.divide(s1, s2, out=np.zeros_like(s1), where=valid)
+    return np.where(valid, last1 + ratio * last2, last1)
+
+
+class POSEngine:
+    """增量 POS: 只为上次调用之后新增的样本计算脉搏值。
+    每个脉搏值只依赖其所在窗口, 因此拼接结果与整段重算完全相同。
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.pulse = np.zeros(0, dtype=np.float64)
+        self.n_new = 0          # 最近一次 update 新增的脉搏值个数
+        self._consumed = 0      # 已投影的样本累计数
+
+    def reset(self):
+        self.pulse = np.zeros(0, dtype=np.float64)
+        self.n_new = 0
+        self._consumed = 0
+
+    def update(self, rgb, total):
+        """rgb: 当前缓冲区 (T, 3); total: 缓冲区自创建以来累计写入的样本数。
+        返回与 rgb 尾部对齐的脉搏波 (T - window + 1,), T <= window 时返回 None。
+        """
+        T = len(rgb)
+        if T <= self.window:
+            return None
+        n_out = T - self.window + 1
+        n_new = total - self._consumed
+        if n_new < 0 or n_new >= n_out or len(self.pulse) == 0:
+            self.pulse = pos_batch(rgb, self.window)
+            n_new = n_out
+        elif n_new > 0:
+            tail = pos_batch(rgb[-(n_new + self.window - 1):], self.window)
+            self.pulse = np.concatenate([self.pulse, tail])
+        self.pulse = self.pulse[-n_out:]
+        self.n_new = n_new
+        self._consumed = total
+        return self.pulse
+
+
+# -------------------- 信号调理 --------------------
+
+def median_filter(signal, kernel=5):
+    """滑动中值, 边缘按最近值延拓 (与逐点 np.pad(mode='edge') 版本一致)。"""
+    if len(signal) < kernel:
+        return signal
+    return _nd_median(np.asarray(signal, dtype=np.float64),
+                      size=kernel, mode='nearest')
+
+
+@lru_cache(maxsize=16)
+def _detrend_basis(n):
+    """长度 n 的中心化时间轴及其平方和 (正规方程的常数项)。"""
+    x = np.arange(n, dtype=np.float64) - (n - 1) / 2.0
+    x.flags.writeable = False
+    return x, float(np.dot(x, x))
+
+
+def detrend(signal):
+    """去均值 + 去线性趋势, 闭式最小二乘, 不再每次 polyfit。
+    沿最后一维计算, 支持 (..., n) 多路信号。
+    """
+    signal = np.asarray(signal, dtype=np.float64)
+    signal = signal - np.mean(signal, axis=-1, keepdims=True)
+    n = signal.shape[-1]
+    if n < 3:
+        return signal
+    x, sxx = _detrend_basis(n)
+    slope = np.asarray(signal @ x / sxx)
+    return signal - slope[..., None] * x
+
+
+def _quantize_fs(fs):
+    return round(fs / FS_QUANT) * FS_QUANT
+
+
+def _band_edges(fs, low, high):
+    nyq = 0.5 * fs
+    if nyq <= 0:
+        return None
+    lo = max(0.001, low / nyq)
+    hi = min(0.999, high / nyq)
+    if hi <= lo:
+        return None
+    return lo, hi
+
+
+@lru_cache(maxsize=32)
+def _bandpass_ba_cached(fs, low, high, order):
+    edges = _band_edges(fs, low, high)
+    if edges is None:
+        return None
+    return butter(order, list(edges), btype='band')
+
+
+@lru_cache(maxsize=32)
+def _bandpass_sos_cached(fs, low, high, order):
+    edges = _band_edges(fs, low, high)
+    if edges is None:
+        return None
+    return butter(order, list(edges), btype='band', output='sos')
+
+
+def bandpass_ba(fs, low, high, order):
+    return _bandpass_ba_cached(_quantize_fs(fs), low, high, order)
+
+
+def bandpass_sos(fs, low, high, order):
+    return _bandpass_sos_cached(_quantize_fs(fs), low, high, order)
+
+
+def butter_bandpass(signal, fs, low, high, order):
+    """零相位带通, 系数按 (fs, 阶数) 缓存。"""
+    try:
+        ba = bandpass_ba(fs, low, high, order)
+        if ba is None:
+            return signal
+        return filtfilt(ba[0], ba[1], signal)
+    except Exception:
+        return signal
+
+
+# -------------------- 频谱峰值插值 --------------------
+
+def peak_offset(left, peak, right):
+    """对数幅度三点抛物线插值: 返回真实峰相对峰值频点的偏移 (单位为频点间隔, -0.5~0.5),
+    峰值频率 = freqs[峰值下标] + 偏移 * 频点间隔。单路 / 批量 / 流式心率估计共用, 支持数组。
+    """
+    a = np.log(np.asarray(left, dtype=np.float64) + 1e-10)
+    b = np.log(np.asarray(peak, dtype=np.float64) + 1e-10)
+    g = np.log(np.asarray(right, dtype=np.float64) + 1e-10)
+    denom = a - 2 * b + g
+    ok = np.abs(denom) > 1e-10
+    return np.where(ok, 0.5 * (a - g) / np.where(ok, denom, 1.0), 0.0)
+
+
+# -------------------- 多路批量 FFT --------------------
+
+def estimate_hr_fft_batch(pulses, fs, f_min, f_max, bw_low, bw_high,
+                          order, median_kernel=5):
+    """多路脉搏波 (S, n) 共用采样率 fs, 一次完成
+    中值 → 去趋势 → 带通 → Hann 窗 FFT → peak_offset 插值 (邻点取整个频谱)。
+    返回 (hr_bpm (S,), quality (S,)); 窗函数、插值和质量分与单路 estimate_hr_fft 相同,
+    同一段脉搏波结果一致 (rppg_replay.py --parity)。
+    """
+    pulses = np.atleast_2d(np.asarray(pulses, dtype=np.float64))
+    S, n = pulses.shape
+    zeros = np.zeros(S)
+    if n < 8 or fs <= 0:
+        return zeros, zeros.copy()
+    x = _nd_median(pulses, size=(1, median_kernel), mode='nearest') \
+        if n >= median_kernel else pulses
+    x = detrend(x)
+    ba = bandpass_ba(fs, bw_low, bw_high, order)
+    if ba is not None:
+        try:
+            x = filtfilt(ba[0], ba[1], x, axis=-1)
+        except ValueError:
+            pass
+    flat = np.std(x, axis=-1) < 1e-8
+    freqs = np.fft.rfftfreq(n, d=1.0 / fs)
+    mags = np.abs(np.fft.rfft(x * np.hanning(n), axis=-1))
+    mask = (freqs >= f_min) & (freqs <= f_max)
+    if np.count_nonzero(mask) < 3:
+        return zeros, zeros.copy()
+    band_mags = mags[:, mask]
+    rows = np.arange(S)
+    # 峰值在频带内找, 插值邻点取整个频谱 (频点下标 k)
+    k = int(np.argmax(mask)) + np.argmax(band_mags, axis=1)
+    interior = (k > 0) & (k < mags.shape[1] - 1)
+    left = np.clip(k - 1, 0, mags.shape[1] - 1)
+    right = np.clip(k + 1, 0, mags.shape[1] - 1)
+    p = np.where(interior, peak_offset(mags[rows, left], mags[rows, k],
+                                       mags[rows, right]), 0.0)
+    hr = (freqs[k] + p * (freqs[1] - freqs[0])) * 60.0
+    quality = np.clip(
+        mags[rows, k] / (np.mean(band_mags, axis=1) + 1e-10) * 12, 0, 100)
+    out_of_range = (hr < 45) | (hr > 180)
+    quality = np.where(out_of_range, quality * 0.1, quality)
+    hr = np.where(out_of_range, 0.0, hr)
+    hr[flat] = 0.0
+    quality[flat] = 0.0
+    return hr, quality
+
+
+# -------------------- 流式心率估计 --------------------
+
+
+class StreamingHREstimator:
+    """逐样本更新的心率估计器, 在计算 tick 之间保留全部状态:
+    因果中值 → EMA 去趋势 → 带 zi 的 sosfilt 带通 → 滑动 DFT 频点组 → Hann 窗 → peak_offset 插值。
+    频点组用样本真实时间戳做相位参考 (对帧率抖动不敏感),
+    新样本加入、最老样本移出, 每个样本开销 O(频点数)。
+    Hann 窗 (与 np.hanning 相同) 展开为 0.5 - 0.25·e^{+jkm} - 0.25·e^{-jkm} (k = 2π/(N-1), m 为窗内位置),
+    另维护两组按全局样本序号调制的累加和, estimate() 时按最老样本序号换算到窗内位置组合即可;
+    窗未填满时直接对已有样本加长度为样本数的 Hann 窗。
+    dt_range / rate_range: 接受的采样间隔 (秒) 和输出频率范围 (次/分),
+    默认值对应摄像头心率; hlk_spectral 用同一实现估计雷达心率/呼吸率。
+    """
+
+    FS_STEP = 0.5           # 采样率变化超过该量化步长才重新设计滤波器
+
+    def __init__(self, window, f_min, f_max, bw_low, bw_high, order=3,
+                 median_kernel=5, min_samples=None, step_hz=1.0 / 60.0,
+                 dt_range=(0.005, 0.15), rate_range=(45.0, 180.0)):
+        self.window = window
+        self.dt_range = dt_range
+        self.rate_range = rate_range
+        self.min_samples = min_samples or window
+        self.bw = (bw_low, bw_high, order)
+        self.freqs = np.arange(f_min, f_max + 1e-9, step_hz)
+        self._rot = -2j * np.pi * self.freqs
+        self._hann_k = 2.0 * np.pi / max(window - 1, 1)
+        self._median_kernel = median_kernel
+        self.reset()
+
+    def reset(self):
+        self.fs = 0.0
+        self._dt = None
+        self._last_ts = None
+        self._t0 = None
+        self._med = deque(maxlen=self._median_kernel)
+        self._baseline = None
+        self._fs_key = None
+        self._sos = None
+        self._zi = None
+        self._contrib = np.zeros((self.window, len(self.freqs)),
+                                 dtype=np.complex128)
+        self._acc = np.zeros(len(self.freqs), dtype=np.complex128)
+        self._acc_p = np.zeros(len(self.freqs), dtype=np.complex128)   # Σ c_i·e^{+jki}
+        self._acc_m = np.zeros(len(self.freqs), dtype=np.complex128)   # Σ c_i·e^{-jki}
+        self._idx = 0
+        self._count = 0
+
+    def push(self, x, ts):
+        if self._last_ts is not None:
+            dt = ts - self._last_ts
+            if self.dt_range[0] < dt < self.dt_range[1]:
+                self._dt = dt if self._dt is None else \
+                    0.9 * self._dt + 0.1 * dt
+        self._last_ts = ts
+        if self._dt is None:
+            return
+        self.fs = 1.0 / self._dt
+
+        self._med.append(float(x))
+        y = float(np.median(self._med)) \
+            if len(self._med) == self._median_kernel else float(x)
+        if self._baseline is None:
+            self._baseline = y
+        self._baseline += (y - self._baseline) * 2.0 / (self.window + 1)
+        y -= self._baseline
+
+        fs_key = round(self.fs / self.FS_STEP) * self.FS_STEP
+        if fs_key != self._fs_key:
+            self._fs_key = fs_key
+            self._sos = bandpass_sos(fs_key, *self.bw)
+            self._zi = sosfilt_zi(self._sos) * y \
+                if self._sos is not None else None
+        if self._sos is not None:
+            out, self._zi = sosfilt(self._sos, [y], zi=self._zi)
+            y = out[0]
+
+        if self._t0 is None:
+            self._t0 = ts
+        c = y * np.exp(self._rot * (ts - self._t0))
+        old = self._contrib[self._idx]
+        # 新样本全局序号 i = _count, 被移出的是 i - window (未填满时 old 为零)
+        e_new = self._hann_phase(self._count)
+        e_old = self._hann_phase(self._count - self.window)
+        self._acc += c - old
+        self._acc_p += c * e_new - old * e_old
+        self._acc_m += c * e_new.conjugate() - old * e_old.conjugate()
+        self._contrib[self._idx] = c
+        self._idx += 1
+        self._count += 1
+        if self._idx == self.window:
+            # 每滑过一个窗口, 用环形缓存重新求和, 消除加减累积误差; 此时槽 j 对应序号 _count - window + j
+            self._idx = 0
+            self._acc = self._contrib.sum(axis=0)
+            e = self._hann_phase(self._count - self.window + np.arange(self.window))
+            self._acc_p = e @ self._contrib
+            self._acc_m = e.conjugate() @ self._contrib
+
+    def _hann_phase(self, i):
+        return np.exp(1j * self._hann_k * (np.asarray(i) % max(self.window - 1, 1)))
+
+    def _spectrum(self):
+        """当前窗口加 Hann 窗后的频点组幅度, 与 estimate_hr_fft 对同一段样本加 np.hanning(n) 一致"""
+        if self._count >= self.window:
+            ph = self._hann_phase(self._count - self.window).conjugate()
+            spec = 0.5 * self._acc - 0.25 * ph * self._acc_p \
+                - 0.25 * ph.conjugate() * self._acc_m
+        else:
+            spec = np.hanning(self._count) @ self._contrib[:self._count]
+        return np.abs(spec)
+
+    def estimate(self):
+        """返回 (hr_bpm, quality), 与 estimate_hr_fft 同一窗函数 (Hann) 和插值 (peak_offset)。"""
+        if self._count < self.min_samples or self.fs <= 0:
+            return 0.0, 0.0
+        mags = self._spectrum()
+        if not np.any(mags > 1e-10):
+            return 0.0, 0.0
+        peak_idx = int(np.argmax(mags))
+        peak_freq = self.freqs[peak_idx]
+        if 0 < peak_idx < len(mags) - 1:
+            peak_freq += float(peak_offset(mags[peak_idx - 1], mags[peak_idx],
+                                           mags[peak_idx + 1])) \
+                * (self.freqs[1] - self.freqs[0])
+        hr_bpm = peak_freq * 60.0
+        # 频点比 FFT 分辨率密, 按一个分辨率间隔抽样求均值, 保持质量分口径
+        n = min(self._count, self.window)
+        stride = max(1, int(round(
+            (self.fs / n) / (self.freqs[1] - self.freqs[0]))))
+        quality = float(np.clip(
+            mags[peak_idx] / (np.mean(mags[::stride]) + 1e-10) * 12,
+            0, 100))
+        if hr_bpm < self.rate_range[0] or hr_bpm > self.rate_range[1]:
+            quality *= 0.1
+            hr_bpm = 0.0
+        return hr_bpm, quality
+
+    def peak_snr(self):
+        """峰值信噪比 (dB): 峰值 ± 一个分辨率间隔内的平均功率 / 频带内其余频点的平均功率。
+        与带宽无关; 数据不足时返回 0.0。用未加窗的频点组 (hlk_spectral 的阈值按此标定)。"""
+        if self._count < self.min_samples or self.fs <= 0:
+            return 0.0
+        power = np.abs(self._acc) ** 2
+        peak = self.freqs[int(np.argmax(power))]
+        near = np.abs(self.freqs - peak) <= self.fs / min(self._count, self.window)
+        if near.all() or power[~near].mean() <= 1e-20:
+            return 0.0
+        return float(10.0 * np.log10(power[near].mean() / power[~near].mean()))